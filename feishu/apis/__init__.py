@@ -1,11 +1,13 @@
 from .base import BaseAPI, allow_async_call, get_or_create_event_loop
 from .auth import AuthAPI
-from .event import setup_event_blueprint
+from .event import setup_event_blueprint, EventReceiver
+from .dispatcher import EventDispatcher, OverflowPolicy
+from .router import Router
 from .feishu_api import FeishuAPI
 
 __all__ = [
     'BaseAPI', 'allow_async_call', 'get_or_create_event_loop',
     'FeishuAPI',
     'AuthAPI',
-    'setup_event_blueprint'
+    'setup_event_blueprint', 'EventReceiver', 'EventDispatcher', 'OverflowPolicy', 'Router'
 ]
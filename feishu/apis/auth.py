@@ -29,7 +29,7 @@ class AuthAPI(BaseAPI):
             "app_secret": self.client.app_secret,
         }
 
-        result = self.client.request("POST", api=api, payload=payload, auth=False)
+        result = self.client.request("POST", api=api, payload=payload, auth=False, idempotent=True)
 
         return result["app_access_token"], result["tenant_access_token"], result["expire"]
 
@@ -46,7 +46,7 @@ class AuthAPI(BaseAPI):
             "app_secret": self.client.app_secret,
         }
 
-        result = self.client.request("POST", api=api, payload=payload, auth=False)
+        result = self.client.request("POST", api=api, payload=payload, auth=False, idempotent=True)
         # 返回 Body ：
         # {
         #     "code": 0,
@@ -1,13 +1,18 @@
+import ast
 import asyncio
 import hashlib
+import importlib.util
 import inspect
-import linecache
 import logging
-import re
-import secrets
+import marshal
+import os
 import textwrap
 from asyncio import AbstractEventLoop
-from functools import wraps
+from functools import update_wrapper
+from types import MethodType, CodeType
+from typing import Optional
+
+from feishu import __version__
 
 __all__ = ['BaseAPI', 'allow_async_call', 'get_or_create_event_loop']
 
@@ -48,115 +53,213 @@ def get_or_create_event_loop() -> AbstractEventLoop:
 
 
 # ****************** @allow_async_call ******************
-to_be_created = {}
-context = {}
-# name -> newname
-# "= name(...)" -> "= await newname(...)"
-async_method_mapping = {
-    "self.client.request": "self.client.request",
-    "self.client.fetch": "self.client.fetch"
-}
+# 生成的async方法中需要await的client方法
+ASYNC_CLIENT_METHODS = ("request", "fetch")
+# 生成的async方法的字节码缓存目录, 默认不缓存; 设置环境变量FEISHU_CODEGEN_CACHE为目录后开启
+CODEGEN_CACHE_DIR = os.environ.get("FEISHU_CODEGEN_CACHE", "")
+# 本文件(AsyncTransformer等生成代码的逻辑)的hash, 修改后旧的缓存全部失效
+with open(__file__, "rb") as _f:
+    CODEGEN_HASH = hashlib.sha256(_f.read()).hexdigest()
+del _f
 
 
 def allow_async_call(func):
     """给同步方法加上被异步调用的能力
 
-    为了让异步调用中不会被同步方法卡住event_loop
+    为了让异步调用中不会被同步方法卡住event_loop, 在类定义时会根据同步方法的源码生成一个名为原方法+'_async'的
+    async版本: 其中的self.client.request(...)、self.client.fetch(...)以及对其他allow_async_call方法的调用
+    self.xxx(...)都会改成await self.client.request(...)、await self.xxx_async(...)。
+    client.run_async=True时, 调用原方法会返回async版本的asyncio.Future。
+
     加allow_async_call修饰的方法必须做到以下几点:
 
     - 方法中没有同步IO事件, 读写文件都最好不要有(本地磁盘且小文件问题不大)
-    - API请求用self.client.request, 且一定要写成xxxx = self.client.request这样的形式
-    - 通用HTTP请求用self.client.fetch, 且一定要携程yyyy = self.client.fetch这样的形式
+    - API请求用self.client.request, 通用HTTP请求用self.client.fetch
+    - 不能用到闭包变量和不带参数的super(), 生成的代码只能访问方法所在模块的全局变量
+    """
+    return AsyncCallable(func)
+
+
+class AsyncCallable:
+    """allow_async_call修饰后的方法"""
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.async_name = self.name + "_async"
+        update_wrapper(self, func)
+
+    def __set_name__(self, owner, name):
+        # 类定义时就生成async版本, 避免第一次调用时才生成
+        setattr(owner, self.async_name, create_async_api(owner, self.func))
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return MethodType(self, instance)
+
+    def __call__(self, api, *args, **kwargs):
+        if not api.client.run_async:
+            return self.func(api, *args, **kwargs)
+
+        if not api.client.event_loop or api.client.event_loop.is_closed():
+            api.client.event_loop = get_or_create_event_loop()
+        async_method = getattr(api, self.async_name, None)
+        if async_method is None:
+            # 不是在类定义中使用时不会触发__set_name__, 这里补上
+            setattr(api.__class__, self.async_name, create_async_api(api.__class__, self.func))
+            async_method = getattr(api, self.async_name)
+        return asyncio.ensure_future(async_method(*args, **kwargs), loop=api.client.event_loop)
+
+
+class AsyncTransformer(ast.NodeTransformer):
+    """把同步方法体中的调用改成await
+        ...                                             ...
+        x = self.client.request(...)          =>        x = await self.client.request(...)
+        return self.send(msg, ...)            =>        return await self.send_async(msg, ...)
+        ...                                             ...
+    """
+
+    def __init__(self, owner: type):
+        self.owner = owner
+
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        func = node.func
+        if not isinstance(func, ast.Attribute):
+            return node
+
+        if func.attr in ASYNC_CLIENT_METHODS and isinstance(func.value, ast.Attribute) \
+                and func.value.attr == "client" and is_self(func.value.value):
+            # self.client.request(...) / self.client.fetch(...)
+            pass
+        elif is_self(func.value) and \
+                isinstance(inspect.getattr_static(self.owner, func.attr, None), AsyncCallable):
+            # self.xxx(...), xxx同样被allow_async_call修饰
+            node.func = ast.Attribute(value=func.value, attr=func.attr + "_async", ctx=ast.Load())
+        else:
+            return node
+        return ast.Await(value=node)
+
+    def visit_FunctionDef(self, node):
+        # 嵌套的同步函数中不能await
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_Lambda = visit_FunctionDef
+
+
+def is_self(node: ast.AST) -> bool:
+    return isinstance(node, ast.Name) and node.id == "self"
+
+
+def create_async_api(owner: type, func):
+    """生成async版本的API, 名字为原方法+'_async'
+
+    设置了CODEGEN_CACHE_DIR时生成的字节码会缓存在其中, 下次启动时直接加载, 省掉解析和编译的时间
+    Args:
+        owner: 方法所在的类
+        func: 同步版本的函数
+    """
+    key = codegen_cache_key(owner, func)
+    code = load_cached_code(key)
+    if code is None:
+        code = compile_async_api(owner, func)
+        save_cached_code(key, code)
+
+    async_name = func.__name__ + "_async"
+    namespace = {}
+    exec(code, func.__globals__, namespace)
+    async_func = namespace[async_name]
+    async_func.__qualname__ = func.__qualname__ + "_async"
+    async_func.__module__ = func.__module__
+    return async_func
+
+
+def compile_async_api(owner: type, func) -> CodeType:
+    """根据同步方法的源码编译出定义async版本的代码"""
+    source = textwrap.dedent(inspect.getsource(func))
+    tree = ast.parse(source)
+    func_def = tree.body[0]
+
+    body = [AsyncTransformer(owner).visit(stmt) for stmt in func_def.body]
+    async_def = ast.AsyncFunctionDef(**{field: getattr(func_def, field, None) for field in func_def._fields})
+    async_def.name = func.__name__ + "_async"
+    async_def.body = body
+    async_def.decorator_list = []
+    tree.body = [ast.copy_location(async_def, func_def)]
+    ast.fix_missing_locations(tree)
+    # 行号和原文件对应, 出错时traceback能直接指向原方法
+    ast.increment_lineno(tree, func.__code__.co_firstlineno - 1)
+
+    filename = inspect.getsourcefile(func) or func.__code__.co_filename
+    return compile(tree, filename, mode="exec")
+
+
+# ****************** codegen cache ******************
+def codegen_cache_key(owner: type, func) -> str:
+    """缓存的key: 库版本、python字节码版本、本文件的hash、方法的字节码(含常量和行号, 源码改动都会体现)
+    以及会被改成await的同类方法; 不读源码, 命中缓存时不用再打开源文件
     """
+    siblings = [name for name in func.__code__.co_names
+                if isinstance(inspect.getattr_static(owner, name, None), AsyncCallable)]
+    h = hashlib.sha256()
+    for part in (__version__, importlib.util.MAGIC_NUMBER.hex(), CODEGEN_HASH, func.__qualname__,
+                 ",".join(siblings)):
+        h.update(part.encode())
+        h.update(b"\0")
+    update_code_hash(h, func.__code__)
+    return f"{func.__module__}.{func.__qualname__}.{h.hexdigest()[:32]}"
 
-    global context, async_method_mapping, to_be_created
-    name = func.__name__
-    newname = name + "_async"
-    async_method_mapping["self." + name] = "self." + newname
-
-    def create_async_api(func=func, name=name):
-        """生成async版本的API, 名字为原方法+'_async'
-
-        Args:
-            func: 同步版本的函数
-            name: 同步版本的函数名
-        """
-        # 用正则生成一下async版本的代码
-        # 注意，这个代码只在context中没有找到async代码时才会执行
-        # 这里更好的方案是用ast，但是太麻烦了——正则大部分时候ok就行
-        # def f(self, a):                             async f_async(self, a):
-        #     ...                                         ...
-        #     xxxx = self.client.request(...   =>         xxxx = await self.client.request(...
-        #     yyyy = self.client.fetch(...     =>         yyyy = await self.client.fetch(...
-        #     ...                                         ...
-        source = inspect.getsource(func)
-        source = textwrap.dedent(source)
-
-        # 加上async def
-        source2 = re.compile(r'def(\s*' + name + r')(\(.*?)->[^:]*:\s*\n\s{4}', re.DOTALL).sub(
-            r'async def\1_async\2-> "Future":\n    ', source)
-        if source2 == source:
-            source2 = re.compile(r'def(\s*' + name + r')(\(.*?)\):\s*\n\s{4}', re.DOTALL).sub(
-                r'async def\1_async\2) -> "Future":\n    ', source2)
-        source = source2
-
-        # 修改await, 目前就修改两种:
-        # - xxx = self.method
-        # - return self.method
-        for method, newmethod in async_method_mapping.items():
-            source = re.sub(r'\s{4}(\S+)\s*=\s*(' + re.escape(method) + r')(.*?\n*|\s{4})',
-                            r'    \1 = await ' + newmethod + r'\3',
-                            source)
-            source = re.sub(r' (\s*)return\s*(' + re.escape(method) + r')(.*?\n*|\s{4})',
-                            r' \1return await ' + newmethod + r'\3',
-                            source)
-        # 去掉decorator
-        source = re.sub(r'\s*@allow_async_call\s*\n', '', source)
-
-        # import各种依赖
-        insert = "" \
-                 "from typing import *\n" \
-                 "from feishu import *\n" \
-                 "from feishu.apis import *\n" \
-                 "from feishu.client import *\n" \
-                 "from feishu.models import *\n" \
-                 "from feishu.utils import *\n" \
-                 ""
-        source = insert + source
-        # 生成临时文件并预编译
-        # BaseAPI.logger.debug(f"自动生成的async版本API:{name} ---\n{source}")
-        filename = "api_" + secrets.token_hex(4) + ".py"
-        compiled = compile(source, filename, mode="exec")
-        linecache.cache[filename] = (len(source), None, [line + '\n' for line in source.splitlines()], filename)
-        exec(compiled, globals())
-
-        context[newname] = globals()[newname]
-
-    to_be_created[newname] = create_async_api
-
-    @wraps(func)
-    def wrapper(self, *args, **kwargs):
-        def create_async_apis():
-            for newname2, create in to_be_created.items():
-                create()
-                setattr(self.__class__, newname2, context[newname2])
-
-        if not hasattr(self.__class__, newname):
-            create_async_apis()
-
-        if not self.client.run_async or name == 'dummy':
-            return func(self, *args, **kwargs)
+
+def update_code_hash(h, code: CodeType):
+    h.update(code.co_filename.encode())
+    h.update(str(code.co_firstlineno).encode())
+    h.update(code.co_code)
+    h.update(getattr(code, "co_linetable", None) or code.co_lnotab)
+    h.update(repr((code.co_names, code.co_varnames)).encode())
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            update_code_hash(h, const)
         else:
-            # print("calling", self, newname, "args", args, "kwargs", kwargs)
-            if not self.client.event_loop or self.client.event_loop.is_closed():
-                self.client.event_loop = get_or_create_event_loop()
+            h.update(repr(const).encode())
+
 
-            if not hasattr(self, newname):
-                create_async_apis()
+def load_cached_code(key: str) -> Optional[CodeType]:
+    if not CODEGEN_CACHE_DIR:
+        return None
+    try:
+        with open(os.path.join(CODEGEN_CACHE_DIR, key + ".pyc"), "rb") as f:
+            data = f.read()
+        magic = importlib.util.MAGIC_NUMBER
+        if data[:len(magic)] == magic:
+            return marshal.loads(data[len(magic):])
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
+    return None
+
+
+def save_cached_code(key: str, code: CodeType):
+    if not CODEGEN_CACHE_DIR:
+        return
+    path = os.path.join(CODEGEN_CACHE_DIR, key + ".pyc")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CODEGEN_CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(importlib.util.MAGIC_NUMBER + marshal.dumps(code))
+        os.replace(tmp, path)
+        prune_cached_code(key)
+    except OSError as e:
+        BaseAPI.logger.debug(f"写入async API缓存失败: {e!r}")
 
-            return asyncio.ensure_future(
-                getattr(self, newname)(*args, **kwargs),
-                loop=self.client.event_loop
-            )
 
-    return wrapper
+def prune_cached_code(key: str):
+    """删除同一个方法的旧缓存"""
+    prefix = key.rsplit(".", 1)[0]
+    for name in os.listdir(CODEGEN_CACHE_DIR):
+        if name.endswith(".pyc") and name[:-4] != key and name[:-4].rsplit(".", 1)[0] == prefix:
+            try:
+                os.remove(os.path.join(CODEGEN_CACHE_DIR, name))
+            except OSError:
+                pass
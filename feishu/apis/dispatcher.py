@@ -0,0 +1,217 @@
+"""订阅事件调度
+有界队列 + 固定数量的worker协程, 代替每个事件一个asyncio.create_task
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import zlib
+from enum import Enum
+from typing import Optional, Callable, Awaitable, List, Tuple, Dict, TYPE_CHECKING
+
+from feishu.models import Event, ChatType
+
+if TYPE_CHECKING:
+    from feishu.client.metrics import MetricsRegistry
+
+__all__ = [
+    'EventDispatcher', 'OverflowPolicy', 'chat_key'
+]
+
+logger = logging.getLogger("feishu")
+
+
+class OverflowPolicy(str, Enum):
+    SHED = "shed"  # 队列满时直接丢弃事件
+    BLOCK = "block"  # 队列满时等待空位, 最多等待block_timeout秒, 仍然没有空位则丢弃
+    SPILL = "spill"  # 队列满时交给spill回调, e.g. 写入Redis/磁盘, 之后再处理
+
+
+def chat_key(event: Event) -> Optional[str]:
+    """消息事件按会话排序的key: 群聊为chat_id, 单聊为发送者的open_id; 其他事件返回None"""
+    message = getattr(event.event, "message", None)
+    if message is None:
+        return None
+    if message.chat_type == ChatType.P2P:
+        return event.event.sender.sender_id.open_id
+    return message.chat_id
+
+
+class EventDispatcher:
+    """有界的事件队列, 由workers个worker协程并发调用handler
+
+    队列满时按overflow处理, 保证推送请求能在飞书要求的3秒内回复;
+    lanes>0时按lane_key(默认为会话, 见chat_key)把事件分到lanes个串行的队列中:
+    同一个会话的事件按收到的顺序逐个处理, 不同会话的事件并行处理, 此时workers不生效
+
+    传入metrics时记录队列长度(event_queue_depth)、事件在队列中的等待时间(event_wait_seconds)、
+    handler耗时(event_handler_seconds), 以及event_shed、event_spilled、event_handler_error的次数;
+    lanes>0时还会记录排队事件最多的会话(event_chat_pending), 以及会话排队数超过hot_threshold的次数(event_hot_chat)
+    Usages::
+    >>> dispatcher = EventDispatcher(workers=8, max_queue=1000, overflow="shed", metrics=metrics)
+    >>> dispatcher = EventDispatcher(lanes=16, max_queue=1000, metrics=metrics)
+    >>> setup_event_blueprint("sanic", blueprint, path, on_event, dispatcher=dispatcher)
+    """
+
+    def __init__(self, handler: Optional[Callable[[Event], Awaitable[None]]] = None,
+                 workers: int = 16, max_queue: int = 1000,
+                 overflow: OverflowPolicy = OverflowPolicy.BLOCK, block_timeout: float = 1,
+                 spill: Optional[Callable[[Event], Awaitable[None]]] = None,
+                 metrics: Optional["MetricsRegistry"] = None,
+                 lanes: int = 0, lane_key: Callable[[Event], Optional[str]] = chat_key,
+                 hot_threshold: int = 50, hot_top: int = 10):
+        """
+        Args:
+            handler: 处理事件的协程函数, 为None时使用setup_event_blueprint的on_event
+            workers: worker协程数, 即同时处理的事件数上限
+            max_queue: 队列长度上限, lanes>0时平均分给每个lane
+            overflow: 队列满时的处理方式, 见OverflowPolicy
+            block_timeout: overflow=block时最多等待几秒, 需小于飞书的3秒超时
+            spill: overflow=spill时接收溢出事件的协程函数
+            metrics: 记录队列指标的MetricsRegistry
+            lanes: 串行lane的个数, 0表示不保证顺序
+            lane_key: 事件的排序key, 相同key的事件进入同一个lane(crc32取模); 返回None的事件轮流分配
+            hot_threshold: 一个会话排队的事件超过多少个时视为热点会话
+            hot_top: metrics中记录排队事件最多的前几个会话
+        """
+        overflow = OverflowPolicy(overflow)
+        if overflow == OverflowPolicy.SPILL and spill is None:
+            raise ValueError("overflow=spill时需要提供spill")
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.spill = spill
+        self.metrics = metrics
+        self.lanes = lanes
+        self.lane_key = lane_key
+        self.hot_threshold = hot_threshold
+        self.hot_top = hot_top
+        # (放入队列的时间, 排序key, 事件), 在第一次submit时创建, 绑定当时运行的event_loop
+        self.queues: List["asyncio.Queue[Tuple[float, Optional[str], Event]]"] = []
+        self.tasks: List[asyncio.Task] = []
+        # 排序key -> 排队中(含正在处理)的事件数, 处理完归零时删除, 大小不超过队列长度
+        self.pending: Dict[str, int] = {}
+        self._round_robin = itertools.count()
+        if metrics:
+            metrics.register_gauge("event_queue_depth", self.qsize)
+            if lanes:
+                metrics.register_gauge("event_chat_pending", lambda: dict(self.hot_chats(self.hot_top)))
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def hot_chats(self, n: int = 10) -> List[Tuple[str, int]]:
+        """排队事件最多的n个会话, [(排序key, 排队的事件数)]"""
+        return heapq.nlargest(n, self.pending.items(), key=lambda item: item[1])
+
+    def lane(self, key: Optional[str]) -> int:
+        """key所在的lane, 只和key有关, 进程重启后也不变"""
+        if key is None:
+            return next(self._round_robin) % self.lanes
+        return zlib.crc32(key.encode()) % self.lanes
+
+    def start(self):
+        """在当前运行的event_loop中启动worker, 第一次submit时自动调用"""
+        if self.tasks:
+            return
+        if self.handler is None:
+            raise RuntimeError("EventDispatcher没有设置handler")
+        if self.lanes:
+            size = max(self.max_queue // self.lanes, 1)
+            self.queues = [asyncio.Queue(size) for _ in range(self.lanes)]
+            self.tasks = [asyncio.create_task(self._work(queue)) for queue in self.queues]
+        else:
+            self.queues = [asyncio.Queue(self.max_queue)]
+            self.tasks = [asyncio.create_task(self._work(self.queues[0])) for _ in range(self.workers)]
+
+    async def submit(self, event: Event) -> bool:
+        """把事件放入队列
+        Returns:
+            bool: 是否放入了队列, 被丢弃或spill时为False
+        """
+        if not self.tasks:
+            self.start()
+        if self.lanes:
+            key = self.lane_key(event)
+            queue = self.queues[self.lane(key)]
+        else:
+            key, queue = None, self.queues[0]
+        item = (time.perf_counter(), key, event)
+        # 先计数再入队, 避免worker处理完时还没有计数
+        self._enqueued(key)
+        try:
+            queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow == OverflowPolicy.BLOCK:
+            try:
+                await asyncio.wait_for(queue.put(item), self.block_timeout)
+                return True
+            except asyncio.TimeoutError:
+                pass
+        self._dequeued(key)
+        if self.overflow == OverflowPolicy.SPILL:
+            self._record("event_spilled")
+            await self.spill(event)
+            return False
+        logger.warning("事件队列已满(%d), 丢弃事件", queue.maxsize)
+        self._record("event_shed")
+        return False
+
+    async def stop(self, timeout: Optional[float] = 10):
+        """等待队列中的事件处理完(最多timeout秒)后停止worker, 超时后没有处理的事件被丢弃"""
+        if not self.tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("停止时还有%d个事件没有处理", self.qsize())
+        tasks, self.tasks = self.tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 丢弃剩下的事件, 否则qsize、hot_chats和metrics中的gauge会一直保留停止前的值
+        self.queues = []
+        self.pending.clear()
+
+    def _enqueued(self, key: Optional[str]):
+        if key is None:
+            return
+        count = self.pending[key] = self.pending.get(key, 0) + 1
+        if count == self.hot_threshold:
+            logger.warning("会话%s有%d个事件在排队", key, count)
+            self._record("event_hot_chat")
+
+    def _dequeued(self, key: Optional[str]):
+        if key is None:
+            return
+        # stop之后还在等待入队的submit超时时, pending已经被清空
+        count = self.pending.pop(key, 0) - 1
+        if count > 0:
+            self.pending[key] = count
+
+    async def _work(self, queue: asyncio.Queue):
+        metrics = self.metrics
+        while True:
+            enqueued, key, event = await queue.get()
+            started = time.perf_counter()
+            try:
+                await self.handler(event)
+            except Exception:
+                logger.exception("处理事件出错")
+                self._record("event_handler_error")
+            finally:
+                queue.task_done()
+                self._dequeued(key)
+                if metrics:
+                    metrics.observe("event_wait_seconds", started - enqueued)
+                    metrics.observe("event_handler_seconds", time.perf_counter() - started)
+
+    def _record(self, name: str):
+        if self.metrics:
+            self.metrics.record_event(name)
@@ -2,24 +2,32 @@
 包含订阅事件的sanic blueprint实现
 """
 import asyncio
-import json
 import logging
+import re
 from pydantic import ValidationError
-from sanic import Blueprint, response
-from sanic.request import Request
-from typing import Optional, Callable, Awaitable, Union
+from typing import Optional, Callable, Awaitable, Union, Dict, Type, TYPE_CHECKING
 
+from feishu.apis.dispatcher import EventDispatcher, OverflowPolicy
+from feishu.apis.router import Router
 from feishu.models import (Event, EventContent, EventType, ReceiveMessageEven, EmojiMessageEven)
-from feishu.utils import decrypt, FeishuError, ERRORS
+from feishu.stores import EventIdStore, MemoryEventIdStore
+from feishu.utils import decrypt, FeishuError, ERRORS, JSONCodec, default_codec
+
+if TYPE_CHECKING:
+    # sanic只在配置blueprint时才导入, 只发消息的进程不需要加载
+    from sanic import Blueprint
+    from sanic.request import Request
 
 logger = logging.getLogger("feishu")
 
-__all__ = ['setup_event_blueprint']
+__all__ = ['setup_event_blueprint', 'EventReceiver', 'find_event_id', 'payload_event_id']
 
 
-def setup_event_blueprint(framework: str, blueprint: Blueprint,
+def setup_event_blueprint(framework: str, blueprint: "Blueprint",
                           path: str, on_event: callable, verify_token: Optional[str] = None,
-                          encrypt_key: Optional[str] = None):
+                          encrypt_key: Optional[str] = None, json_codec: Optional[JSONCodec] = None,
+                          dedup: Union[bool, EventIdStore] = True,
+                          dispatcher: Union[bool, EventDispatcher] = True):
     """配置一个用于接收订阅事件的Blueprint
     https://open.feishu.cn/document/ukTMukTMukTM/uUTNz4SN1MjL1UzM
     Args:
@@ -27,73 +35,224 @@ def setup_event_blueprint(framework: str, blueprint: Blueprint,
         blueprint: sanic的Blueprint对象
         path: 回调路径, 只需包含blueprint后的挂载部分
         on_event:
-            有订阅事件时, 接收Event的参数, 无需返回
-            当framework="sanic"时, on_event函数会被asyncio.create_task添加，
-                请确保asyncio的loop配置正确，e.g. set_default_loop, 或者注意运行的先后顺序
-                一般情况下直接用sanic不应该出现任何问题
+            有订阅事件时, 接收Event的参数, 无需返回; 也可以传入Router, 按event_type分发
+            当framework="sanic"时, on_event函数由dispatcher的worker协程在sanic的loop中调用
         verify_token: 校验token, 需和飞书后台配置一致, 不提供则不校验请求来源
         encrypt_key: 加密key, 需和飞书后台配置一致, 不提供则无法解析加密数据
+        json_codec: 解析事件的JSON编解码器, 默认安装了orjson时使用orjson, 否则使用标准库json
+        dedup: 按event_id去重, 飞书重推的事件直接回复, 不再调用on_event
+            True: 进程内去重(MemoryEventIdStore); 多个worker/进程部署时传入共享的EventIdStore, e.g. RedisEventIdStore
+            False: 不去重
+        dispatcher: 事件调度, 限制同时处理的事件数和排队的事件数
+            True: 使用默认参数的EventDispatcher(16个worker, 队列长度1000, 队列满时最多等待1秒后丢弃)
+            EventDispatcher: 自定义worker数、队列长度和溢出策略, handler为None时使用on_event
+            False: 每个事件直接asyncio.create_task(on_event(event)), 不限制数量
+            默认开启; 事件因队列满被丢弃(shed或block超时)时删除去重记录并回复503, 由飞书稍后重推,
+            overflow=spill时事件交给spill回调, 正常回复
     """
     if framework == "sanic":
         return sanic_blueprint(blueprint=blueprint, path=path, on_event=on_event,
-                               verify_token=verify_token, encrypt_key=encrypt_key)
+                               verify_token=verify_token, encrypt_key=encrypt_key, json_codec=json_codec,
+                               dedup=dedup, dispatcher=dispatcher)
     else:
         raise NotImplementedError
 
 
-def sanic_blueprint(blueprint: Blueprint, path: str,
+def sanic_blueprint(blueprint: "Blueprint", path: str,
                     on_event: Callable[[Event], Awaitable[None]],
-                    verify_token: Optional[str] = None, encrypt_key: Optional[str] = None):
+                    verify_token: Optional[str] = None, encrypt_key: Optional[str] = None,
+                    json_codec: Optional[JSONCodec] = None, dedup: Union[bool, EventIdStore] = True,
+                    dispatcher: Union[bool, EventDispatcher] = True):
     """配置一个用于接收消息交互回调的sanic.blueprint
     Args:
         blueprint: sanic的Blueprint对象
         path: 回调路径, 只需包含blueprint后的挂载部分
-        on_event: 有Action事件时, 接收Event类型的参数, 无需任何返回
-            on_event函数会被asyncio.create_task添加，
-            请确保asyncio的loop配置正确，e.g. set_default_loop, 或者注意运行的先后顺序
-            一般情况下直接用sanic不应该出现任何问题
+        on_event: 有Action事件时, 接收Event类型的参数, 无需任何返回; 也可以传入Router
+            on_event函数由dispatcher的worker协程调用, sanic停止前会等待队列中的事件处理完
         verify_token: 校验token, 需和飞书后台配置一致, 不提供则不校验请求来源
         encrypt_key: 加密key, 需和飞书后台配置一致, 不提供则无法解析加密数据
+        json_codec: 解析事件的JSON编解码器
+        dedup: 按event_id去重, 同setup_event_blueprint
+        dispatcher: 事件调度, 同setup_event_blueprint
     """
+    from sanic import response
+    receiver = EventReceiver(on_event=on_event, verify_token=verify_token, encrypt_key=encrypt_key,
+                             json_codec=json_codec, dedup=dedup, dispatcher=dispatcher)
 
     @blueprint.route(path, methods=["POST"])
-    async def handle_event(request: Request):
-        payload: dict = request.json
-        if "encrypt" in payload:
-            payload = json.loads(decrypt(encrypt_key, payload["encrypt"]))
+    async def handle_event(request: "Request"):
+        try:
+            return response.json(await receiver.handle(request.body))
+        except FeishuError as e:
+            if e.code != ERRORS.EVENT_DROPPED:
+                raise
+            # 非2xx的回复飞书会重推
+            return response.json(dict(msg=e.msg), status=503)
+
+    @blueprint.listener("before_server_start")
+    async def build_router(app, loop):
+        # 包含在setup_event_blueprint之后注册的handler
+        if receiver.router:
+            receiver.router.build()
+
+    @blueprint.listener("before_server_stop")
+    async def stop_dispatcher(app, loop):
+        await receiver.close()
+
+
+class EventReceiver:
+    """和web框架无关的订阅事件处理: 解密、去重、解析并调度on_event, 返回需要回复给飞书的内容"""
+
+    def __init__(self, on_event: Callable[[Event], Awaitable[None]],
+                 verify_token: Optional[str] = None, encrypt_key: Optional[str] = None,
+                 json_codec: Optional[JSONCodec] = None, dedup: Union[bool, EventIdStore] = True,
+                 dispatcher: Union[bool, EventDispatcher] = True):
+        """
+        Args:
+            参数同sanic_blueprint
+        """
+        self.on_event = on_event
+        self.router: Optional[Router] = on_event if isinstance(on_event, Router) else None
+        if self.router:
+            self.router.build()
+        self.verify_token = verify_token
+        self.encrypt_key = encrypt_key
+        self.codec = json_codec or default_codec()
+        if dedup is True:
+            dedup = MemoryEventIdStore()
+        self.event_ids: Optional[EventIdStore] = dedup or None
+        if dispatcher is True:
+            dispatcher = EventDispatcher()
+        if dispatcher and dispatcher.handler is None:
+            dispatcher.handler = on_event
+        self.dispatcher: Optional[EventDispatcher] = dispatcher or None
 
+    async def handle(self, body: Union[bytes, str]) -> dict:
+        """处理一次推送
+        Args:
+            body: 请求体
+        Returns:
+            dict: 回复给飞书的JSON
+        Raises:
+            FeishuError: ERRORS.EVENT_DROPPED, 事件队列已满被丢弃, 已删除去重记录, 需要回复非2xx让飞书重推
+        """
+        payload: Optional[dict] = None
+        event_id = self.event_ids and find_event_id(body)
+        if not event_id:
+            # 加密的事件需要先解密才能拿到event_id
+            payload = self.codec.loads(body)
+            if "encrypt" in payload:
+                body, payload = decrypt(self.encrypt_key, payload["encrypt"]), None
+                event_id = self.event_ids and find_event_id(body)
+            if self.event_ids and not event_id:
+                # key的顺序和文档不同时(e.g. event在header之前)正则不可靠, 从解析后的内容中取
+                if payload is None:
+                    payload = self.codec.loads(body)
+                event_id = payload_event_id(payload)
+        if event_id and not await self.event_ids.add(event_id):
+            # 重推的事件直接回复, 不再解析
+            logger.debug("忽略重复推送的事件: %s", event_id)
+            return {}
+        try:
+            if payload is None:
+                payload = self.codec.loads(body)
+            return await self.handle_payload(payload)
+        except BaseException:
+            # 解析、调度失败或被丢弃时撤销去重记录, 让飞书的重推可以再次处理
+            if event_id:
+                await self.forget(event_id)
+            raise
+
+    async def handle_payload(self, payload: dict) -> dict:
+        """解析并调度推送内容
+        Args:
+            payload: 解密后的推送JSON
+        Returns:
+            dict: 回复给飞书的JSON
+        """
         # V1.0: url_verification, event_callback
         event_type = payload.get("type")
         if event_type == "url_verification":
-            return url_verification(payload)
+            return self.url_verification(payload)
         elif event_type == "event_callback":
-            event = Event(**payload)
-            asyncio.create_task(on_event(event))
+            await self.dispatch(Event(**payload))
         elif payload.get('schema') == "2.0":
             # V2.0
+            event_type = payload["header"]["event_type"]
+            if self.router and not self.router.accepts(event_type):
+                # 没有handler的事件不解析
+                return {}
             event = Event(**payload)
-            event_type = event.header.event_type
             event.event = adapt_event(event_type, event.event)
-            asyncio.create_task(on_event(event))
+            await self.dispatch(event)
         else:
             raise NotImplementedError
-        return response.json({})
+        return {}
 
-    def url_verification(payload: dict):
+    async def forget(self, event_id: str):
+        """删除event_id的去重记录, 删除失败时只记录日志"""
+        try:
+            await self.event_ids.discard(event_id)
+        except Exception:
+            logger.warning("删除event_id记录失败: %s", event_id, exc_info=True)
+
+    async def dispatch(self, event: Event):
+        if self.dispatcher:
+            accepted = await self.dispatcher.submit(event)
+            # spill的事件由回调负责, 只有丢弃的事件需要飞书重推
+            if not accepted and self.dispatcher.overflow != OverflowPolicy.SPILL:
+                raise FeishuError(ERRORS.EVENT_DROPPED, "事件队列已满, 丢弃事件")
+        else:
+            asyncio.create_task(self.on_event(event))
+
+    async def close(self):
+        """等待dispatcher中排队的事件处理完"""
+        if self.dispatcher:
+            await self.dispatcher.stop()
+
+    def url_verification(self, payload: dict) -> dict:
         """配置请求网址后飞书会发送的验证请求
         https://open.feishu.cn/document/ukTMukTMukTM/uUTNz4SN1MjL1UzM#%E9%85%8D%E7%BD%AE%E8%AF%B7%E6%B1%82%E7%BD%91%E5%9D%80
         """
-        if verify_token and verify_token != payload.get("token"):
-            return response.json(dict(challenge=""))
-        return response.json(dict(challenge=payload.get("challenge")))
+        if self.verify_token and self.verify_token != payload.get("token"):
+            return dict(challenge="")
+        return dict(challenge=payload.get("challenge"))
+
+
+# V2.0的header.event_id, V1.0的uuid; 飞书推送时两者都出现在事件内容之前, 事件内容中嵌套的JSON字符串里引号是转义的, 不会匹配
+# 先遇到"event"时(key被重新排序过), 事件内容里未转义的同名key可能先匹配上, 不能确定event_id
+EVENT_ID_PATTERN = re.compile(r'"(?:(?:event_id|uuid)"\s*:\s*"([^"\\]+)"|event"\s*:)')
+EVENT_ID_PATTERN_BYTES = re.compile(EVENT_ID_PATTERN.pattern.encode())
+
+
+def find_event_id(body: Union[bytes, str]) -> Optional[str]:
+    """不解析JSON, 直接从请求体中找到event_id
+    找不到(e.g. 加密的事件、url_verification)或event_id不在事件内容之前时返回None, 需要解析后用payload_event_id
+    """
+    if isinstance(body, str):
+        match = EVENT_ID_PATTERN.search(body)
+        return match.group(1) if match else None
+    match = EVENT_ID_PATTERN_BYTES.search(body)
+    return match.group(1).decode() if match and match.group(1) else None
+
+
+def payload_event_id(payload: dict) -> Optional[str]:
+    """从解析后的推送中取event_id: V2.0的header.event_id, V1.0的uuid"""
+    header = payload.get("header")
+    event_id = header.get("event_id") if isinstance(header, dict) else payload.get("uuid")
+    return event_id if isinstance(event_id, str) and event_id else None
+
+
+# event_type -> 事件内容的模型
+EVENT_MODELS: Dict[str, Type[EventContent]] = {
+    EventType.im_message_receive_v1: ReceiveMessageEven,
+    EventType.im_message_reaction_created_v1: EmojiMessageEven,
+}
 
 
 def adapt_event(event_type: [str], event: [EventContent]) -> Union[dict, EventContent]:
     """适配event的真实类型"""
-    event_cls: Optional[EventContent] = {
-        EventType.im_message_receive_v1: ReceiveMessageEven,
-        EventType.im_message_reaction_created_v1: EmojiMessageEven,
-    }.get(event_type)
+    event_cls: Optional[Type[EventContent]] = EVENT_MODELS.get(event_type)
 
     if event_cls:
         try:
@@ -25,17 +25,10 @@ class FeishuAPI(AuthAPI, MessageAPI, ABC):
     params, payload为url参数和body参数，可为空不传
 
     注意:
-        为了让allow_async_call的hack起作用，
-        请一定要通过`result = self.client.request`或者`result = self.client.fetch_url`来发起通用请求，
-        否则可能会造在异步代码中执行同步请求，卡住event_loop的问题
+        请一定要通过`self.client.request`或者`self.client.fetch`来发起请求,
+        allow_async_call会在生成的async版本中await它们,
+        否则可能会造成在异步代码中执行同步请求，卡住event_loop的问题
     """
 
     def __init__(self, feishu_client: "FeishuClient"):
         self.client = feishu_client
-        # 执行allow_async_call里面的hack
-        self.dummy()
-
-    @allow_async_call
-    def dummy(self):
-        """这是一个用来初始化async函数的API"""
-        pass
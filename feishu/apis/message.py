@@ -3,32 +3,93 @@
 - 分享群名片、个人名片
 - 发送语音、视频、文件、表情包
 """
-import json
-from typing import Optional, Union
+import asyncio
+import uuid
+from asyncio import Future
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Union, List, NamedTuple, Iterable, Iterator, AsyncIterator, Callable, Any
 
 from .base import BaseAPI, allow_async_call
+from feishu.consts import BATCH_SEND_SIZE
 from feishu.models import (SendMessage, MessageType, MessageContent, ReceiveIdType,
                            TextMessage, PostMessage, ImageMessage, InteractiveMessage, ShareChatMessage,
                            ShareUserMessage, AudioMessage, MediaMessage, FileMessage, StickerMessage,
                            TextContent, PostContent, ImageContent, InteractiveContent, ShareChatContent,
                            ShareUserContent, AudioContent, MediaContent, FileContent, StickerContent)
+from feishu.utils import FeishuError, JSONCodec
 
-__all__ = ['MessageAPI']
+__all__ = ['MessageAPI', 'BatchSendResult', 'SendResult', 'EncodedMessage']
+
+
+class BatchSendResult(NamedTuple):
+    """批量发送中一个分片的结果
+    id_type: "open_ids", "user_ids" or "department_ids"
+    ids: 这个分片中的接收者id
+    message_id: 批量消息id, 失败时为None
+    invalid_ids: 飞书返回的无效接收者id, 分片失败时为None
+    error: 这个分片失败时的异常
+    """
+    id_type: str
+    ids: List[str]
+    message_id: Optional[str] = None
+    invalid_ids: Optional[List[str]] = None
+    error: Optional[FeishuError] = None
+
+
+class SendResult(NamedTuple):
+    """send_many中一条消息的结果
+    index: 消息在输入中的序号
+    message_id: 消息id, 失败时为None
+    error: 失败时的异常
+    """
+    index: int
+    message_id: Optional[str] = None
+    error: Optional[FeishuError] = None
+
+
+class EncodedMessage:
+    """只序列化一次的消息模板, 发给不同接收者时只拼接receive_id和uuid, content不再重复序列化
+
+    请求体为: {"receive_id":<receive_id>,"uuid":"<uuid>",<tail>, 其中tail为'"msg_type":...,"content":"..."}'
+    """
+
+    def __init__(self, msg_type: MessageType, content: Union[MessageContent, dict, str], codec: JSONCodec):
+        """
+        Args:
+            msg_type: 消息类型
+            content: 消息内容, str视为已经序列化好的JSON
+            codec: 序列化使用的JSON编解码器
+        """
+        if isinstance(content, MessageContent):
+            content = content.dict(exclude_none=True)
+        if not isinstance(content, str):
+            content = codec.dumps_str(content)
+        self.codec = codec
+        self.tail = codec.dumps({"msg_type": msg_type, "content": content})[1:]
+
+    def render(self, receive_id: str, message_uuid: Optional[str] = None) -> bytes:
+        """拼接出发给receive_id的请求体, message_uuid默认随机生成"""
+        return b"".join((b'{"receive_id":', self.codec.dumps(receive_id),
+                         b',"uuid":"', (message_uuid or uuid.uuid4().hex).encode(), b'",', self.tail))
+
+
+# 消息类型 -> (消息model, 消息内容model)
+MESSAGE_MODELS = {
+    MessageType.TEXT: (TextMessage, TextContent),
+    MessageType.POST: (PostMessage, PostContent),
+    MessageType.IMAGE: (ImageMessage, ImageContent),
+    MessageType.INTERACTIVE: (InteractiveMessage, InteractiveContent),
+    MessageType.SHARE_CHAT: (ShareChatMessage, ShareChatContent),
+    MessageType.SHARE_USER: (ShareUserMessage, ShareUserContent),
+    MessageType.AUDIO: (AudioMessage, AudioContent),
+    MessageType.MEDIA: (MediaMessage, MediaContent),
+    MessageType.FILE: (FileMessage, FileContent),
+    MessageType.STICKER: (StickerMessage, StickerContent),
+}
 
 
 def create_message(msg_type: MessageType, content: MessageContent, receive_id: str) -> SendMessage:
-    message_cls = {
-        MessageType.TEXT: TextMessage,
-        MessageType.POST: PostMessage,
-        MessageType.IMAGE: ImageMessage,
-        MessageType.INTERACTIVE: InteractiveMessage,
-        MessageType.SHARE_CHAT: ShareChatMessage,
-        MessageType.SHARE_USER: ShareUserMessage,
-        MessageType.AUDIO: AudioMessage,
-        MessageType.MEDIA: MediaMessage,
-        MessageType.FILE: FileMessage,
-        MessageType.STICKER: StickerMessage,
-    }[msg_type]
+    message_cls = MESSAGE_MODELS[msg_type][0]
 
     msg = message_cls(
         receive_id=receive_id,
@@ -38,6 +99,13 @@ def create_message(msg_type: MessageType, content: MessageContent, receive_id: s
     return msg
 
 
+def build_message(msg_type: MessageType, content: dict, receive_id: str) -> dict:
+    """不经过pydantic, 直接构造/im/v1/messages的payload, 调用方需保证content的结构正确
+    结果和create_message(...).dict(exclude_none=True)一致
+    """
+    return {"receive_id": receive_id, "msg_type": msg_type, "content": content}
+
+
 class MessageAPI(BaseAPI):
     """消息管理相关API
     https://open.feishu.cn/document/ukTMukTMukTM/uUjNz4SN2MjL1YzM
@@ -61,19 +129,33 @@ class MessageAPI(BaseAPI):
         >>> client = FeishuClient(...)
         >>> message_id = client.send(msg, ReceiveIdType.OpenId)
         >>> client.send(msg)
+
+        dict中的content为str时认为已经是序列化好的JSON, 不再重复序列化
+
+        每条消息会带上随机生成的uuid(也可以在dict中自己指定), 飞书对相同uuid的消息1小时内只发送一次,
+        所以client配置了retry_policy时, 重试不会导致重复发送
         """
         api = "/im/v1/messages"
         if isinstance(message, SendMessage):
             payload = message.dict(exclude_none=True)
         else:
-            payload = message
+            payload = dict(message)
         # content json序列化
-        payload['content'] = json.dumps(payload['content'])
+        if not isinstance(payload['content'], str):
+            payload['content'] = self.client.json_codec.dumps_str(payload['content'])
+        # 幂等键
+        payload.setdefault('uuid', uuid.uuid4().hex)
 
         param = {'receive_id_type': receive_id_type}
         result = self.client.request("POST", api=api, payload=payload, params=param)
         return result.get("data", {}).get("message_id")
 
+    def _message(self, msg_type: MessageType, content: dict, receive_id: str) -> Union[SendMessage, dict]:
+        """构造send_xxx要发送的消息: 默认直接构造payload, client开启validate_messages时先用pydantic model校验"""
+        if self.client.validate_messages:
+            return create_message(msg_type, MESSAGE_MODELS[msg_type][1](**content), receive_id)
+        return build_message(msg_type, content, receive_id)
+
     @allow_async_call
     def send_text(self, text: str, receive_id: str,
                   receive_id_type: ReceiveIdType = ReceiveIdType.OpenId) -> Optional[str]:
@@ -83,7 +165,7 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        msg = create_message(MessageType.TEXT, content=TextContent(text=text), receive_id=receive_id)
+        msg = self._message(MessageType.TEXT, {"text": text}, receive_id)
         if text.strip():
             return self.send(msg, receive_id_type)
         else:
@@ -98,7 +180,9 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        msg = create_message(MessageType.POST, content=PostContent(**post), receive_id=receive_id)
+        if isinstance(post, PostContent):
+            post = post.dict(exclude_none=True)
+        msg = self._message(MessageType.POST, post, receive_id)
         if post:
             return self.send(msg, receive_id_type)
         else:
@@ -113,7 +197,7 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        msg = create_message(MessageType.IMAGE, content=ImageContent(image_key=image_key), receive_id=receive_id)
+        msg = self._message(MessageType.IMAGE, {"image_key": image_key}, receive_id)
         if image_key.strip():
             return self.send(msg, receive_id_type)
         else:
@@ -144,7 +228,7 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        msg = create_message(MessageType.SHARE_CHAT, content=ShareChatContent(chat_id=chat_id), receive_id=receive_id)
+        msg = self._message(MessageType.SHARE_CHAT, {"chat_id": chat_id}, receive_id)
         if chat_id.strip():
             return self.send(msg, receive_id_type)
         else:
@@ -159,7 +243,7 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        msg = create_message(MessageType.SHARE_USER, content=ShareUserContent(user_id=user_id), receive_id=receive_id)
+        msg = self._message(MessageType.SHARE_USER, {"user_id": user_id}, receive_id)
         if user_id.strip():
             return self.send(msg, receive_id_type)
         else:
@@ -174,7 +258,7 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        msg = create_message(MessageType.AUDIO, content=AudioContent(file_key=audio_file_key), receive_id=receive_id)
+        msg = self._message(MessageType.AUDIO, {"file_key": audio_file_key}, receive_id)
         if audio_file_key.strip():
             return self.send(msg, receive_id_type)
         else:
@@ -190,8 +274,10 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        media = MediaContent(file_key=media_file_key, image_key=media_image_key)
-        msg = create_message(MessageType.MEDIA, content=media, receive_id=receive_id)
+        media = {"file_key": media_file_key}
+        if media_image_key is not None:
+            media["image_key"] = media_image_key
+        msg = self._message(MessageType.MEDIA, media, receive_id)
         if media_file_key.strip():
             return self.send(msg, receive_id_type)
         else:
@@ -206,7 +292,7 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        msg = create_message(MessageType.FILE, content=FileContent(file_key=file_key), receive_id=receive_id)
+        msg = self._message(MessageType.FILE, {"file_key": file_key}, receive_id)
         if file_key.strip():
             return self.send(msg, receive_id_type)
         else:
@@ -221,9 +307,163 @@ class MessageAPI(BaseAPI):
             receive_id_type: 消息接收者id类型
             receive_id: 依据receive_id_type的值，填写对应的消息接收者id
         """
-        msg = create_message(MessageType.STICKER, content=StickerContent(file_key=sticker_file_key),
-                             receive_id=receive_id)
+        msg = self._message(MessageType.STICKER, {"file_key": sticker_file_key}, receive_id)
         if sticker_file_key.strip():
             return self.send(msg, receive_id_type)
         else:
             self.logger.warning(f"sticker_file_key为空, 表情包未发送: sticker_file_key={sticker_file_key}")
+
+    def batch_send(self, msg_type: MessageType, content: Union[MessageContent, dict],
+                   open_ids: Optional[List[str]] = None, user_ids: Optional[List[str]] = None,
+                   department_ids: Optional[List[str]] = None) -> Union[List[BatchSendResult], Future]:
+        """批量发送消息, 接收者列表按BATCH_SEND_SIZE分片, 异步模式下各分片并发发送
+        Args:
+            msg_type: 消息类型
+            content: 消息内容, 消息卡片为卡片本身的结构
+            open_ids: 接收者open_id列表
+            user_ids: 接收者user_id列表
+            department_ids: 接收部门id列表
+        Returns:
+            List[BatchSendResult]: 每个分片的结果, 单个分片失败不影响其他分片, 失败信息在BatchSendResult.error中
+        """
+        if isinstance(content, MessageContent):
+            content = content.dict(exclude_none=True)
+
+        results = []
+        for id_type, ids in (("open_ids", open_ids), ("user_ids", user_ids), ("department_ids", department_ids)):
+            for i in range(0, len(ids or []), BATCH_SEND_SIZE):
+                results.append(self._batch_send_chunk(msg_type, content, id_type, ids[i:i + BATCH_SEND_SIZE]))
+
+        if self.client.run_async:
+            async def gather_async():
+                return list(await asyncio.gather(*results))
+
+            return asyncio.ensure_future(gather_async(), loop=self.client.event_loop)
+        return results
+
+    @allow_async_call
+    def _batch_send_chunk(self, msg_type: MessageType, content: dict, id_type: str,
+                          ids: List[str]) -> BatchSendResult:
+        """发送批量消息的一个分片"""
+        api = "/message/v4/batch_send/"
+        payload = {"msg_type": msg_type, id_type: ids}
+        # 批量接口中content不需要序列化, 消息卡片放在card字段
+        if msg_type == MessageType.INTERACTIVE:
+            payload["card"] = content
+        else:
+            payload["content"] = content
+
+        try:
+            # 批量接口没有uuid, 超时后重发可能导致整个分片的接收者收到两条, 只在确定没有发出或被限流时重试
+            result = self.client.request("POST", api=api, payload=payload, idempotent=False)
+        except FeishuError as e:
+            self.logger.warning(f"批量发送消息失败: {e!r}, {id_type}共{len(ids)}个")
+            return BatchSendResult(id_type=id_type, ids=ids, error=e)
+        data = result.get("data", {})
+        return BatchSendResult(id_type=id_type, ids=ids, message_id=data.get("message_id"),
+                               invalid_ids=data.get("invalid_" + id_type) or [])
+
+    def send_many(self, messages: Iterable[Union[SendMessage, dict]],
+                  receive_id_type: ReceiveIdType = ReceiveIdType.OpenId,
+                  concurrency: int = 10) -> Union[Iterator[SendResult], AsyncIterator[SendResult]]:
+        """并发发送多条消息(e.g. 给每个用户发送个性化的文本), 按完成顺序逐条返回结果
+
+        同一时刻最多有concurrency条消息在发送, messages可以是生成器, 只会按需读取,
+        所以上万条消息也不需要一次性全部构造好; 单条消息失败不影响其他消息, 失败信息在SendResult.error中
+        同步模式下使用线程池并共用client的requests.Session(concurrency不要超过client的connection_limit),
+        异步模式下返回一个async iterator
+        Args:
+            messages: 待发送的消息, 同send
+            receive_id_type: 消息接收者id类型
+            concurrency: 最大并发数
+        Usages::
+        >>> for result in client.send_many(messages, concurrency=20):
+        ...     print(result.index, result.message_id, result.error)
+        >>> # 异步模式
+        >>> async for result in client_async.send_many(messages, concurrency=20):
+        ...     print(result.index, result.message_id, result.error)
+        """
+        return self._send_concurrently(messages, lambda message: self.send(message, receive_id_type), concurrency)
+
+    def broadcast(self, msg_type: MessageType, content: Union[MessageContent, dict, str],
+                  receive_ids: Iterable[str], receive_id_type: ReceiveIdType = ReceiveIdType.OpenId,
+                  concurrency: int = 10) -> Union[Iterator[SendResult], AsyncIterator[SendResult]]:
+        """把同一条消息(e.g. 很大的消息卡片)分别发送给多个接收者, 按完成顺序逐条返回结果
+
+        content只序列化一次(EncodedMessage), 每个接收者的请求体只拼接receive_id和uuid;
+        并发控制、返回值以及同步/异步模式下的行为都和send_many一致, SendResult.index为接收者的序号
+        Args:
+            msg_type: 消息类型
+            content: 消息内容, str视为已经序列化好的JSON
+            receive_ids: 接收者id, 可以是生成器
+            receive_id_type: 消息接收者id类型
+            concurrency: 最大并发数
+        Usages::
+        >>> for result in client.broadcast(MessageType.INTERACTIVE, card, open_ids, concurrency=20):
+        ...     print(open_ids[result.index], result.message_id, result.error)
+        """
+        message = EncodedMessage(msg_type, content, self.client.json_codec)
+        return self._send_concurrently(
+            receive_ids, lambda receive_id: self._send_encoded(message, receive_id, receive_id_type), concurrency)
+
+    @allow_async_call
+    def _send_encoded(self, message: EncodedMessage, receive_id: str, receive_id_type: ReceiveIdType) -> Optional[str]:
+        """发送EncodedMessage给一个接收者, 重试时复用同一个请求体(同一个uuid)"""
+        api = "/im/v1/messages"
+        param = {'receive_id_type': receive_id_type}
+        result = self.client.request("POST", api=api, params=param, payload={"receive_id": receive_id},
+                                     body=message.render(receive_id), idempotent=True)
+        return result.get("data", {}).get("message_id")
+
+    def _send_concurrently(self, items: Iterable, send: Callable[[Any], Union[Optional[str], Future]],
+                           concurrency: int) -> Union[Iterator[SendResult], AsyncIterator[SendResult]]:
+        """对items中的每一项调用send, 最多同时concurrency个, 按完成顺序返回SendResult"""
+        if self.client.run_async:
+            return self._send_many_async(items, send, concurrency)
+        return self._send_many_sync(items, send, concurrency)
+
+    def _send_many_sync(self, items: Iterable, send: Callable[[Any], Optional[str]],
+                        concurrency: int) -> Iterator[SendResult]:
+        def send_one(index: int, item) -> SendResult:
+            try:
+                return SendResult(index=index, message_id=send(item))
+            except FeishuError as e:
+                return SendResult(index=index, error=e)
+
+        with ThreadPoolExecutor(concurrency, thread_name_prefix="feishu-send") as executor:
+            pending = set()
+            for index, item in enumerate(items):
+                pending.add(executor.submit(send_one, index, item))
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    async def _send_many_async(self, items: Iterable, send: Callable[[Any], Future],
+                               concurrency: int) -> AsyncIterator[SendResult]:
+        async def send_one(index: int, item) -> SendResult:
+            try:
+                return SendResult(index=index, message_id=await send(item))
+            except FeishuError as e:
+                return SendResult(index=index, error=e)
+
+        pending = set()
+        try:
+            for index, item in enumerate(items):
+                pending.add(asyncio.ensure_future(send_one(index, item)))
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # 调用方提前退出迭代时, 取消还没发完的消息
+            for future in pending:
+                future.cancel()
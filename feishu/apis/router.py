@@ -0,0 +1,69 @@
+"""订阅事件路由
+按event_type注册处理函数, 代替在on_event中手写if event_type == ...
+"""
+from typing import Optional, Callable, Awaitable, Dict, List, Tuple, Union
+
+from feishu.models import Event, EventType
+
+__all__ = [
+    'Router'
+]
+
+EventHandler = Callable[[Event], Awaitable[None]]
+EventFilter = Callable[[Event], bool]
+
+
+class Router:
+    """订阅事件路由, 可以直接作为setup_event_blueprint的on_event
+
+    同一个event_type按注册顺序匹配, 只调用第一个filter通过(或没有filter)的handler;
+    setup_event_blueprint时会生成分发表, 没有handler的event_type在解析成模型之前就被跳过
+    Usages::
+    >>> router = Router()
+    >>> @router.on("im.message.receive_v1", filter=lambda event: event.event.message.chat_type == "p2p")
+    ... async def on_p2p_message(event: Event):
+    ...     pass
+    >>> setup_event_blueprint("sanic", blueprint, path, on_event=router)
+    """
+
+    def __init__(self):
+        self.routes: List[Tuple[str, Optional[EventFilter], EventHandler]] = []
+        # event_type -> ((filter, handler), ...), 注册新的handler后重新生成
+        self.table: Optional[Dict[str, Tuple[Tuple[Optional[EventFilter], EventHandler], ...]]] = None
+
+    def on(self, event_type: Union[str, EventType], filter: Optional[EventFilter] = None):
+        """注册处理event_type的协程函数
+        Args:
+            event_type: 事件类型, e.g. "im.message.receive_v1"
+            filter: 接收Event, 返回是否由这个handler处理
+        """
+
+        def decorator(handler: EventHandler) -> EventHandler:
+            self.add(event_type, handler, filter)
+            return handler
+
+        return decorator
+
+    def add(self, event_type: Union[str, EventType], handler: EventHandler, filter: Optional[EventFilter] = None):
+        """同on, 不使用装饰器时调用"""
+        event_type = event_type.value if isinstance(event_type, EventType) else event_type
+        self.routes.append((event_type, filter, handler))
+        self.table = None
+
+    def build(self) -> Dict[str, Tuple[Tuple[Optional[EventFilter], EventHandler], ...]]:
+        """生成分发表"""
+        table: Dict[str, list] = {}
+        for event_type, filter, handler in self.routes:
+            table.setdefault(event_type, []).append((filter, handler))
+        self.table = {event_type: tuple(handlers) for event_type, handlers in table.items()}
+        return self.table
+
+    def accepts(self, event_type: str) -> bool:
+        """是否有处理event_type的handler"""
+        return event_type in (self.table if self.table is not None else self.build())
+
+    async def __call__(self, event: Event):
+        table = self.table if self.table is not None else self.build()
+        for filter, handler in table.get(event.header.event_type, ()):
+            if filter is None or filter(event):
+                return await handler(event)
@@ -1,5 +1,19 @@
 from .client import FeishuClient
+from .refresher import TokenRefresher
+from .ratelimit import RateLimiter, TokenBucket
+from .retry import RetryPolicy, RETRYABLE_CODES, SAFE_RETRY_CODES
+from .loop_thread import LoopThread
+from .trace import RequestTrace, normalize_route
+from .metrics import MetricsRegistry
+from .breaker import CircuitBreaker, CircuitState, BREAKER_FAILURE_CODES
 
 __all__ = [
-    'FeishuClient'
+    'FeishuClient',
+    'TokenRefresher',
+    'RateLimiter', 'TokenBucket',
+    'RetryPolicy', 'RETRYABLE_CODES', 'SAFE_RETRY_CODES',
+    'LoopThread',
+    'RequestTrace', 'normalize_route',
+    'MetricsRegistry',
+    'CircuitBreaker', 'CircuitState', 'BREAKER_FAILURE_CODES'
 ]
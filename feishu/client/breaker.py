@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Optional, Callable, Iterable, Dict, List
+
+from feishu.utils import FeishuError, ERRORS
+
+__all__ = [
+    'CircuitBreaker', 'CircuitState', 'BREAKER_FAILURE_CODES'
+]
+
+logger = logging.getLogger("feishu")
+
+# 计入熔断的错误码: 连不上服务器、返回无法解析、服务端无有效错误信息
+# 业务错误(e.g. 无效的receive_id)说明服务端正常, 不计入
+BREAKER_FAILURE_CODES = {
+    ERRORS.CONNECT_FAILED,
+    ERRORS.FAILED_TO_ESTABLISH_CONNECTION,
+    ERRORS.UNABLE_TO_PARSE_SERVER_RESPONSE,
+    ERRORS.UNKNOWN_SERVER_ERROR,
+}
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"  # 正常放行
+    OPEN = "open"  # 熔断, 直接失败
+    HALF_OPEN = "half_open"  # 放行少量探测请求
+
+
+class _Circuit:
+    __slots__ = ('state', 'failures', 'opened_at', 'probes', 'probe_started', 'lock')
+
+    def __init__(self):
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.
+        self.probes = 0
+        self.probe_started = 0.
+        self.lock = threading.Lock()
+
+
+class CircuitBreaker:
+    """按API路由熔断(FeishuClient.request的route, 默认为把id替换为":id"的API Path)
+
+    - closed: 连续失败failure_threshold次后进入open
+    - open: 请求直接抛出FeishuError(ERRORS.CIRCUIT_OPEN), 不再等待超时; recovery_timeout秒后进入half_open
+    - half_open: 最多放行half_open_max_calls个探测请求, 成功则恢复closed, 失败则重新open;
+      探测请求超过recovery_timeout秒没有结果(e.g. 被cancel)时允许新的探测
+    - 记录的路由超过max_circuits个时, 清理处于closed且没有失败记录(和新建的一样)的路由
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30, half_open_max_calls: int = 1,
+                 failure_codes: Optional[Iterable[int]] = None,
+                 on_state_change: Optional[Callable[[str, CircuitState, CircuitState], None]] = None,
+                 max_circuits: int = 1000):
+        """
+        Args:
+            failure_threshold: 连续失败几次后熔断
+            recovery_timeout: 熔断多少秒后放行探测请求
+            half_open_max_calls: half_open时同时放行的探测请求数
+            failure_codes: 计入熔断的FeishuError.code, 默认为BREAKER_FAILURE_CODES; 请求超时也会计入
+            on_state_change: 状态变化时的回调, 参数为(API Path, 原状态, 新状态)
+            max_circuits: 超过多少个路由时清理没有失败记录的路由
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.failure_codes = set(BREAKER_FAILURE_CODES if failure_codes is None else failure_codes)
+        self.listeners: List[Callable[[str, CircuitState, CircuitState], None]] = []
+        if on_state_change:
+            self.listeners.append(on_state_change)
+
+        self.max_circuits = max_circuits
+        self.circuits: Dict[str, _Circuit] = {}
+        self.lock = threading.Lock()
+        # 路由数超过evict_at时清理一次
+        self.evict_at = max_circuits
+
+    def add_listener(self, listener: Callable[[str, CircuitState, CircuitState], None]):
+        """添加状态变化的回调, 重复添加只生效一次"""
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def state(self, key: str) -> CircuitState:
+        circuit = self.circuits.get(key)
+        return circuit.state if circuit else CircuitState.CLOSED
+
+    def is_failure(self, error: Exception) -> bool:
+        if isinstance(error, FeishuError):
+            return error.code in self.failure_codes
+        return isinstance(error, (asyncio.TimeoutError, TimeoutError))
+
+    def acquire(self, key: str):
+        """请求前调用, 熔断时抛出FeishuError(ERRORS.CIRCUIT_OPEN)"""
+        circuit = self._circuit(key)
+        if circuit.state == CircuitState.CLOSED:
+            return
+        transition = None
+        with circuit.lock:
+            now = time.monotonic()
+            if circuit.state == CircuitState.OPEN and now - circuit.opened_at >= self.recovery_timeout:
+                transition = self._transit(circuit, CircuitState.HALF_OPEN)
+                circuit.probes = 0
+            if circuit.state == CircuitState.HALF_OPEN:
+                if now - circuit.probe_started >= self.recovery_timeout:
+                    circuit.probes = 0
+                if circuit.probes < self.half_open_max_calls:
+                    circuit.probes += 1
+                    circuit.probe_started = now
+                    allowed = True
+                else:
+                    allowed = False
+            else:
+                allowed = circuit.state == CircuitState.CLOSED
+            retry_after = self.recovery_timeout - (now - circuit.opened_at)
+        if transition:
+            self._notify(key, *transition)
+        if not allowed:
+            raise FeishuError(ERRORS.CIRCUIT_OPEN,
+                              f"{key}已熔断, 约{max(retry_after, 0):.1f}s后重新探测")
+
+    def record(self, key: str, error: Optional[Exception] = None):
+        """请求结束后调用, error为None表示成功"""
+        circuit = self._circuit(key)
+        failed = error is not None and self.is_failure(error)
+        if not failed and circuit.state == CircuitState.CLOSED and not circuit.failures:
+            return
+        transition = None
+        with circuit.lock:
+            if failed:
+                circuit.failures += 1
+                if circuit.state == CircuitState.HALF_OPEN or (
+                        circuit.state == CircuitState.CLOSED and circuit.failures >= self.failure_threshold):
+                    transition = self._transit(circuit, CircuitState.OPEN)
+                    circuit.opened_at = time.monotonic()
+            else:
+                circuit.failures = 0
+                if circuit.state == CircuitState.HALF_OPEN:
+                    transition = self._transit(circuit, CircuitState.CLOSED)
+        if transition:
+            self._notify(key, *transition)
+
+    @staticmethod
+    def _transit(circuit: _Circuit, state: CircuitState):
+        old, circuit.state = circuit.state, state
+        return old, state
+
+    def _notify(self, key: str, old: CircuitState, new: CircuitState):
+        if new == CircuitState.OPEN:
+            logger.warning(f"{key}连续请求失败, 熔断{self.recovery_timeout}s")
+        for listener in self.listeners:
+            try:
+                listener(key, old, new)
+            except Exception:
+                logger.exception("熔断状态回调出错")
+
+    def _circuit(self, key: str) -> _Circuit:
+        circuit = self.circuits.get(key)
+        if circuit is None:
+            with self.lock:
+                circuit = self.circuits.get(key)
+                if circuit is None:
+                    if len(self.circuits) >= self.evict_at:
+                        self._evict()
+                    circuit = self.circuits[key] = _Circuit()
+        return circuit
+
+    def _evict(self):
+        """清理closed且没有失败记录的路由, 调用时需持有self.lock"""
+        for key, circuit in list(self.circuits.items()):
+            if circuit.state == CircuitState.CLOSED and not circuit.failures:
+                del self.circuits[key]
+        # 剩下的都有失败记录时, 等路由数翻倍后再清理, 均摊O(1)
+        self.evict_at = max(self.max_circuits, len(self.circuits) * 2)
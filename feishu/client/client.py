@@ -1,17 +1,29 @@
 import asyncio
 import logging
 import secrets
-import aiohttp
-import requests
+import threading
+import time
 from asyncio import Future, AbstractEventLoop
 from concurrent.futures import ThreadPoolExecutor
-from typing import Optional, Union, Tuple
+from typing import Optional, Union, Tuple, Callable, TYPE_CHECKING
 
 from .base import FeishuBaseClient, AppType
+from .refresher import TokenRefresher
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
+from .loop_thread import LoopThread
+from .trace import RequestTrace, create_trace_config, redact, normalize_route
+from .metrics import MetricsRegistry
+from .breaker import CircuitBreaker
 from feishu.apis import FeishuAPI, get_or_create_event_loop, allow_async_call
-from feishu.utils import FeishuError, ERRORS
-from feishu.consts import APP_ID, APP_SECRET
-from feishu.stores import TokenStore, MemoryStore
+from feishu.utils import FeishuError, ERRORS, JSONCodec, default_codec
+from feishu.consts import APP_ID, APP_SECRET, TOKEN_UPDATE_TIME
+from feishu.stores import TokenStore, MemoryStore, AsyncTokenStore, AsyncMemoryStore, SyncStoreAdapter
+
+if TYPE_CHECKING:
+    # aiohttp只在异步模式(或loop_thread)下用到, requests只在同步模式下用到, 都在用到时才导入
+    import aiohttp
+    import requests
 
 __all__ = [
     'FeishuClient'
@@ -27,7 +39,17 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
                  app_type: AppType = AppType.TENANT, run_async: bool = False,
                  event_loop: Optional[AbstractEventLoop] = None,
                  endpoint: str = "https://open.feishu.cn/open-apis/",
-                 timeout: float = 6, token_store: Optional[TokenStore] = None):
+                 timeout: float = 6, token_store: Optional[Union[TokenStore, AsyncTokenStore]] = None,
+                 refresh_token_in_background: bool = False,
+                 on_token_refresh: Optional[Callable[[float, Optional[Exception]], None]] = None,
+                 token_lock_ttl: float = 10, token_lock_wait: float = 3,
+                 connector: Optional["aiohttp.BaseConnector"] = None, session: Optional["requests.Session"] = None,
+                 connection_limit: int = 100, connection_limit_per_host: int = 0,
+                 keepalive_timeout: float = 15, dns_cache_ttl: Optional[int] = 10,
+                 rate_limiter: Optional[RateLimiter] = None, retry_policy: Optional[RetryPolicy] = None,
+                 loop_thread: bool = False, json_codec: Optional[JSONCodec] = None,
+                 validate_messages: bool = False, on_request: Optional[Callable[[RequestTrace], None]] = None,
+                 metrics: Optional[MetricsRegistry] = None, circuit_breaker: Optional[CircuitBreaker] = None):
         """初始化
         Args:
             app_id: 飞书自建应用的app_id, 默认则取环境变量中的APP_ID
@@ -39,6 +61,34 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
             timeout: 连接超时，其中timeout/3为连接超时，timeout*2/3为读取超时
             endpoint: 飞书平台的endpoint, 一般默认就好
             token_store: 飞书的access_token会在2小时后过期
+                异步模式下推荐使用AsyncTokenStore(AsyncMemoryStore, AsyncRedisStore),
+                同步的TokenStore会通过SyncStoreAdapter在线程池中读写
+            refresh_token_in_background: 是否在后台提前刷新token, 开启后请求时不再需要同步等待token刷新
+                同步模式下为一个daemon线程, 异步模式下为event_loop中的task(在第一次请求时启动)
+            on_token_refresh: 后台刷新token后的回调, 参数为(刷新耗时秒数, 失败时的异常 or None)
+            token_lock_ttl: 多进程共享token_store时, 刷新token的锁(租约)的有效期
+            token_lock_wait: 没拿到刷新锁且没有可用的旧token时, 等待其他进程刷新的最长时间, 超时后自己刷新
+            connector: 异步模式下共享的aiohttp连接池, 多个client传入同一个connector即可共用连接,
+                client关闭时不会关闭外部传入的connector; 传入后下面几个连接池参数不再生效
+            session: 同步模式下共享的requests.Session, 传入后下面几个连接池参数不再生效
+            connection_limit: 连接池的总连接数上限, 0为不限制; 同步模式下为每个host的连接池大小, 0则用requests的默认值
+            connection_limit_per_host: 每个host的连接数上限, 0为不限制(仅异步模式)
+            keepalive_timeout: 空闲连接保持的秒数(仅异步模式)
+            dns_cache_ttl: DNS缓存的秒数, None为永久缓存(仅异步模式)
+            rate_limiter: 按API path(及群聊接收者)自适应限流, 超出速率时同步模式阻塞等待、异步模式await等待
+            retry_policy: 请求失败时的重试策略, 默认不重试
+            loop_thread: 仅同步模式, 在后台daemon线程中运行一个私有的event_loop, 请求通过aiohttp连接池发送,
+                同步方法阻塞等待结果; 多个线程共用一个client时请求会在连接池中并发执行
+                (e.g. Django/Celery等同步服务), 此时连接池参数和异步模式一致
+            json_codec: 序列化请求体、消息content以及解析返回值的JSON编解码器,
+                默认安装了orjson时使用OrjsonCodec, 否则使用标准库json
+            validate_messages: send_text等方法发送前是否先用pydantic model校验消息内容,
+                默认直接构造payload以减少开销, 调试时可以打开
+            on_request: 每次HTTP请求(包括每次重试)结束后的回调, 参数为RequestTrace,
+                包含method、path、HTTP状态码、飞书code、字节数以及DNS/建立连接/首字节/总耗时
+            metrics: 记录请求次数、耗时直方图、token刷新次数和token_store命中率, 可以多个client共用
+            circuit_breaker: 按API path熔断, 熔断期间请求直接抛出FeishuError(ERRORS.CIRCUIT_OPEN)而不是等待超时,
+                同时配置了metrics时熔断状态会记录到metrics中
         """
         allowed_types = AppType.__dict__["_value2member_map_"]
         if app_type not in allowed_types or app_type == "user":
@@ -51,6 +101,8 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
         self.event_loop: Optional[asyncio.AbstractEventLoop] = event_loop
         self.endpoint = endpoint
         self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=1)
 
         if not self.app_id:
             self.app_id = APP_ID.strip()
@@ -66,43 +118,192 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
         self.api = FeishuAPI(self)
         # 但同时因为继承了FeishuAPI, 所以必须为那些方法提供一个client
         self.client = self
-
+        self.json_codec = json_codec or default_codec()
+        self.validate_messages = validate_messages
+        self.on_request = on_request
+        self.metrics = metrics
+        self.circuit_breaker = circuit_breaker
+        if circuit_breaker and metrics:
+            circuit_breaker.add_listener(metrics.record_circuit)
+
+        self.session_async = None       # lazy initialize in self.request/self.fetch
+        self.connector = connector
+        self.connector_options = dict(limit=connection_limit, limit_per_host=connection_limit_per_host,
+                                      keepalive_timeout=keepalive_timeout, ttl_dns_cache=dns_cache_ttl)
+        self.loop_thread: Optional[LoopThread] = None
         if self.run_async:
             self.event_loop = event_loop    # lazy initialize in self.request/self.fetch
-            self.session_async = None       # lazy initialize in self.request/self.fetch
-            self.executor = ThreadPoolExecutor(2)
         else:
-            self.session = requests.Session()
-            self.executor = None
+            if loop_thread:
+                self.loop_thread = LoopThread()
+            if not session:
+                import requests
+                session = requests.Session()
+                pool_size = connection_limit or requests.adapters.DEFAULT_POOLSIZE
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+            self.session = session
+        self.executor = None
         self.closed = False
+
         if not token_store:
-            token_store = MemoryStore()
+            token_store = AsyncMemoryStore() if self.run_async else MemoryStore()
+        if self.run_async and isinstance(token_store, TokenStore):
+            self.executor = ThreadPoolExecutor(2)
+            token_store = SyncStoreAdapter(token_store, self.executor)
+        assert self.run_async or not isinstance(token_store, AsyncTokenStore), "同步模式下不支持AsyncTokenStore"
         self.token_store = token_store
+        # token过期时合并并发的刷新请求: 同步模式下用锁让其余线程等待, 异步模式下共享同一个Future
+        self._token_lock = threading.Lock()
+        self._token_future: Optional[Future] = None
+        self._obtain_future: Optional[Future] = None
+        # 最近一次见到的有效token和见到的时间, 刷新锁被其他进程持有时兜底用
+        self._last_token: Tuple[Optional[str], float] = (None, 0)
+        self.token_lock_ttl = token_lock_ttl
+        self.token_lock_wait = token_lock_wait
+
+        self.token_refresher: Optional[TokenRefresher] = None
+        if refresh_token_in_background:
+            self.token_refresher = TokenRefresher(self, on_refresh=on_token_refresh)
+            if not self.run_async:
+                self.token_refresher.start()
 
     def get_token(self) -> Union[str, Future]:
         if self.run_async:
             async def get_token_async():
-                token_ = await self.event_loop.run_in_executor(self.executor, self.token_store.get, "token")
-                if not token_:
-                    token_, expire_ = await self.api.get_tenant_access_token()
-                    await self.event_loop.run_in_executor(self.executor, self.token_store.set,
-                                                          "token", token_, expire_)
+                token_ = await self.token_store.get("token")
+                if self.metrics:
+                    self.metrics.record_event("token_store_hit" if token_ else "token_store_miss")
+                if token_:
+                    self._last_token = (token_, time.time())
+                else:
+                    token_ = await self._obtain_token_async()
                 return token_
 
             return asyncio.ensure_future(get_token_async(), loop=self.event_loop)
         else:
             token = self.token_store.get("token")
-            if not token:
-                if self.app_type == AppType.TENANT:
-                    token, expire = self.api.get_tenant_access_token()
-                    self.token_store.set("token", token, expire)
-                else:
-                    raise NotImplementedError
+            if self.metrics:
+                self.metrics.record_event("token_store_hit" if token else "token_store_miss")
+            if token:
+                self._last_token = (token, time.time())
+            else:
+                with self._token_lock:
+                    # 等锁期间token可能已被其他线程刷新
+                    token = self.token_store.get("token") or self._obtain_token_sync()
+
+            return token
+
+    def _stale_token(self) -> Optional[str]:
+        """最近见到的旧token
 
+        token_store中的有效期比真实有效期提前了TOKEN_UPDATE_TIME,
+        所以最后一次从token_store读到后TOKEN_UPDATE_TIME秒内, 这个token在飞书侧仍然有效
+        """
+        token, seen_at = self._last_token
+        if token and time.time() - seen_at < TOKEN_UPDATE_TIME:
             return token
+        return None
+
+    def _obtain_token_sync(self) -> str:
+        """token_store中没有token时获取token, 调用方需持有self._token_lock
+
+        多进程共享token_store时, 通过token_store的刷新锁保证集群中只有一个进程请求新token,
+        没拿到锁的进程先用自己手上仍有效的旧token, 没有的话等待持锁进程写入, 超时后自己刷新
+        """
+        lock_id = self.token_store.acquire_lock("token", self.token_lock_ttl)
+        if lock_id:
+            try:
+                # 上一个持锁进程可能刚刷新完并释放了锁, 拿到锁后再读一次
+                return self.token_store.get("token") or self._refresh_token_sync()[0]
+            finally:
+                self.token_store.release_lock("token", lock_id)
+
+        token = self._stale_token()
+        deadline = time.monotonic() + self.token_lock_wait
+        while not token and time.monotonic() < deadline:
+            time.sleep(0.05)
+            token = self.token_store.get("token")
+        return token or self._refresh_token_sync()[0]
+
+    def _obtain_token_async(self) -> Future:
+        """_obtain_token_sync的异步版本, 同一时刻最多只有一个在途"""
+        if self._obtain_future is None:
+            async def obtain_token_async():
+                try:
+                    lock_id = await self.token_store.acquire_lock("token", self.token_lock_ttl)
+                    if lock_id:
+                        try:
+                            # 同_obtain_token_sync, 拿到锁后再读一次
+                            token_ = await self.token_store.get("token")
+                            return token_ or (await self._refresh_token_async())[0]
+                        finally:
+                            await self.token_store.release_lock("token", lock_id)
+
+                    token_ = self._stale_token()
+                    deadline = time.monotonic() + self.token_lock_wait
+                    while not token_ and time.monotonic() < deadline:
+                        await asyncio.sleep(0.05)
+                        token_ = await self.token_store.get("token")
+                    return token_ or (await self._refresh_token_async())[0]
+                finally:
+                    self._obtain_future = None
+
+            self._obtain_future = asyncio.ensure_future(obtain_token_async(), loop=self.event_loop)
+        return asyncio.shield(self._obtain_future)
+
+    def _refresh_token_sync(self) -> Tuple[str, int]:
+        """请求新的token并写入token_store, 调用方需持有self._token_lock
+        Returns:
+            Tuple[token, expire]
+        """
+        if self.app_type != AppType.TENANT:
+            raise NotImplementedError
+        try:
+            token, expire = self.api.get_tenant_access_token()
+        except Exception:
+            if self.metrics:
+                self.metrics.record_event("token_refresh_error")
+            raise
+        if self.metrics:
+            self.metrics.record_event("token_refresh_success")
+        self.token_store.set("token", token, expire)
+        self._last_token = (token, time.time())
+        return token, expire
+
+    def _refresh_token_async(self) -> Future:
+        """请求新的token并写入token_store, Future的结果为Tuple[token, expire]
+
+        同一时刻最多只有一个刷新请求在途, 其余调用方await同一个Future;
+        用shield包一层, 避免某个调用方被cancel时连带取消共享的刷新请求
+        """
+        if self._token_future is None:
+            async def refresh_token_async():
+                try:
+                    if self.app_type != AppType.TENANT:
+                        raise NotImplementedError
+                    try:
+                        token_, expire_ = await self.api.get_tenant_access_token()
+                    except Exception:
+                        if self.metrics:
+                            self.metrics.record_event("token_refresh_error")
+                        raise
+                    if self.metrics:
+                        self.metrics.record_event("token_refresh_success")
+                    await self.token_store.set("token", token_, expire_)
+                    self._last_token = (token_, time.time())
+                    return token_, expire_
+                finally:
+                    self._token_future = None
+
+            self._token_future = asyncio.ensure_future(refresh_token_async(), loop=self.event_loop)
+        return asyncio.shield(self._token_future)
 
     def request(self, method: str, api: str, params: dict = {}, payload: dict = {},
-                data: dict = {}, files: dict = {}, auth: str = True) -> Union[dict, bytes, Future]:
+                data: dict = {}, files: dict = {}, auth: str = True,
+                body: Optional[bytes] = None, idempotent: Optional[bool] = None,
+                route: Optional[str] = None) -> Union[dict, bytes, Future]:
         """发起请求
         Args:
             method: "GET" or "POST"
@@ -112,6 +313,11 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
             data: Form-Data格式的参数
             files: Multipart-encoded格式的文件参数
             auth: 是否需要验证, 只有token类API需要设为False
+            body: 已经序列化好的JSON请求体, 传入时直接发送body, payload只用于限流和日志
+            idempotent: 请求能否安全地重复发送, 决定超时等情况下是否重试;
+                默认GET和payload中带uuid的请求为True, 其他为False(只在确定请求没有发出或被限流时重试)
+            route: 路由模板, e.g. "/im/v1/messages/:id/reply", 作为metrics、熔断和限流的key;
+                默认把api中的id段(om_xxx、oc_xxx、纯数字等)替换为":id"
 
         Returns:
             一个解析好的返回dict，为飞书的标准格式
@@ -124,6 +330,8 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
         """
         if self.closed:
             raise FeishuError(ERRORS.CLIENT_CLOSED, "client对象已被关闭")
+        if self.token_refresher and not self.token_refresher.started:
+            self.token_refresher.start()
 
         headers = {
             "Content-Type": "application/json; charset=utf-8",
@@ -133,15 +341,32 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
         timeout_pair = (self.timeout / 3, self.timeout * 2 / 3)
         if files:
             headers.pop("Content-Type")
+        route = route or normalize_route(api)
+        limit_keys = self.rate_limiter.keys(route, params, payload) if self.rate_limiter else None
+        circuit = route if self.circuit_breaker else None
+        request_kwargs = dict(method=method, url=url, timeout_pair=timeout_pair, headers=headers,
+                              params=params, payload=payload, data=data, files=files, body=body)
+        if idempotent is None:
+            idempotent = method == "GET" or bool(payload and "uuid" in payload)
 
         if self.run_async:
             async def do_request_async():
-                if auth:
-                    token = await self.get_token()
-                    headers['Authorization'] = f"Bearer {token}"
-                return await self._async_request(
-                    method=method, url=url, timeout_pair=timeout_pair, headers=headers,
-                    params=params, payload=payload, data=data, files=files)
+                start = time.monotonic()
+                attempt = 0
+                while True:
+                    attempt += 1
+                    try:
+                        result = await self._request_once_async(auth, route, limit_keys, circuit,
+                                                                 request_kwargs)
+                    except Exception as e:
+                        delay = self.retry_policy.next_delay(attempt, start, e, idempotent)
+                        if delay is None:
+                            self.retry_policy.complete(api, attempt, start, e)
+                            raise
+                        await asyncio.sleep(delay)
+                    else:
+                        self.retry_policy.complete(api, attempt, start)
+                        return result
 
             future = asyncio.ensure_future(
                 do_request_async(),
@@ -149,26 +374,151 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
             )
             return future
         else:
-            if auth:
-                headers['Authorization'] = f"Bearer {self.get_token()}"
-
-            return self._sync_request(method=method, url=url, timeout_pair=timeout_pair,
-                                      headers=headers, params=params, payload=payload, data=data, files=files)
+            start = time.monotonic()
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    result = self._request_once_sync(auth, route, limit_keys, circuit, request_kwargs)
+                except Exception as e:
+                    delay = self.retry_policy.next_delay(attempt, start, e, idempotent)
+                    if delay is None:
+                        self.retry_policy.complete(api, attempt, start, e)
+                        raise
+                    time.sleep(delay)
+                else:
+                    self.retry_policy.complete(api, attempt, start)
+                    return result
+
+    async def _request_once_async(self, auth: bool, route: str, limit_keys: Optional[list],
+                                  circuit: Optional[str], request_kwargs: dict) -> dict:
+        """单次请求: 获取token、熔断、限流、发送"""
+        if auth:
+            token = await self.get_token()
+            request_kwargs['headers']['Authorization'] = f"Bearer {token}"
+        if circuit:
+            self._acquire_circuit(circuit, request_kwargs)
+        if limit_keys:
+            delay = self.rate_limiter.acquire(limit_keys)
+            if delay:
+                await asyncio.sleep(delay)
+        trace = self._start_trace(request_kwargs, route)
+        kwargs = dict(request_kwargs, trace=trace) if trace else request_kwargs
+        try:
+            result = await self._async_request(**kwargs)
+        except Exception as e:
+            if limit_keys:
+                self.rate_limiter.record(limit_keys, e)
+            if circuit:
+                self.circuit_breaker.record(circuit, e)
+            if trace:
+                self._finish_trace(trace, error=e)
+            raise
+        if limit_keys:
+            self.rate_limiter.record(limit_keys)
+        if circuit:
+            self.circuit_breaker.record(circuit)
+        if trace:
+            self._finish_trace(trace, result=result)
+        return result
 
-    async def _async_request(self, method: str, url: str, timeout_pair: Tuple[float, float],
-                             headers: dict, params: dict, payload: dict, data: dict, files: dict) -> Future:
+    def _request_once_sync(self, auth: bool, route: str, limit_keys: Optional[list],
+                           circuit: Optional[str], request_kwargs: dict) -> dict:
+        """单次请求: 获取token、熔断、限流、发送"""
+        if auth:
+            request_kwargs['headers']['Authorization'] = f"Bearer {self.get_token()}"
+        if circuit:
+            self._acquire_circuit(circuit, request_kwargs)
+        if limit_keys:
+            delay = self.rate_limiter.acquire(limit_keys)
+            if delay:
+                time.sleep(delay)
+        trace = self._start_trace(request_kwargs, route)
+        kwargs = dict(request_kwargs, trace=trace) if trace else request_kwargs
+        try:
+            if self.loop_thread:
+                result = self.loop_thread.run(self._async_request(**kwargs))
+            else:
+                result = self._sync_request(**kwargs)
+        except Exception as e:
+            if limit_keys:
+                self.rate_limiter.record(limit_keys, e)
+            if circuit:
+                self.circuit_breaker.record(circuit, e)
+            if trace:
+                self._finish_trace(trace, error=e)
+            raise
+        if limit_keys:
+            self.rate_limiter.record(limit_keys)
+        if circuit:
+            self.circuit_breaker.record(circuit)
+        if trace:
+            self._finish_trace(trace, result=result)
+        return result
 
+    def _acquire_circuit(self, circuit: str, request_kwargs: dict):
+        """熔断时直接抛出FeishuError(ERRORS.CIRCUIT_OPEN), 同样会记录到metrics和on_request"""
+        try:
+            self.circuit_breaker.acquire(circuit)
+        except FeishuError as e:
+            trace = self._start_trace(request_kwargs, circuit)
+            if trace:
+                self._finish_trace(trace, error=e)
+            raise
+
+    def _start_trace(self, request_kwargs: dict, route: str) -> Optional[RequestTrace]:
+        """配置了on_request或metrics时, 为这次请求创建RequestTrace"""
+        if not self.on_request and not self.metrics:
+            return None
+        return RequestTrace(request_kwargs['method'], request_kwargs['url'][len(self.endpoint):], route)
+
+    def _finish_trace(self, trace: RequestTrace, result: Optional[dict] = None, error: Optional[Exception] = None):
+        trace.total = time.perf_counter() - trace.start
+        if error is None:
+            trace.code = result.get("code")
+        else:
+            trace.error = error
+            trace.code = error.code if isinstance(error, FeishuError) else None
+        if self.metrics:
+            self.metrics.record_request(trace.route, trace.code, trace.total)
+        if self.on_request:
+            try:
+                self.on_request(trace)
+            except Exception:
+                self.logger.exception("请求回调on_request出错")
+
+    def _get_session_async(self) -> "aiohttp.ClientSession":
+        """懒加载aiohttp session, 需要在event_loop中调用"""
         if not self.session_async:
-            self.session_async = aiohttp.ClientSession()
-        if not self.event_loop or self.event_loop.is_closed():
+            import aiohttp
+            trace_configs = [create_trace_config()] if self.on_request else None
+            if self.connector:
+                self.session_async = aiohttp.ClientSession(connector=self.connector, connector_owner=False,
+                                                           trace_configs=trace_configs)
+            else:
+                connector = aiohttp.TCPConnector(**self.connector_options)
+                self.session_async = aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+        return self.session_async
+
+    async def _async_request(self, method: str, url: str, timeout_pair: Tuple[float, float],
+                             headers: dict, params: dict, payload: dict, data: dict, files: dict,
+                             body: Optional[bytes] = None, trace: Optional[RequestTrace] = None) -> Future:
+        import aiohttp
+        session = self._get_session_async()
+        if self.run_async and (not self.event_loop or self.event_loop.is_closed()):
             self.event_loop = get_or_create_event_loop()
-        request_id = secrets.token_hex(4)
+        # 只有开启debug日志时才生成请求id和格式化日志
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        request_id = secrets.token_hex(4) if debug else None
 
         try:
             timeout = aiohttp.ClientTimeout(sock_connect=timeout_pair[0], sock_read=timeout_pair[1])
             if method == "GET":
-                self.logger.debug(f"GET url={url} params={params} headers={headers} (id={request_id})")
-                resp = await self.session_async.get(url, params=params, headers=headers, timeout=timeout)
+                if debug:
+                    self.logger.debug("GET url=%s params=%s headers=%s (id=%s)",
+                                      url, params, redact(headers), request_id)
+                resp = await session.get(url, params=params, headers=headers, timeout=timeout,
+                                         trace_request_ctx=trace)
             elif method == "POST":
                 if data or files:
                     # multipart/form-data
@@ -177,57 +527,96 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
                         form.add_field(key, value)
                     for filename, content in files.items():
                         form.add_field(filename, content)
-                    self.logger.debug(f"POST(form-data) url={url} params={params} "
-                                      f"headers={headers} (id={request_id})")
-                    resp = await self.session_async.post(url, params=params, data=form, headers=headers,
-                                                         timeout=timeout)
+                    if debug:
+                        self.logger.debug("POST(form-data) url=%s params=%s headers=%s (id=%s)",
+                                          url, params, redact(headers), request_id)
+                    resp = await session.post(url, params=params, data=form, headers=headers,
+                                              timeout=timeout, trace_request_ctx=trace)
                 else:
                     # application/json
-                    self.logger.debug(f"POST url={url} params={params} json={payload} "
-                                      f"headers={headers} (id={request_id})")
-                    resp = await self.session_async.post(url, params=params, json=payload, headers=headers,
-                                                         timeout=timeout)
+                    if body is None and payload is not None:
+                        body = self.json_codec.dumps(payload)
+                    if debug:
+                        self.logger.debug("POST url=%s params=%s json=%s headers=%s (id=%s)",
+                                          url, params, redact(payload), redact(headers), request_id)
+                    if trace:
+                        trace.request_bytes = len(body or b"")
+                    resp = await session.post(url, params=params, data=body, headers=headers,
+                                              timeout=timeout, trace_request_ctx=trace)
             else:
                 raise FeishuError(ERRORS.UNSUPPORTED_METHOD,
                                   f"不支持的请求method: {method}, 调用上下文: "
                                   f"url={url}, params={params}, payload={payload} "
                                   f"data={data} files.keys={files.keys()}")
+            if trace:
+                trace.status = resp.status
+            content = await resp.read()
+        except (aiohttp.ClientConnectorError, aiohttp.ServerTimeoutError) as e:
+            if isinstance(e, aiohttp.ClientConnectorError) or isinstance(e.__cause__, asyncio.TimeoutError):
+                # 建立连接失败或超时(读超时的ServerTimeoutError没有__cause__)
+                raise FeishuError(ERRORS.CONNECT_FAILED, f"连接服务器失败, 请求没有发出: {e}")
+            raise FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, f"建立和服务器的请求失败: {e}")
         except aiohttp.ClientError as e:
             raise FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, f"建立和服务器的请求失败: {e}")
 
+        if trace:
+            trace.response_bytes = len(content)
         try:
-            result = await resp.json(content_type=None)
+            result = self.json_codec.loads(content)
         except ValueError:
-            raise FeishuError(ERRORS.UNABLE_TO_PARSE_SERVER_RESPONSE, f"服务器返回格式有问题，无法解析成JSON: {resp.text}")
+            raise FeishuError(ERRORS.UNABLE_TO_PARSE_SERVER_RESPONSE, f"服务器返回格式有问题，无法解析成JSON: {content!r}")
 
         if result.get("code") != 0:
             raise FeishuError(result.get("code") or ERRORS.UNKNOWN_SERVER_ERROR,
                               result.get("msg") or f"无有效出错信息，返回JSON数据为: {result}")
 
-        self.logger.debug(f"response={result} (id={request_id})")
+        if debug:
+            self.logger.debug("response=%s (id=%s)", redact(result), request_id)
         return result
 
     def _sync_request(self, method: str, url: str, timeout_pair: Tuple[float, float],
-                      headers: dict, params: dict, payload: dict, data: dict, files: dict) -> dict:
-        request_id = secrets.token_hex(4)
+                      headers: dict, params: dict, payload: dict, data: dict, files: dict,
+                      body: Optional[bytes] = None, trace: Optional[RequestTrace] = None) -> dict:
+        import requests
+        # 只有开启debug日志时才生成请求id和格式化日志
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        request_id = secrets.token_hex(4) if debug else None
         try:
             if method == "GET":
-                self.logger.debug(f"GET url={url} params={params} headers={headers} (id={request_id})")
+                if debug:
+                    self.logger.debug("GET url=%s params=%s headers=%s (id=%s)",
+                                      url, params, redact(headers), request_id)
                 resp = self.session.get(url, params=params, headers=headers, timeout=timeout_pair)
             elif method == "POST":
-                self.logger.debug(f"POST url={url} params={params} json={payload} data={data} "
-                                  f"files.keys={files.keys()} headers={headers} (id={request_id})")
-                resp = self.session.post(url, params=params, json=payload, data=data, files=files,
-                                         headers=headers, timeout=timeout_pair)
+                if debug:
+                    self.logger.debug("POST url=%s params=%s json=%s data=%s files.keys=%s headers=%s (id=%s)",
+                                      url, params, redact(payload), data, files.keys(), redact(headers), request_id)
+                if data or files:
+                    resp = self.session.post(url, params=params, data=data, files=files,
+                                             headers=headers, timeout=timeout_pair)
+                else:
+                    if body is None and payload is not None:
+                        body = self.json_codec.dumps(payload)
+                    resp = self.session.post(url, params=params, data=body,
+                                             headers=headers, timeout=timeout_pair)
             else:
                 raise FeishuError(ERRORS.UNSUPPORTED_METHOD,
                                   f"不支持的请求method: {method}, 调用上下文: "
                                   f"params={params}, payload={payload}")
         except requests.exceptions.RequestException as e:
+            if _connect_failed(e):
+                raise FeishuError(ERRORS.CONNECT_FAILED, f"连接服务器失败, 请求没有发出: {e}")
             raise FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, f"建立和服务器的请求失败: {e}")
 
+        if trace:
+            # requests无法区分DNS解析和建立连接的耗时, elapsed为发出请求到解析完返回header
+            request_body = resp.request.body
+            trace.status = resp.status_code
+            trace.ttfb = resp.elapsed.total_seconds()
+            trace.request_bytes = len(request_body) if request_body else 0
+            trace.response_bytes = len(resp.content)
         try:
-            result = resp.json()
+            result = self.json_codec.loads(resp.content)
         except ValueError:
             raise FeishuError(ERRORS.UNABLE_TO_PARSE_SERVER_RESPONSE, f"服务器返回格式有问题，无法解析成JSON: {resp.text}")
 
@@ -235,7 +624,8 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
             raise FeishuError(result.get("code") or ERRORS.UNKNOWN_SERVER_ERROR,
                               result.get("msg") or f"无有效出错信息，返回JSON数据为: {result}")
 
-        self.logger.debug(f"response={result} (id={request_id})")
+        if debug:
+            self.logger.debug("response=%s (id=%s)", redact(result), request_id)
         return result
 
     def fetch(self, url: str, params: dict = None, data: dict = None, json: dict = None,
@@ -260,25 +650,26 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
         if self.closed:
             raise FeishuError(ERRORS.CLIENT_CLOSED, "client对象已被关闭")
 
+        async def async_fetch():
+            session = self._get_session_async()
+            if data:
+                resp = await session.request(method=method, url=url, params=params, data=data,
+                                             headers=headers, timeout=timeout)
+            else:
+                resp = await session.request(method=method, url=url, params=params, json=json,
+                                             headers=headers, timeout=timeout)
+            return await resp.read()
+
         if self.run_async:
-            if not self.session_async:
-                self.session_async = aiohttp.ClientSession()
             if not self.event_loop or self.event_loop.is_closed():
                 self.event_loop = get_or_create_event_loop()
 
-            async def async_fetch():
-                if data:
-                    resp = await self.session_async.request(method=method, url=url, params=params, data=data,
-                                                            headers=headers, timeout=timeout)
-                else:
-                    resp = await self.session_async.request(method=method, url=url, params=params, json=json,
-                                                            headers=headers, timeout=timeout)
-                return await resp.read()
-
             return asyncio.ensure_future(
                 async_fetch(),
                 loop=self.event_loop
             )
+        elif self.loop_thread:
+            return self.loop_thread.run(async_fetch())
         else:
             if data:
                 resp = self.session.request(method=method, url=url, params=params, data=data,
@@ -290,6 +681,28 @@ class FeishuClient(FeishuBaseClient, FeishuAPI):
 
     async def close(self):
         """不关闭一下aiohttp会发warning有点烦, 强迫症适用"""
+        if self.token_refresher:
+            self.token_refresher.stop()
+        if self.loop_thread:
+            # session属于loop_thread中的loop, 需要在那边关闭
+            if not self.closed and self.session_async:
+                self.loop_thread.run(self.session_async.close())
+            self.loop_thread.stop()
+            self.closed = True
         if not self.closed and self.session_async:
-            self.session_async.close()
+            await self.session_async.close()
             self.closed = True
+
+
+def _connect_failed(error: Exception) -> bool:
+    """requests的异常是否发生在建立连接时(DNS解析失败、连接被拒绝、连接超时), 此时请求一定没有发出"""
+    import requests
+    from urllib3.exceptions import NewConnectionError, MaxRetryError
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and not isinstance(error, requests.exceptions.ProxyError):
+        reason = error.args[0] if error.args else None
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return isinstance(reason, NewConnectionError)
+    return False
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+from typing import Optional, Coroutine, Any
+
+__all__ = [
+    'LoopThread'
+]
+
+
+class LoopThread:
+    """在daemon线程中运行的私有event_loop
+
+    同步代码通过run()把协程提交到这个loop中执行并阻塞等待结果,
+    多个线程提交的协程在同一个loop中并发执行, 共用同一个aiohttp连接池
+    """
+
+    def __init__(self, name: str = "feishu-loop"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """在loop中执行协程, 阻塞当前线程直到返回结果"""
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("不能在LoopThread自己的线程中阻塞等待")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -0,0 +1,262 @@
+import bisect
+import threading
+import weakref
+from typing import Optional, Sequence, Dict, List, Tuple, Union, Callable
+
+from .breaker import CircuitState
+
+__all__ = [
+    'MetricsRegistry', 'DEFAULT_BUCKETS'
+]
+
+# 请求耗时直方图的分桶上限(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 导出Prometheus时熔断状态的取值
+CIRCUIT_STATE_VALUES = {CircuitState.CLOSED: 0, CircuitState.OPEN: 1, CircuitState.HALF_OPEN: 2}
+
+
+class _Shard:
+    """一个线程自己的计数, 只有这个线程会写, 所以不需要加锁"""
+    __slots__ = ('requests', 'latency', 'events', 'histograms')
+
+    def __init__(self):
+        # (path, code) -> 次数
+        self.requests: Dict[Tuple[str, Union[int, str]], int] = {}
+        # path -> [各分桶次数..., 超出最后一个分桶的次数, 总耗时]
+        self.latency: Dict[str, list] = {}
+        # 事件名 -> 次数, e.g. token_refresh_success, token_store_hit
+        self.events: Dict[str, int] = {}
+        # 直方图名 -> 同latency, e.g. event_wait_seconds
+        self.histograms: Dict[str, list] = {}
+
+
+class MetricsRegistry:
+    """进程内的请求指标: 按API路由(FeishuClient.request的route)和飞书code统计请求数、按API路由统计耗时直方图,
+    以及token刷新次数、token_store命中率和各API path的熔断状态;
+    其他组件(e.g. EventDispatcher)可以通过observe记录直方图, 通过register_gauge注册gauge
+
+    每个线程写自己的分片(threading.local), 记录时不加锁; snapshot时再合并所有分片,
+    线程退出后它的分片合并到_base中, 分片数不会随线程数增长; 多个client可以共用一个MetricsRegistry
+    Usages::
+    >>> metrics = MetricsRegistry()
+    >>> client = FeishuClient(..., metrics=metrics)
+    >>> metrics.quantile("/im/v1/messages", 0.99)
+    >>> print(metrics.to_prometheus())
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, prefix: str = "feishu"):
+        """
+        Args:
+            buckets: 耗时直方图的分桶上限(秒), 从小到大
+            prefix: 导出Prometheus指标时的名称前缀
+        """
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        # 已退出线程的计数, 只在_lock内整体替换, 不会原地修改
+        self._base = _Shard()
+        self._lock = threading.Lock()
+        # path -> 当前熔断状态, 只在状态变化时整体赋值
+        self._circuits: Dict[str, CircuitState] = {}
+        # gauge名 -> 取值函数, snapshot时才调用
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # 每个线程只会走一次
+            shard = self._local.shard = _Shard()
+            # owner只被这个线程的threading.local引用, 线程退出时被回收, 触发_retire
+            owner = self._local.owner = _ShardOwner()
+            weakref.finalize(owner, _retire, weakref.ref(self), shard)
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard: _Shard):
+        """把已退出线程的分片合并到_base, 然后丢弃这个分片"""
+        with self._lock:
+            base = _Shard()
+            for source in (self._base, shard):
+                for key, count in source.requests.items():
+                    base.requests[key] = base.requests.get(key, 0) + count
+                for name, count in source.events.items():
+                    base.events[name] = base.events.get(name, 0) + count
+                _merge_histograms(base.latency, source.latency)
+                _merge_histograms(base.histograms, source.histograms)
+            self._base = base
+            self._shards.remove(shard)
+
+    def record_request(self, path: str, code: Optional[int], latency: float):
+        """记录一次请求, code为飞书返回的code(成功为0)或本地错误码, 非FeishuError的异常为None"""
+        shard = self._shard()
+        key = (path, "exception" if code is None else int(code))
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        self._observe(shard.latency, path, latency)
+
+    def record_event(self, name: str):
+        """记录一次事件, e.g. token_refresh_success, token_refresh_error, token_store_hit, token_store_miss"""
+        events = self._shard().events
+        events[name] = events.get(name, 0) + 1
+
+    def observe(self, name: str, value: float):
+        """记录一个值(秒)到名为name的直方图, e.g. event_wait_seconds, event_handler_seconds"""
+        self._observe(self._shard().histograms, name, value)
+
+    def register_gauge(self, name: str, getter: Callable[[], Union[float, Dict[str, float]]]):
+        """注册一个gauge, e.g. 队列长度; getter只在snapshot时调用, 记录时没有开销
+        getter返回dict时, 每个key导出为一个带key标签的值
+        """
+        self._gauges[name] = getter
+
+    def _observe(self, histograms: Dict[str, list], key: str, value: float):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.]
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def record_circuit(self, path: str, old: CircuitState, new: CircuitState):
+        """记录熔断状态变化, 可直接作为CircuitBreaker的on_state_change回调"""
+        self._circuits[path] = new
+        self.record_event(f"circuit_{new.value}")
+
+    def snapshot(self) -> dict:
+        """合并所有线程的计数
+        Returns:
+            dict: {
+                "requests": {path: {code: 次数}},
+                "errors": {code: 次数},   # 所有path中code不为0的请求
+                "latency": {path: {"buckets": [(上限, 累计次数), ..., (inf, 总次数)], "count": 次数, "sum": 总耗时}},
+                "events": {事件名: 次数},
+                "circuits": {path: CircuitState},  # 发生过状态变化的path
+                "histograms": {直方图名: 格式同latency},
+                "gauges": {gauge名: 当前值},
+            }
+        """
+        with self._lock:
+            shards = [self._base] + self._shards
+        requests, errors, latency, events, histograms = {}, {}, {}, {}, {}
+        for shard in shards:
+            # dict.copy在持有GIL时完成, 不会读到写了一半的dict
+            for (path, code), count in shard.requests.copy().items():
+                per_path = requests.setdefault(path, {})
+                per_path[code] = per_path.get(code, 0) + count
+                if code != 0:
+                    errors[code] = errors.get(code, 0) + count
+            _merge_histograms(latency, shard.latency)
+            _merge_histograms(histograms, shard.histograms)
+            for name, count in shard.events.copy().items():
+                events[name] = events.get(name, 0) + count
+
+        gauges = {}
+        for name, getter in list(self._gauges.items()):
+            try:
+                gauges[name] = getter()
+            except Exception:
+                continue
+        return {"requests": requests, "errors": errors, "latency": self._cumulate(latency), "events": events,
+                "circuits": self._circuits.copy(), "histograms": self._cumulate(histograms), "gauges": gauges}
+
+    def _cumulate(self, histograms: Dict[str, list]) -> Dict[str, dict]:
+        result = {}
+        for key, histogram in histograms.items():
+            cumulative, buckets = 0, []
+            for upper, count in zip(self.buckets + (float("inf"),), histogram[:-1]):
+                cumulative += count
+                buckets.append((upper, cumulative))
+            result[key] = {"buckets": buckets, "count": cumulative, "sum": histogram[-1]}
+        return result
+
+    def quantile(self, path: str, q: float, snapshot: Optional[dict] = None,
+                 histogram: Optional[str] = None) -> Optional[float]:
+        """根据直方图估算path的耗时分位数(秒, 在分桶内线性插值), 没有请求时返回None
+        histogram不为None时估算名为histogram的直方图, 忽略path
+        """
+        snapshot = snapshot or self.snapshot()
+        if histogram is None:
+            histogram = snapshot["latency"].get(path)
+        else:
+            histogram = snapshot["histograms"].get(histogram)
+        if not histogram or not histogram["count"]:
+            return None
+        rank = q * histogram["count"]
+        lower, below = 0., 0
+        for upper, cumulative in histogram["buckets"]:
+            if cumulative >= rank:
+                if upper == float("inf"):
+                    # 超出最后一个分桶, 只能返回最后一个分桶的上限
+                    return lower
+                return lower + (upper - lower) * (rank - below) / (cumulative - below)
+            lower, below = upper, cumulative
+        return lower
+
+    def to_prometheus(self) -> str:
+        """导出为Prometheus的text格式"""
+        snapshot = self.snapshot()
+        prefix = self.prefix
+        lines = [f"# HELP {prefix}_requests_total 请求次数, code为飞书返回的code或本地错误码",
+                 f"# TYPE {prefix}_requests_total counter"]
+        for path, codes in snapshot["requests"].items():
+            for code, count in codes.items():
+                lines.append(f'{prefix}_requests_total{{path="{_escape(path)}",code="{code}"}} {count}')
+
+        lines += [f"# HELP {prefix}_request_duration_seconds 请求耗时",
+                  f"# TYPE {prefix}_request_duration_seconds histogram"]
+        for path, histogram in snapshot["latency"].items():
+            labels = f'path="{_escape(path)}"'
+            for upper, cumulative in histogram["buckets"]:
+                le = "+Inf" if upper == float("inf") else repr(float(upper))
+                lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_request_duration_seconds_sum{{{labels}}} {histogram["sum"]}')
+            lines.append(f'{prefix}_request_duration_seconds_count{{{labels}}} {histogram["count"]}')
+
+        lines += [f"# HELP {prefix}_events_total token刷新、token_store命中等事件的次数",
+                  f"# TYPE {prefix}_events_total counter"]
+        for name, count in snapshot["events"].items():
+            lines.append(f'{prefix}_events_total{{event="{_escape(name)}"}} {count}')
+
+        lines += [f"# HELP {prefix}_circuit_state 熔断状态, 0: closed, 1: open, 2: half_open",
+                  f"# TYPE {prefix}_circuit_state gauge"]
+        for path, state in snapshot["circuits"].items():
+            lines.append(f'{prefix}_circuit_state{{path="{_escape(path)}"}} {CIRCUIT_STATE_VALUES[state]}')
+
+        for name, histogram in snapshot["histograms"].items():
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for upper, cumulative in histogram["buckets"]:
+                le = "+Inf" if upper == float("inf") else repr(float(upper))
+                lines.append(f'{prefix}_{name}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_{name}_sum {histogram["sum"]}')
+            lines.append(f'{prefix}_{name}_count {histogram["count"]}')
+
+        for name, value in snapshot["gauges"].items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    lines.append(f'{prefix}_{name}{{key="{_escape(key)}"}} {item}')
+            else:
+                lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class _ShardOwner:
+    """标记分片所属线程是否存活"""
+    __slots__ = ('__weakref__',)
+
+
+def _retire(registry: "weakref.ref[MetricsRegistry]", shard: _Shard):
+    registry = registry()
+    if registry is not None:
+        registry._retire(shard)
+
+
+def _merge_histograms(merged: Dict[str, list], histograms: Dict[str, list]):
+    for key, histogram in histograms.copy().items():
+        histogram = list(histogram)
+        current = merged.get(key)
+        merged[key] = histogram if current is None else [a + b for a, b in zip(current, histogram)]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
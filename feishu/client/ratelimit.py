@@ -0,0 +1,122 @@
+import threading
+import time
+from typing import Optional, Dict, List
+
+from feishu.models import ReceiveIdType
+from feishu.utils import FeishuError, RATE_LIMIT_CODES
+
+__all__ = [
+    'TokenBucket', 'RateLimiter'
+]
+
+
+class TokenBucket:
+    """令牌桶, 允许预支令牌: reserve返回拿到令牌前需要等待的秒数, 调用方等待结束即视为拿到"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        # 自适应降速后恢复的上限
+        self.max_rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """按API路由(以及群聊接收者)限流的自适应令牌桶
+
+    - 每个路由(FeishuClient.request的route, 默认为把id替换为":id"的API Path)一个令牌桶,
+      速率默认为rate, 可以用rates单独指定, e.g. {"/im/v1/messages": 50, "/im/v1/messages/:id/reply": 20}
+    - 发往群聊(receive_id_type=chat_id)的消息额外按群限流, 速率为per_chat_rate
+    - 服务端返回限流错误码(RATE_LIMIT_CODES)时速率乘以decrease_factor,
+      之后每连续成功increase_after次速率加increase_step, 直到恢复为初始速率
+    - 令牌桶超过max_buckets个时清理空闲的桶: 已经回满且速率没有被降低(和新建的桶一样),
+      或者超过idle_ttl秒没有使用
+    """
+
+    def __init__(self, rate: float = 50, rates: Optional[Dict[str, float]] = None,
+                 per_chat_rate: Optional[float] = 5, min_rate: float = 1,
+                 decrease_factor: float = 0.5, increase_step: float = 1, increase_after: int = 20,
+                 max_buckets: int = 10000, idle_ttl: float = 600):
+        self.rate = rate
+        self.rates = rates or {}
+        self.per_chat_rate = per_chat_rate
+        self.min_rate = min_rate
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.increase_after = increase_after
+        self.max_buckets = max_buckets
+        self.idle_ttl = idle_ttl
+
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+        # 令牌桶个数超过sweep_at时清理一次
+        self.sweep_at = max_buckets
+
+    def keys(self, api: str, params: dict, payload: dict) -> List[str]:
+        """一次请求需要经过的令牌桶"""
+        keys = [api]
+        if self.per_chat_rate and params.get("receive_id_type") == ReceiveIdType.ChatId and payload:
+            keys.append(f"{api}#{payload.get('receive_id')}")
+        return keys
+
+    def acquire(self, keys: List[str]) -> float:
+        """从每个令牌桶各取一个令牌, 返回需要等待的秒数"""
+        return max(self._bucket(key).reserve() for key in keys)
+
+    def record(self, keys: List[str], error: Optional[Exception] = None):
+        """根据请求结果调整速率"""
+        throttled = isinstance(error, FeishuError) and error.code in RATE_LIMIT_CODES
+        for key in keys:
+            bucket = self._bucket(key)
+            with bucket.lock:
+                if throttled:
+                    bucket.rate = max(self.min_rate, bucket.rate * self.decrease_factor)
+                    bucket.capacity = min(bucket.capacity, bucket.rate)
+                    bucket.tokens = min(bucket.tokens, 0)
+                    bucket.successes = 0
+                elif error is None:
+                    bucket.successes += 1
+                    if bucket.successes >= self.increase_after and bucket.rate < bucket.max_rate:
+                        bucket.rate = min(bucket.max_rate, bucket.rate + self.increase_step)
+                        bucket.capacity = bucket.rate
+                        bucket.successes = 0
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    api = key.split("#", 1)[0]
+                    rate = self.per_chat_rate if "#" in key else self.rates.get(api, self.rate)
+                    if len(self.buckets) >= self.sweep_at:
+                        self._sweep()
+                    bucket = self.buckets[key] = TokenBucket(rate)
+        return bucket
+
+    def _sweep(self):
+        """清理空闲的令牌桶, 调用时需持有self.lock"""
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            # 和record互斥, 避免读到调整了一半的速率
+            with bucket.lock:
+                idle = now - bucket.updated
+                refilled = bucket.rate >= bucket.max_rate and \
+                    bucket.tokens + idle * bucket.rate >= bucket.capacity
+            if refilled or idle > self.idle_ttl:
+                del self.buckets[key]
+        # 剩下的都在使用中时, 等桶的个数翻倍后再清理, 均摊O(1)
+        self.sweep_at = max(self.max_buckets, len(self.buckets) * 2)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Optional, Callable
+
+from feishu.stores import token_ttl
+
+__all__ = [
+    'TokenRefresher'
+]
+
+logger = logging.getLogger("feishu")
+
+
+class TokenRefresher:
+    """后台提前刷新tenant_access_token
+
+    token写入token_store时有效期已被缩短了TOKEN_UPDATE_TIME, 飞书在这之后才会发放新token(之前只会返回同一个token),
+    所以刷新器按token_store中的剩余有效期, 在过期后[0, jitter)秒内的随机时间刷新, 避免多个进程集中刷新;
+    启动时token_store中已有有效的token则不刷新; 刷新失败后按retry_interval(同样带随机抖动)重试。
+    异步模式下是event_loop中的一个task, 同步模式下是一个daemon线程。
+    """
+
+    def __init__(self, client: "FeishuClient", jitter: float = 300, retry_interval: float = 30,
+                 on_refresh: Optional[Callable[[float, Optional[Exception]], None]] = None):
+        """
+        Args:
+            client: FeishuClient
+            jitter: token_store中的token过期后, 延后刷新的随机时间上限(秒), 需小于TOKEN_UPDATE_TIME
+            retry_interval: 刷新失败后的重试间隔(秒)
+            on_refresh: 每次刷新后的回调, 参数为(刷新耗时秒数, 失败时的异常 or None)
+        """
+        self.client = client
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self.on_refresh = on_refresh
+
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._task: Optional[asyncio.Future] = None
+
+    @property
+    def started(self) -> bool:
+        """是否启动过, stop之后仍为True, 不会再被启动"""
+        return self._thread is not None or self._task is not None or self.stopped
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def start(self):
+        if self.started:
+            return
+        if self.client.run_async:
+            self._task = asyncio.ensure_future(self._run_async(), loop=self.client.event_loop)
+        else:
+            self._thread = threading.Thread(target=self._run_sync, name="feishu-token-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止刷新, 停止后start不再生效"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def next_delay(self, ttl: Optional[float]) -> float:
+        """距离下次刷新的秒数
+        Args:
+            ttl: token_store中token的剩余有效期, None表示本次刷新失败
+        """
+        if ttl is None:
+            return self.retry_interval * random.uniform(0.5, 1.5)
+        return max(ttl + random.uniform(0, self.jitter), 1)
+
+    def first_delay(self, ttl: Optional[float]) -> float:
+        """启动后第一次刷新的秒数, token_store中已有有效的token(e.g. 其他进程刷新的)时不立刻刷新"""
+        return self.next_delay(ttl) if ttl else 0
+
+    def _run_sync(self):
+        try:
+            delay = self.first_delay(self.client.token_store.ttl("token"))
+        except Exception:
+            delay = 0
+        while not self._stopped.wait(delay):
+            start = time.monotonic()
+            try:
+                ttl = self.refresh_sync()
+            except Exception as e:
+                self._report(time.monotonic() - start, e)
+                delay = self.next_delay(None)
+            else:
+                self._report(time.monotonic() - start, None)
+                delay = self.next_delay(ttl)
+
+    async def _run_async(self):
+        try:
+            delay = self.first_delay(await self.client.token_store.ttl("token"))
+        except Exception:
+            delay = 0
+        while not self._stopped.is_set():
+            await asyncio.sleep(delay)
+            start = time.monotonic()
+            try:
+                ttl = await self.refresh_async()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._report(time.monotonic() - start, e)
+                delay = self.next_delay(None)
+            else:
+                self._report(time.monotonic() - start, None)
+                delay = self.next_delay(ttl)
+
+    def refresh_sync(self) -> float:
+        """刷新一次token, 返回token_store中token的剩余有效期
+
+        和请求时获取token一样先拿token_store的刷新锁, 拿到锁后token_store中已有有效的token
+        (其他进程的刷新器刚刷新过)时不再刷新, 多个进程共享token_store时每个周期只有一个进程请求token;
+        没拿到锁时说明其他进程正在刷新, 按当前的剩余有效期(通常为0)在[0, jitter)秒后再看
+        """
+        client, store = self.client, self.client.token_store
+        with client._token_lock:
+            lock_id = store.acquire_lock("token", client.token_lock_ttl)
+            if lock_id is None:
+                return store.ttl("token") or 0
+            try:
+                ttl = store.ttl("token")
+                if ttl and store.get("token"):
+                    return ttl
+                _, expire = client._refresh_token_sync()
+            finally:
+                store.release_lock("token", lock_id)
+        ttl = store.ttl("token")
+        return token_ttl(expire) if ttl is None else ttl
+
+    async def refresh_async(self) -> float:
+        """refresh_sync的异步版本"""
+        client, store = self.client, self.client.token_store
+        lock_id = await store.acquire_lock("token", client.token_lock_ttl)
+        if lock_id is None:
+            return await store.ttl("token") or 0
+        try:
+            ttl = await store.ttl("token")
+            if ttl and await store.get("token"):
+                return ttl
+            _, expire = await client._refresh_token_async()
+        finally:
+            await store.release_lock("token", lock_id)
+        ttl = await store.ttl("token")
+        return token_ttl(expire) if ttl is None else ttl
+
+    def _report(self, latency: float, error: Optional[Exception]):
+        if error:
+            logger.warning(f"后台刷新token失败: {error!r}, 耗时{latency:.3f}s")
+        if self.on_refresh:
+            try:
+                self.on_refresh(latency, error)
+            except Exception:
+                logger.exception("token刷新回调on_refresh出错")
@@ -0,0 +1,83 @@
+import logging
+import random
+import time
+from typing import Optional, Callable, Iterable
+
+from feishu.utils import FeishuError, ERRORS, RATE_LIMIT_CODES
+
+__all__ = [
+    'RetryPolicy', 'RETRYABLE_CODES', 'SAFE_RETRY_CODES'
+]
+
+logger = logging.getLogger("feishu")
+
+# 默认重试的错误码: 连接失败、返回无法解析、服务端无有效错误信息, 以及服务端限流
+RETRYABLE_CODES = {
+    ERRORS.CONNECT_FAILED,
+    ERRORS.FAILED_TO_ESTABLISH_CONNECTION,
+    ERRORS.UNABLE_TO_PARSE_SERVER_RESPONSE,
+    ERRORS.UNKNOWN_SERVER_ERROR,
+} | RATE_LIMIT_CODES
+# 非幂等请求(没有uuid的POST)只在确定服务端没有处理时重试: 没连上服务器, 或者被限流拒绝;
+# FAILED_TO_ESTABLISH_CONNECTION包含读超时, 此时请求可能已经被处理, 不能重试
+SAFE_RETRY_CODES = {ERRORS.CONNECT_FAILED} | RATE_LIMIT_CODES
+
+
+class RetryPolicy:
+    """请求重试策略: 指数退避 + 随机抖动(full jitter)
+
+    第n次重试前等待 random.uniform(0, min(max_delay, base_delay * 2 ** (n - 1))) 秒,
+    重试次数达到max_attempts或总耗时将超过max_elapsed时不再重试;
+    非幂等的请求只重试safe_codes中的错误
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.2, max_delay: float = 5,
+                 max_elapsed: float = 30, retryable_codes: Optional[Iterable[int]] = None,
+                 safe_codes: Optional[Iterable[int]] = None,
+                 on_complete: Optional[Callable[[str, int, float, Optional[Exception]], None]] = None):
+        """
+        Args:
+            max_attempts: 最多请求几次(包含第一次)
+            base_delay: 第一次重试前的最长等待秒数
+            max_delay: 单次重试前的最长等待秒数
+            max_elapsed: 从第一次请求开始, 超过这个秒数后不再重试
+            retryable_codes: 可以重试的FeishuError.code, 默认为RETRYABLE_CODES
+            safe_codes: 非幂等请求也可以重试的FeishuError.code(需同时在retryable_codes中), 默认为SAFE_RETRY_CODES
+            on_complete: 每个请求结束(成功或最终失败)后的回调, 参数为(API Path, 请求次数, 总耗时秒数, 异常 or None)
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.retryable_codes = set(RETRYABLE_CODES if retryable_codes is None else retryable_codes)
+        self.safe_codes = set(SAFE_RETRY_CODES if safe_codes is None else safe_codes)
+        self.on_complete = on_complete
+
+    def retryable(self, error: Exception, idempotent: bool = True) -> bool:
+        if not isinstance(error, FeishuError) or error.code not in self.retryable_codes:
+            return False
+        return idempotent or error.code in self.safe_codes
+
+    def next_delay(self, attempt: int, start: float, error: Exception,
+                   idempotent: bool = True) -> Optional[float]:
+        """第attempt次请求失败后, 距离下次重试的秒数; 不应再重试时返回None
+        Args:
+            attempt: 已经请求的次数
+            start: 第一次请求时的time.monotonic()
+            error: 本次请求的异常
+            idempotent: 请求是否可以安全地重复发送(GET, 或带uuid的POST)
+        """
+        if attempt >= self.max_attempts or not self.retryable(error, idempotent):
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if time.monotonic() - start + delay > self.max_elapsed:
+            return None
+        logger.debug("请求失败, %.3fs后第%d次重试: %r", delay, attempt, error)
+        return delay
+
+    def complete(self, api: str, attempts: int, start: float, error: Optional[Exception] = None):
+        if self.on_complete:
+            try:
+                self.on_complete(api, attempts, time.monotonic() - start, error)
+            except Exception:
+                logger.exception("重试回调on_complete出错")
@@ -0,0 +1,114 @@
+import functools
+import re
+import time
+from typing import Optional
+
+__all__ = [
+    'RequestTrace', 'create_trace_config', 'redact', 'normalize_route'
+]
+
+# API Path中的id段: 飞书的各类id(om_、oc_、ou_等前缀)、纯数字, 以及含数字的长字符串(e.g. file_token、uuid)
+ID_SEGMENT = re.compile(r"^(?:(?:om|oc|ou|on|od|omt|cli|img|file)_[\w-]+|\d+|(?=[\w-]*\d)[\w-]{16,})$")
+
+# 日志中需要隐藏的header/payload字段
+REDACTED_KEYS = {"Authorization", "app_secret", "app_access_token", "tenant_access_token"}
+
+
+class RequestTrace:
+    """一次HTTP请求(每次重试各算一次)的结构化记录, 请求结束后传给FeishuClient的on_request回调
+
+    - method, path: 请求方法和API Path
+    - route: 路由模板, 即把path中的id替换为":id"后的结果, metrics按route统计
+    - status: HTTP状态码, 没有收到返回时为None
+    - code: 飞书返回的code, 或者本地错误码(ERRORS), 成功为0
+    - request_bytes, response_bytes: 请求体和返回体的字节数, 无法统计时为None
+    - dns, connect, ttfb, total: 耗时(秒), total为发出请求到解析完返回值;
+      dns和connect只有异步模式(aiohttp)能统计, 复用已有连接时为0, 同步模式下为None
+    - error: 失败时的异常
+    """
+    __slots__ = ('method', 'path', 'route', 'status', 'code', 'request_bytes', 'response_bytes',
+                 'dns', 'connect', 'ttfb', 'total', 'error', 'start', 'dns_start', 'connect_start')
+
+    def __init__(self, method: str, path: str, route: Optional[str] = None):
+        self.method = method
+        self.path = path
+        self.route = route or normalize_route(path)
+        self.status: Optional[int] = None
+        self.code: Optional[int] = None
+        self.request_bytes: Optional[int] = None
+        self.response_bytes: Optional[int] = None
+        self.dns: Optional[float] = None
+        self.connect: Optional[float] = None
+        self.ttfb: Optional[float] = None
+        self.total: Optional[float] = None
+        self.error: Optional[Exception] = None
+        self.start = time.perf_counter()
+        self.dns_start = 0.
+        self.connect_start = 0.
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__[:12])
+        return f"{self.__class__.__name__}({fields})"
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_route(path: str) -> str:
+    """把API Path中的id段替换为":id", 作为metrics、熔断和限流的key, 避免每个id产生一个新的key
+    e.g. /im/v1/messages/om_xxx/reply -> /im/v1/messages/:id/reply
+    """
+    return "/".join(":id" if ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+
+def create_trace_config():
+    """aiohttp的TraceConfig, 把DNS解析、建立连接和首字节的耗时记录到请求的RequestTrace中
+
+    请求时通过trace_request_ctx传入RequestTrace, 没有传入的请求(e.g. fetch)不统计
+    """
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        trace = context.trace_request_ctx
+        if isinstance(trace, RequestTrace):
+            trace.dns = trace.connect = 0.
+
+    async def on_dns_resolvehost_start(session, context, params):
+        trace = context.trace_request_ctx
+        if isinstance(trace, RequestTrace):
+            trace.dns_start = time.perf_counter()
+
+    async def on_dns_resolvehost_end(session, context, params):
+        trace = context.trace_request_ctx
+        if isinstance(trace, RequestTrace):
+            trace.dns += time.perf_counter() - trace.dns_start
+
+    async def on_connection_create_start(session, context, params):
+        trace = context.trace_request_ctx
+        if isinstance(trace, RequestTrace):
+            trace.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params):
+        trace = context.trace_request_ctx
+        if isinstance(trace, RequestTrace):
+            # 建立连接的过程包含了DNS解析, 这里只算TCP/TLS握手
+            trace.connect = time.perf_counter() - trace.connect_start - trace.dns
+
+    async def on_request_end(session, context, params):
+        trace = context.trace_request_ctx
+        if isinstance(trace, RequestTrace):
+            trace.ttfb = time.perf_counter() - trace.start
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+def redact(obj: Optional[dict]) -> Optional[dict]:
+    """隐藏headers/payload中的token和secret, 只在输出debug日志时调用"""
+    if not obj or REDACTED_KEYS.isdisjoint(obj):
+        return obj
+    return {key: "***" if key in REDACTED_KEYS else value for key, value in obj.items()}
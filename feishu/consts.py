@@ -19,3 +19,5 @@ ENCRYPT_KEY = config.ENCRYPT_KEY
 TOKEN_EXPIRE_TIME = 7200  # token时效
 TOKEN_UPDATE_TIME = 1800  # token提前更新的时间
 BATCH_SEND_SIZE = 200  # 批量发送消息列表的大小限制
+EVENT_DEDUP_TTL = 7 * 3600  # 事件去重的时效, 飞书推送失败后在15秒、5分钟、1小时、6小时后重推
+EVENT_DEDUP_SIZE = 10000  # 进程内事件去重最多记录的event_id个数
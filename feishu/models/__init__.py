@@ -1,13 +1,14 @@
 from .event.base import (Event, EventContent, EventType)
 from .message.base import (SendMessage, MessageContent, MessageType, ReceiveIdType)
 
-from .event.receive_message import ReceiveMessageEven, EmojiMessageEven
+from .event.receive_message import ReceiveMessageEven, EmojiMessageEven, ChatType
 
 from .message.im.message import (TextMessage, PostMessage, ImageMessage, InteractiveMessage, ShareChatMessage,
                                  ShareUserMessage, AudioMessage, MediaMessage, FileMessage, StickerMessage)
 
 from .message.im.content import (TextContent, PostContent, ImageContent, InteractiveContent, ShareChatContent,
-                                 ShareUserContent, AudioContent, MediaContent, FileContent, StickerContent)
+                                 ShareUserContent, AudioContent, MediaContent, FileContent, StickerContent,
+                                 CONTENT_MODELS)
 
 __all__ = []
 
@@ -19,7 +20,7 @@ __all__ += [
 
 # even
 __all__ += [
-    "ReceiveMessageEven"
+    "ReceiveMessageEven", "ChatType"
 ]
 
 # message-im
@@ -31,4 +32,5 @@ __all__ += [
 __all__ += [
     "TextContent", "PostContent", "ImageContent", "InteractiveContent", "ShareChatContent",
     "ShareUserContent", "AudioContent", "MediaContent", "FileContent", "StickerContent",
+    "CONTENT_MODELS",
 ]
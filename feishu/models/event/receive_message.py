@@ -1,12 +1,11 @@
-import json
 from enum import Enum
-from typing import Union, Optional
-from pydantic import BaseModel
+from typing import Union, Optional, List, Any
+from pydantic import BaseModel, ValidationError, validator
 
 from .base import UserID, EventContent
 from ..message.base import MessageType
-from ..message.im.content import (TextContent, PostContent, ImageContent, InteractiveContent, ShareChatContent,
-                                  ShareUserContent, AudioContent, MediaContent, FileContent, StickerContent)
+from ..message.im.content import CONTENT_MODELS
+from feishu.utils import default_codec
 
 __all__ = [
     'SenderType', 'ChatType',
@@ -73,29 +72,40 @@ class Message(BaseModel):
     }
     """
     message_id: str
-    message_type: MessageType
-    content: Union[
-        TextContent, PostContent, ImageContent, InteractiveContent, ShareChatContent,
-        ShareUserContent, AudioContent, MediaContent, FileContent, StickerContent, dict, str
-    ]
+    # 新增的消息类型(e.g. merge_forward)保留为str
+    message_type: Union[MessageType, str]
+    # 按message_type解析为CONTENT_MODELS中的模型, 未知类型或解析失败时为dict
+    # 声明为Any, 避免pydantic再逐个尝试Union中的模型
+    content: Any
     root_id: Optional[str]
     parent_id: Optional[str]
     create_time: Optional[str]
     chat_id: Optional[str]
     chat_type: Optional[ChatType]
-    mentions: Optional[Mentions]
+    mentions: Optional[List[Mentions]]
+
+    @validator("content", pre=True)
+    def parse_content(cls, content, values):
+        if isinstance(content, (str, bytes)):
+            try:
+                content = default_codec().loads(content)
+            except ValueError:
+                return content
+        content_cls = CONTENT_MODELS.get(values.get("message_type"))
+        if content_cls is None or not isinstance(content, dict):
+            return content
+        try:
+            model = content_cls(**content)
+        except ValidationError:
+            return content
+        # 没有一个字段对得上(e.g. 收到的富文本没有zh_cn这一层)时保留原始的dict, 避免丢失内容
+        return model if model.__fields_set__ or not content else content
 
 
 class ReceiveMessageEven(EventContent):
     sender: Sender
     message: Message
 
-    def __init__(self, **kwargs):
-        content = kwargs['message']['content']
-        if type(content) == str:
-            kwargs['message']['content'] = json.loads(content)
-        super(ReceiveMessageEven, self).__init__(**kwargs)
-
 
 class ReactionType(BaseModel):
     emoji_type: str
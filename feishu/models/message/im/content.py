@@ -1,12 +1,13 @@
 from enum import Enum
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Dict, Type
 from pydantic import BaseModel
 
-from ..base import MessageContent
+from ..base import MessageContent, MessageType
 
 __all__ = [
     "TextContent", "PostContent", "ImageContent", "InteractiveContent", "ShareChatContent",
     "ShareUserContent", "AudioContent", "MediaContent", "FileContent", "StickerContent",
+    "CONTENT_MODELS",
 ]
 
 
@@ -96,3 +97,18 @@ class StickerContent(MessageContent):
     # 可通过[接收消息事件]的推送获取表情包 file_key。
     # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/events/receive
     file_key: str
+
+
+# msg_type -> content的模型
+CONTENT_MODELS: Dict[str, Type[MessageContent]] = {
+    MessageType.TEXT: TextContent,
+    MessageType.POST: PostContent,
+    MessageType.IMAGE: ImageContent,
+    MessageType.INTERACTIVE: InteractiveContent,
+    MessageType.SHARE_CHAT: ShareChatContent,
+    MessageType.SHARE_USER: ShareUserContent,
+    MessageType.AUDIO: AudioContent,
+    MessageType.MEDIA: MediaContent,
+    MessageType.FILE: FileContent,
+    MessageType.STICKER: StickerContent,
+}
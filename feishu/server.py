@@ -9,9 +9,9 @@ from sanic.log import logger
 from consts import SYS_PATH
 sys.path.append(SYS_PATH)
 
-from apis import setup_event_blueprint
+from apis import setup_event_blueprint, Router
 from consts import VERIFY_TOKEN, ENCRYPT_KEY, PATH_EVENT
-from models import EventContent, Event
+from models import Event
 from client import FeishuClient
 
 
@@ -19,32 +19,31 @@ def create_sanic_server(verify_token: str = '', encrypt_key: str = '') -> Sanic:
     # 订阅事件(models.event)
     app = Sanic("feishu")
 
-    async def on_event(event: [Event]):
+    router = Router()
+    # 所有事件共用一个client, token只在过期后才重新获取(默认的MemoryStore属于client实例)
+    client = FeishuClient()
+
+    @router.on("im.message.receive_v1")
+    async def on_message(event: [Event]):
         await asyncio.sleep(1)
-        event_type = event.header.event_type
-        logger.info(f"event_type: {event_type}")
         logger.info(f"event: {event}")
-        if event_type == "im.message.receive_v1":
-            async def send_message(event: [EventContent]):
-                client = FeishuClient()
-                receive_id = event.sender.sender_id.open_id
-                text = f"""<at user_id="ou_1e20496774ba8483cdcb0cf8398296b0">TEST</at> {event.message}"""
-                message_id = client.send_text(text, receive_id)
-                print(f"message_id: {message_id}")
-            await send_message(event.event)
-        elif event_type == "im.message.reaction.created_v1":
-            async def send_message(event: [EventContent]):
-                client = FeishuClient()
-                receive_id = event.user_id.open_id
-                text = f"""<at user_id="ou_1e20496774ba8483cdcb0cf8398296b0">TEST</at> {event.reaction_type.emoji_type}"""
-                message_id = client.send_text(text, receive_id)
-                print(f"message_id: {message_id}")
+        receive_id = event.event.sender.sender_id.open_id
+        text = f"""<at user_id="ou_1e20496774ba8483cdcb0cf8398296b0">TEST</at> {event.event.message}"""
+        message_id = client.send_text(text, receive_id)
+        print(f"message_id: {message_id}")
 
-            await send_message(event.event)
+    @router.on("im.message.reaction.created_v1")
+    async def on_reaction(event: [Event]):
+        await asyncio.sleep(1)
+        logger.info(f"event: {event}")
+        receive_id = event.event.user_id.open_id
+        text = f"""<at user_id="ou_1e20496774ba8483cdcb0cf8398296b0">TEST</at> {event.event.reaction_type.emoji_type}"""
+        message_id = client.send_text(text, receive_id)
+        print(f"message_id: {message_id}")
 
     event_app = Blueprint(name="event_app")
     setup_event_blueprint("sanic", blueprint=event_app, path=PATH_EVENT,
-                          on_event=on_event, verify_token=verify_token, encrypt_key=encrypt_key)
+                          on_event=router, verify_token=verify_token, encrypt_key=encrypt_key)
 
     app.blueprint(event_app)
     logger.setLevel(logging.INFO)
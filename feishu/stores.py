@@ -1,10 +1,31 @@
+import asyncio
+import secrets
 import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Executor
 from typing import Optional
 
-from .consts import TOKEN_EXPIRE_TIME, TOKEN_UPDATE_TIME
+from .consts import TOKEN_EXPIRE_TIME, TOKEN_UPDATE_TIME, EVENT_DEDUP_TTL, EVENT_DEDUP_SIZE
 
-__all__ = ['TokenStore', 'MemoryStore', 'RedisStore']
+__all__ = ['TokenStore', 'MemoryStore', 'RedisStore', 'LayeredStore',
+           'AsyncTokenStore', 'AsyncMemoryStore', 'AsyncRedisStore', 'SyncStoreAdapter',
+           'EventIdStore', 'MemoryEventIdStore', 'RedisEventIdStore', 'token_ttl']
+
+# 只删除自己持有的锁, 避免锁超时后误删其他进程新拿到的锁
+REDIS_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def token_ttl(expire: float) -> int:
+    """token在store中的有效期: 飞书在剩余有效期不足TOKEN_UPDATE_TIME时才会发放新token, 所以提前这么久过期;
+    飞书返回的剩余有效期已经不足TOKEN_UPDATE_TIME时只保存1秒, 下次获取时就能拿到新token
+    """
+    return max(int(expire) - TOKEN_UPDATE_TIME, 1)
 
 
 class TokenStore(ABC):
@@ -16,16 +37,36 @@ class TokenStore(ABC):
     def get(self, key: str):
         pass
 
+    def ttl(self, key: str) -> Optional[float]:
+        """剩余有效时间(秒), 不存在或不支持时返回None"""
+        return None
+
+    def get_nowait(self, key: str) -> Optional[str]:
+        """不涉及IO的快速读取, 读不到(或需要IO才能读到)时返回None, 调用方再走get"""
+        return None
+
+    def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        """获取key的刷新锁(租约), ttl秒后自动失效, 成功返回锁标识, 已被占用返回None
+
+        默认实现直接成功: 单进程内的并发已经由client自己的锁合并, 多进程共享的store需要重写
+        """
+        return secrets.token_hex(8)
+
+    def release_lock(self, key: str, lock_id: str):
+        """释放acquire_lock拿到的锁, 只有锁标识一致时才释放"""
+        pass
+
 
 class MemoryStore(TokenStore):
-    """ 内存存储 """
-    cache = {}
-    timings = {}
+    """ 内存存储, 缓存属于实例, 多个client需要共享token时传入同一个MemoryStore """
+
+    def __init__(self):
+        self.cache = {}
+        self.timings = {}
 
     def set(self, key: str, value: str, expire: float = TOKEN_EXPIRE_TIME):
-        expire -= TOKEN_UPDATE_TIME
         self.cache[key] = value
-        self.timings[key] = time.time() + expire
+        self.timings[key] = time.time() + token_ttl(expire)
 
     def get(self, key: str):
         expired_time = self.timings.get(key)
@@ -34,6 +75,15 @@ class MemoryStore(TokenStore):
             self.cache.pop(key, None)
         return self.cache.get(key)
 
+    def ttl(self, key: str) -> Optional[float]:
+        expired_time = self.timings.get(key)
+        if expired_time and key in self.cache:
+            return max(expired_time - time.time(), 0)
+        return None
+
+    def get_nowait(self, key: str) -> Optional[str]:
+        return self.get(key)
+
 
 class RedisStore(TokenStore):
     """ Redis存储 """
@@ -46,8 +96,291 @@ class RedisStore(TokenStore):
             self.client = redis.Redis()
 
     def set(self, key: str, value: str, expire: int = TOKEN_EXPIRE_TIME):
-        expire -= TOKEN_UPDATE_TIME
-        self.client.setex(key, expire, value)
+        self.client.setex(key, token_ttl(expire), value)
+
+    def get(self, key: str):
+        value = self.client.get(key)
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def ttl(self, key: str) -> Optional[float]:
+        ttl = self.client.pttl(key)
+        if ttl is None or ttl < 0:
+            return None
+        return ttl / 1000
+
+    def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        lock_id = secrets.token_hex(8)
+        if self.client.set(key + ":lock", lock_id, nx=True, px=int(ttl * 1000)):
+            return lock_id
+        return None
+
+    def release_lock(self, key: str, lock_id: str):
+        self.client.eval(REDIS_RELEASE_LOCK, 1, key + ":lock", lock_id)
+
+
+class LayeredStore(TokenStore):
+    """ 两级存储: 进程内缓存(L1) + 共享存储(L2, e.g. RedisStore)
+
+    读取时优先读L1, 只有L1中的token临近过期(L2中的剩余有效期 - refresh_ahead)或被invalidate后才会读L2,
+    这样每次请求取token只是一次dict查找; 写入时同时写L1和L2。
+    """
+
+    def __init__(self, store: TokenStore, refresh_ahead: float = 60, local_ttl: float = 60):
+        """
+        Args:
+            store: 共享存储(L2)
+            refresh_ahead: L1比L2提前多少秒过期, 过期后重新读L2以拿到其他进程刷新的token
+            local_ttl: L2无法提供剩余有效时间(ttl返回None)时, L1的缓存时间
+        """
+        self.store = store
+        self.refresh_ahead = refresh_ahead
+        self.local_ttl = local_ttl
+        # key -> (value, L1过期时间), 存成一个tuple保证读写是原子的
+        self.cache = {}
+
+    def set(self, key: str, value: str, expire: float = TOKEN_EXPIRE_TIME):
+        self.store.set(key, value, expire)
+        self._set_local(key, value, token_ttl(expire) - self.refresh_ahead)
 
     def get(self, key: str):
-        self.client.get(key)
+        value = self.get_nowait(key)
+        if value is None:
+            value = self.store.get(key)
+            if value is None:
+                self.invalidate(key)
+            else:
+                ttl = self.store.ttl(key)
+                self._set_local(key, value, self.local_ttl if ttl is None else ttl - self.refresh_ahead)
+        return value
+
+    def ttl(self, key: str) -> Optional[float]:
+        return self.store.ttl(key)
+
+    def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        return self.store.acquire_lock(key, ttl)
+
+    def release_lock(self, key: str, lock_id: str):
+        self.store.release_lock(key, lock_id)
+
+    def get_nowait(self, key: str) -> Optional[str]:
+        value, expired_time = self.cache.get(key, (None, 0))
+        if expired_time > time.time():
+            return value
+        return None
+
+    def invalidate(self, key: Optional[str] = None):
+        """丢弃L1中的缓存, 下次读取时从L2读取, key为None时丢弃全部"""
+        if key is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(key, None)
+
+    def _set_local(self, key: str, value: str, ttl: float):
+        self.cache[key] = (value, time.time() + ttl)
+
+
+# ********************** async ********************** #
+class AsyncTokenStore(ABC):
+    """异步模式下的TokenStore, client直接await读写, 不再经过线程池"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, expire: float = TOKEN_EXPIRE_TIME):
+        pass
+
+    @abstractmethod
+    async def get(self, key: str):
+        pass
+
+    async def ttl(self, key: str) -> Optional[float]:
+        """剩余有效时间(秒), 不存在或不支持时返回None"""
+        return None
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        """同TokenStore.acquire_lock"""
+        return secrets.token_hex(8)
+
+    async def release_lock(self, key: str, lock_id: str):
+        """同TokenStore.release_lock"""
+        pass
+
+
+class AsyncMemoryStore(AsyncTokenStore):
+    """ 内存存储(异步) """
+
+    def __init__(self):
+        self.store = MemoryStore()
+
+    async def set(self, key: str, value: str, expire: float = TOKEN_EXPIRE_TIME):
+        self.store.set(key, value, expire)
+
+    async def get(self, key: str):
+        return self.store.get(key)
+
+    async def ttl(self, key: str) -> Optional[float]:
+        return self.store.ttl(key)
+
+
+class AsyncRedisStore(AsyncTokenStore):
+    """ Redis存储(异步), 基于redis.asyncio """
+
+    def __init__(self, redis_url: Optional[str] = None):
+        from redis import asyncio as aioredis
+        if redis_url:
+            self.client = aioredis.Redis.from_url(redis_url)
+        else:
+            self.client = aioredis.Redis()
+
+    async def set(self, key: str, value: str, expire: int = TOKEN_EXPIRE_TIME):
+        await self.client.setex(key, token_ttl(expire), value)
+
+    async def get(self, key: str):
+        value = await self.client.get(key)
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    async def ttl(self, key: str) -> Optional[float]:
+        ttl = await self.client.pttl(key)
+        if ttl is None or ttl < 0:
+            return None
+        return ttl / 1000
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        lock_id = secrets.token_hex(8)
+        if await self.client.set(key + ":lock", lock_id, nx=True, px=int(ttl * 1000)):
+            return lock_id
+        return None
+
+    async def release_lock(self, key: str, lock_id: str):
+        await self.client.eval(REDIS_RELEASE_LOCK, 1, key + ":lock", lock_id)
+
+
+class SyncStoreAdapter(AsyncTokenStore):
+    """把同步的TokenStore适配成AsyncTokenStore
+
+    能通过get_nowait直接读到时不切换线程, 否则把阻塞的读写放到executor中执行
+    """
+
+    def __init__(self, store: TokenStore, executor: Optional[Executor] = None):
+        self.store = store
+        self.executor = executor
+
+    async def set(self, key: str, value: str, expire: float = TOKEN_EXPIRE_TIME):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.store.set, key, value, expire)
+
+    async def get(self, key: str):
+        value = self.store.get_nowait(key)
+        if value is None:
+            loop = asyncio.get_running_loop()
+            value = await loop.run_in_executor(self.executor, self.store.get, key)
+        return value
+
+    async def ttl(self, key: str) -> Optional[float]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.store.ttl, key)
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.store.acquire_lock, key, ttl)
+
+    async def release_lock(self, key: str, lock_id: str):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.store.release_lock, key, lock_id)
+
+
+# ********************** event_id ********************** #
+class EventIdStore(ABC):
+    """订阅事件去重: 记录最近收到的event_id, 飞书重推的事件直接回复, 不再处理"""
+
+    @abstractmethod
+    async def add(self, event_id: str) -> bool:
+        """记录event_id, 第一次收到时返回True, 已经收到过(重推)时返回False"""
+        pass
+
+    @abstractmethod
+    async def discard(self, event_id: str):
+        """删除event_id的记录, 事件处理失败时调用, 飞书重推时会再次处理"""
+        pass
+
+
+class MemoryEventIdStore(EventIdStore):
+    """ 内存存储: 按收到的先后顺序记录event_id, 超过ttl或max_size时淘汰最早的 """
+
+    def __init__(self, max_size: int = EVENT_DEDUP_SIZE, ttl: float = EVENT_DEDUP_TTL):
+        """
+        Args:
+            max_size: 最多记录多少个event_id, 决定内存上限
+            ttl: 记录多少秒, 需要覆盖飞书重推的时间范围
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # event_id -> 过期时间, 所有记录的ttl相同, 所以顺序也是过期时间的顺序
+        self.cache: "OrderedDict[str, float]" = OrderedDict()
+
+    async def add(self, event_id: str) -> bool:
+        return self.add_nowait(event_id)
+
+    def add_nowait(self, event_id: str) -> bool:
+        """同add, 不涉及IO"""
+        now = time.time()
+        cache = self.cache
+        expired_time = cache.get(event_id)
+        if expired_time is not None and expired_time > now:
+            return False
+        cache[event_id] = now + self.ttl
+        cache.move_to_end(event_id)
+        # 每次最多淘汰已过期的记录和超出max_size的部分, 均摊O(1)
+        while cache and (len(cache) > self.max_size or next(iter(cache.values())) <= now):
+            cache.popitem(last=False)
+        return True
+
+    async def discard(self, event_id: str):
+        self.discard_nowait(event_id)
+
+    def discard_nowait(self, event_id: str):
+        """同discard, 不涉及IO"""
+        self.cache.pop(event_id, None)
+
+
+class RedisEventIdStore(EventIdStore):
+    """ Redis存储(异步), 多个worker/进程共享: SET key NX EX ttl, 设置成功说明是第一次收到
+
+    同一进程内的重推先由进程内的MemoryEventIdStore挡住, 不再访问Redis
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, ttl: int = EVENT_DEDUP_TTL,
+                 prefix: str = "feishu:event:", local_size: int = EVENT_DEDUP_SIZE):
+        """
+        Args:
+            redis_url: Redis地址, 默认为本机
+            ttl: 记录多少秒
+            prefix: Redis key的前缀
+            local_size: 进程内缓存的event_id个数, 为0时每个事件都访问Redis
+        """
+        from redis import asyncio as aioredis
+        if redis_url:
+            self.client = aioredis.Redis.from_url(redis_url)
+        else:
+            self.client = aioredis.Redis()
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.local = MemoryEventIdStore(local_size, ttl) if local_size else None
+
+    async def add(self, event_id: str) -> bool:
+        if self.local is not None and not self.local.add_nowait(event_id):
+            return False
+        try:
+            return bool(await self.client.set(self.prefix + event_id, 1, nx=True, ex=self.ttl))
+        except BaseException:
+            # Redis没有记录成功, 撤销进程内的记录, 否则飞书重推时会被当作重复事件丢掉
+            if self.local is not None:
+                self.local.discard_nowait(event_id)
+            raise
+
+    async def discard(self, event_id: str):
+        if self.local is not None:
+            self.local.discard_nowait(event_id)
+        await self.client.delete(self.prefix + event_id)
@@ -1,6 +1,5 @@
 import base64
 import hashlib
-from Crypto.Cipher import AES
 
 from .errors import FeishuError, ERRORS
 
@@ -11,6 +10,8 @@ __all__ = [
 
 class AESCipher(object):
     def __init__(self, key):
+        # pycryptodome在收到第一个加密事件时才导入
+        from Crypto.Cipher import AES
         self.bs = AES.block_size
         self.key = hashlib.sha256(AESCipher.str_to_bytes(key)).digest()
 
@@ -26,9 +27,10 @@ class AESCipher(object):
         return s[:-ord(s[len(s) - 1:])]
 
     def decrypt(self, enc):
-        iv = enc[:AES.block_size]
+        from Crypto.Cipher import AES
+        iv = enc[:self.bs]
         cipher = AES.new(self.key, AES.MODE_CBC, iv)
-        return self._unpad(cipher.decrypt(enc[AES.block_size:]))
+        return self._unpad(cipher.decrypt(enc[self.bs:]))
 
     def decrypt_string(self, enc):
         enc = base64.b64decode(enc)
@@ -1,7 +1,9 @@
 from .AES import decrypt_aes as decrypt
-from .errors import FeishuError, ERRORS
+from .errors import FeishuError, ERRORS, RATE_LIMIT_CODES
+from .codec import JSONCodec, StdJSONCodec, OrjsonCodec, default_codec
 
 __all__ = [
     'decrypt',
-    'FeishuError', 'ERRORS'
+    'FeishuError', 'ERRORS', 'RATE_LIMIT_CODES',
+    'JSONCodec', 'StdJSONCodec', 'OrjsonCodec', 'default_codec'
 ]
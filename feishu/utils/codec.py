@@ -0,0 +1,68 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Union, Optional
+
+__all__ = [
+    'JSONCodec', 'StdJSONCodec', 'OrjsonCodec', 'default_codec'
+]
+
+
+class JSONCodec(ABC):
+    """JSON编解码器, client用它序列化请求体、解析返回值和订阅事件"""
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        """序列化为UTF-8编码的bytes, 直接作为请求体发送"""
+        pass
+
+    @abstractmethod
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """解析失败时抛出ValueError"""
+        pass
+
+    def dumps_str(self, obj: Any) -> str:
+        """序列化为str, 用于嵌套在payload中的JSON字符串字段, e.g. 消息的content"""
+        return self.dumps(obj).decode()
+
+
+class StdJSONCodec(JSONCodec):
+    """ 标准库json """
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.dumps_str(obj).encode()
+
+    def dumps_str(self, obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """ orjson, 序列化比标准库快数倍, 需要另外安装: pip install orjson """
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        # 兼容标准库: 允许非str类型的dict key
+        self.option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.orjson.dumps(obj, option=self.option)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return self.orjson.loads(data)
+
+
+_default_codec: Optional[JSONCodec] = None
+
+
+def default_codec() -> JSONCodec:
+    """安装了orjson时使用OrjsonCodec, 否则使用StdJSONCodec"""
+    global _default_codec
+    if _default_codec is None:
+        try:
+            _default_codec = OrjsonCodec()
+        except ImportError:
+            _default_codec = StdJSONCodec()
+    return _default_codec
@@ -1,7 +1,7 @@
 from enum import Enum
 
 __all__ = [
-    'FeishuError', 'ERRORS'
+    'FeishuError', 'ERRORS', 'RATE_LIMIT_CODES'
 ]
 
 
@@ -25,3 +25,13 @@ class ERRORS(int, Enum):
     VALIDATION_ERROR = -6
     MISSING_ENCRYPT_KEY = -7
     CLIENT_CLOSED = -8
+    CIRCUIT_OPEN = -9
+    CONNECT_FAILED = -10  # 没能连上服务器(DNS解析失败、连接被拒绝、连接超时), 请求确定没有发出
+    EVENT_DROPPED = -11  # 事件队列已满, 事件被丢弃, 需要回复非2xx让飞书重推
+
+
+# 服务端的限流错误码
+# 99991400: 应用/接口请求频率超限
+# 230020: 消息发送频率超限
+# 11232, 11233: 发送消息频率超限(旧版消息接口、单个群)
+RATE_LIMIT_CODES = {99991400, 230020, 11232, 11233}
@@ -28,6 +28,16 @@ class TheAPI:
         result = self.client.request(arg2)
         return result
 
+    @allow_async_call
+    def the_caller(self, arg1: str, upper: bool = False) -> str:
+        if upper:
+            return self.the_method(
+                arg1.upper()
+            )
+        return self.client.request(
+            self.the_method(arg1) + "_" + self.client.request("nested")
+        ).replace("_", "-")
+
 
 def test_sync_call():
     api = TheAPI()
@@ -47,6 +57,25 @@ def test_async_call():
     print(res)
 
 
+def test_generated_at_class_definition():
+    assert "the_method_async" in TheAPI.__dict__
+    assert "the_caller_async" in TheAPI.__dict__
+
+
+def test_nested_calls():
+    api = TheAPI()
+    api.client.run_async = False
+    assert api.the_caller("sync") == "sync-ok-nested"
+    assert api.the_caller("sync", upper=True) == "SYNC_ok"
+
+    api.client.run_async = True
+    loop = api.client.event_loop
+    assert loop.run_until_complete(api.the_caller("async")) == "async-ok-nested"
+    assert loop.run_until_complete(api.the_caller("async", upper=True)) == "ASYNC_ok"
+
+
 if __name__ == "__main__":
     test_async_call()
     test_sync_call()
+    test_generated_at_class_definition()
+    test_nested_calls()
@@ -0,0 +1,62 @@
+from feishu.client import FeishuClient, RetryPolicy
+from feishu.consts import BATCH_SEND_SIZE
+from feishu.models import MessageType, TextContent
+from feishu.utils import FeishuError, ERRORS
+
+BATCH_SEND_API = "/message/v4/batch_send/"
+
+
+def test_batch_send_chunks():
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx")
+    payloads = []
+
+    def _sync_request(method, url, payload, **kwargs):
+        if not url.endswith(BATCH_SEND_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        payloads.append(payload)
+        if "user_ids" in payload:
+            raise FeishuError(99991400, "request trigger frequency limit")
+        return {"code": 0, "msg": "ok", "data": {"message_id": f"bm-{len(payloads)}", "invalid_open_ids": []}}
+
+    client._sync_request = _sync_request
+    open_ids = [f"ou_{i}" for i in range(BATCH_SEND_SIZE * 2 + 50)]
+    user_ids = [f"u_{i}" for i in range(10)]
+    results = client.batch_send(MessageType.TEXT, TextContent(text="hello"), open_ids=open_ids, user_ids=user_ids)
+
+    assert [len(p.get("open_ids", p.get("user_ids"))) for p in payloads] == [BATCH_SEND_SIZE, BATCH_SEND_SIZE, 50, 10]
+    assert payloads[0]["content"] == {"text": "hello"}
+    assert [r.message_id for r in results] == ["bm-1", "bm-2", "bm-3", None]
+    assert sum((r.ids for r in results), []) == open_ids + user_ids
+    assert results[-1].id_type == "user_ids" and results[-1].error.code == 99991400
+
+
+
+def test_batch_send_not_resent_after_timeout():
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01))
+    failures = [FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, "read timeout"),
+                FeishuError(ERRORS.CONNECT_FAILED, "connection refused")]
+    payloads = []
+
+    def _sync_request(method, url, payload, **kwargs):
+        if not url.endswith(BATCH_SEND_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        payloads.append(payload)
+        if failures:
+            raise failures.pop(0)
+        return {"code": 0, "msg": "ok", "data": {"message_id": "bm-1", "invalid_open_ids": ["ou_0"]}}
+
+    client._sync_request = _sync_request
+    # 读超时后分片可能已经发出, 不重发
+    first = client.batch_send(MessageType.TEXT, TextContent(text="hello"), open_ids=["ou_0", "ou_1"])
+    assert len(payloads) == 1
+    assert first[0].error.code == ERRORS.FAILED_TO_ESTABLISH_CONNECTION and first[0].invalid_ids is None
+
+    # 没连上服务器时确定没有发出, 可以重试
+    second = client.batch_send(MessageType.TEXT, TextContent(text="hello"), open_ids=["ou_0", "ou_1"])
+    assert len(payloads) == 3
+    assert second[0].message_id == "bm-1" and second[0].invalid_ids == ["ou_0"]
+
+
+if __name__ == "__main__":
+    test_batch_send_chunks()
+    test_batch_send_not_resent_after_timeout()
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from feishu.client import FeishuClient, CircuitBreaker, CircuitState, MetricsRegistry
+from feishu.utils import FeishuError, ERRORS
+
+MESSAGES_API = "/im/v1/messages"
+AUTH_API = "/auth/v3/tenant_access_token/internal/"
+
+
+def test_state_machine():
+    changes = []
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=0.1,
+                             on_state_change=lambda *args: changes.append(args))
+    connection_error = FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, "timeout")
+
+    # 业务错误不计入
+    for _ in range(5):
+        breaker.acquire(MESSAGES_API)
+        breaker.record(MESSAGES_API, FeishuError(230001, "invalid receive_id"))
+    assert breaker.state(MESSAGES_API) == CircuitState.CLOSED
+
+    for _ in range(3):
+        breaker.acquire(MESSAGES_API)
+        breaker.record(MESSAGES_API, connection_error)
+    assert breaker.state(MESSAGES_API) == CircuitState.OPEN
+    with pytest.raises(FeishuError) as e:
+        breaker.acquire(MESSAGES_API)
+    assert e.value.code == ERRORS.CIRCUIT_OPEN
+    # 其他path不受影响
+    breaker.acquire(AUTH_API)
+
+    # 探测失败, 重新熔断
+    time.sleep(0.1)
+    breaker.acquire(MESSAGES_API)
+    assert breaker.state(MESSAGES_API) == CircuitState.HALF_OPEN
+    with pytest.raises(FeishuError):
+        breaker.acquire(MESSAGES_API)
+    breaker.record(MESSAGES_API, connection_error)
+    assert breaker.state(MESSAGES_API) == CircuitState.OPEN
+
+    # 探测成功, 恢复
+    time.sleep(0.1)
+    breaker.acquire(MESSAGES_API)
+    breaker.record(MESSAGES_API)
+    assert breaker.state(MESSAGES_API) == CircuitState.CLOSED
+    breaker.acquire(MESSAGES_API)
+
+    O, H, C = CircuitState.OPEN, CircuitState.HALF_OPEN, CircuitState.CLOSED
+    assert [(old, new) for _, old, new in changes] == [(C, O), (O, H), (H, O), (O, H), (H, C)]
+
+
+def test_client_fail_fast():
+    metrics = MetricsRegistry()
+    traces = []
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", metrics=metrics, on_request=traces.append,
+                          circuit_breaker=CircuitBreaker(failure_threshold=3, recovery_timeout=60))
+    sent = []
+
+    def _sync_request(method, url, payload, **kwargs):
+        if url.endswith(AUTH_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        sent.append(payload)
+        time.sleep(0.05)
+        raise FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, "建立和服务器的请求失败: timeout")
+
+    client._sync_request = _sync_request
+    for _ in range(3):
+        with pytest.raises(FeishuError):
+            client.send_text("hello", "ou_xxx")
+
+    start = time.monotonic()
+    for _ in range(10):
+        with pytest.raises(FeishuError) as e:
+            client.send_text("hello", "ou_xxx")
+        assert e.value.code == ERRORS.CIRCUIT_OPEN
+    assert time.monotonic() - start < 0.05
+    assert len(sent) == 3
+
+    snapshot = metrics.snapshot()
+    assert snapshot["requests"][MESSAGES_API] == {ERRORS.FAILED_TO_ESTABLISH_CONNECTION: 3, ERRORS.CIRCUIT_OPEN: 10}
+    assert snapshot["circuits"] == {MESSAGES_API: CircuitState.OPEN}
+    assert f'feishu_circuit_state{{path="{MESSAGES_API}"}} 1' in metrics.to_prometheus()
+    assert traces[-1].code == ERRORS.CIRCUIT_OPEN and traces[-1].status is None
+
+
+def test_healthy_circuits_evicted():
+    breaker = CircuitBreaker(failure_threshold=2, max_circuits=10)
+    breaker.record("/failing", FeishuError(ERRORS.CONNECT_FAILED, "connection refused"))
+    for i in range(30):
+        breaker.acquire(f"/api/{i}")
+        breaker.record(f"/api/{i}")
+    # 有失败记录的路由保留, 没有失败记录的被清理
+    assert "/failing" in breaker.circuits and len(breaker.circuits) <= 10
+    breaker.record("/failing", FeishuError(ERRORS.CONNECT_FAILED, "connection refused"))
+    assert breaker.state("/failing") == CircuitState.OPEN
+
+
+if __name__ == "__main__":
+    test_state_machine()
+    test_client_fail_fast()
+    test_healthy_circuits_evicted()
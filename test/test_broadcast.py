@@ -0,0 +1,115 @@
+import asyncio
+import json
+import time
+
+from feishu.apis.message import EncodedMessage
+from feishu.client import FeishuClient
+from feishu.models import MessageType
+from feishu.utils import StdJSONCodec, default_codec
+
+MESSAGES_API = "/im/v1/messages"
+TOTAL = 50
+CARD = {
+    "config": {"wide_screen_mode": True},
+    "header": {"title": {"tag": "plain_text", "content": "日报"}},
+    "elements": [{"tag": "div", "text": {"tag": "lark_md", "content": f"**第{i}行** \"引号\" \\ 反斜杠"}}
+                 for i in range(300)],
+}
+
+
+class CountingCodec(StdJSONCodec):
+    """统计序列化dict的次数, 字符串(receive_id)不算"""
+
+    def __init__(self):
+        self.dict_dumps = 0
+
+    def dumps_str(self, obj):
+        if isinstance(obj, dict):
+            self.dict_dumps += 1
+        return super().dumps_str(obj)
+
+
+def check_bodies(bodies: dict):
+    assert sorted(bodies) == sorted(f"ou_{i}" for i in range(TOTAL))
+    uuids = set()
+    for receive_id, body in bodies.items():
+        payload = json.loads(body)
+        assert payload["receive_id"] == receive_id
+        assert payload["msg_type"] == "interactive"
+        assert json.loads(payload["content"]) == CARD
+        uuids.add(payload["uuid"])
+    assert len(uuids) == TOTAL
+
+
+def test_broadcast_sync():
+    codec = CountingCodec()
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", json_codec=codec)
+    bodies = {}
+
+    def _sync_request(method, url, payload, body=None, **kwargs):
+        if not url.endswith(MESSAGES_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        bodies[payload["receive_id"]] = body
+        return {"code": 0, "msg": "ok", "data": {"message_id": "om_" + payload["receive_id"]}}
+
+    client._sync_request = _sync_request
+    client.get_token()
+    receive_ids = [f"ou_{i}" for i in range(TOTAL)]
+    results = list(client.broadcast(MessageType.INTERACTIVE, CARD, receive_ids, concurrency=5))
+
+    assert sorted(r.message_id for r in results) == sorted(f"om_{i}" for i in receive_ids)
+    check_bodies(bodies)
+    # content和消息模板各序列化一次, 和接收者数量无关
+    assert codec.dict_dumps == 2
+
+
+def test_broadcast_async():
+    loop = asyncio.new_event_loop()
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True, event_loop=loop)
+    bodies = {}
+
+    async def _async_request(method, url, payload, body=None, **kwargs):
+        if not url.endswith(MESSAGES_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        await asyncio.sleep(0.001)
+        bodies[payload["receive_id"]] = body
+        return {"code": 0, "msg": "ok", "data": {"message_id": "om_" + payload["receive_id"]}}
+
+    client._async_request = _async_request
+
+    async def main():
+        receive_ids = (f"ou_{i}" for i in range(TOTAL))
+        return [r async for r in client.broadcast(MessageType.INTERACTIVE, CARD, receive_ids, concurrency=5)]
+
+    results = loop.run_until_complete(main())
+    assert all(r.error is None for r in results)
+    check_bodies(bodies)
+    loop.run_until_complete(client.close())
+    loop.close()
+
+
+def test_render_benchmark():
+    rounds = 1000
+    codec = default_codec()
+    content = codec.dumps_str(CARD)
+    message = EncodedMessage(MessageType.INTERACTIVE, CARD, codec)
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        codec.dumps({"receive_id": f"ou_{i}", "msg_type": MessageType.INTERACTIVE,
+                     "content": codec.dumps_str(CARD), "uuid": "0" * 32})
+    encode = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        message.render(f"ou_{i}")
+    render = (time.perf_counter() - start) / rounds
+    print(f"\n{len(content) / 1024:.1f}KB card: encode per receiver {encode * 1e6:.1f}us, "
+          f"render template {render * 1e6:.1f}us")
+    assert render < encode
+
+
+if __name__ == "__main__":
+    test_broadcast_sync()
+    test_broadcast_async()
+    test_render_benchmark()
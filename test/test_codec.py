@@ -0,0 +1,71 @@
+import pytest
+
+from feishu.client import FeishuClient
+from feishu.models import MessageType, ReceiveIdType
+from feishu.utils import StdJSONCodec, OrjsonCodec, default_codec
+
+AUTH_API = "/auth/v3/tenant_access_token/internal/"
+
+
+class CountingCodec(StdJSONCodec):
+    def __init__(self):
+        self.dumps_calls = 0
+        self.loads_calls = 0
+
+    def dumps_str(self, obj):
+        # StdJSONCodec.dumps也是调用dumps_str
+        self.dumps_calls += 1
+        return super().dumps_str(obj)
+
+    def loads(self, data):
+        self.loads_calls += 1
+        return super().loads(data)
+
+
+class FakeResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.text = content.decode()
+
+
+class FakeSession:
+    def __init__(self):
+        self.bodies = []
+
+    def post(self, url, data=None, **kwargs):
+        self.bodies.append(data)
+        if url.endswith(AUTH_API):
+            return FakeResponse(b'{"code":0,"msg":"ok","tenant_access_token":"t-xxx","expire":7200}')
+        return FakeResponse(b'{"code":0,"msg":"ok","data":{"message_id":"om_xxx"}}')
+
+
+def test_codecs_compatible():
+    pytest.importorskip("orjson")
+    obj = {"text": "你好", "msg_type": MessageType.TEXT, "n": [1, 2.5, None, True], 1: "int key"}
+    std, fast = StdJSONCodec(), OrjsonCodec()
+    assert std.loads(std.dumps(obj)) == fast.loads(fast.dumps(obj))
+    assert fast.loads(std.dumps(obj)) == std.loads(fast.dumps_str(obj))
+    assert std.dumps_str({"text": "你好"}) == '{"text":"你好"}'
+    assert isinstance(default_codec(), OrjsonCodec)
+
+
+def test_client_uses_codec():
+    codec = CountingCodec()
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", json_codec=codec)
+    client.session = FakeSession()
+
+    message = {"receive_id": "ou_xxx", "msg_type": MessageType.TEXT, "content": {"text": "你好"}}
+    message_id = client.send(message, ReceiveIdType.OpenId)
+    assert message_id == "om_xxx"
+
+    body = codec.loads(client.session.bodies[-1])
+    assert isinstance(client.session.bodies[-1], bytes)
+    assert codec.loads(body["content"]) == {"text": "你好"}
+    # token请求体 + content + 消息请求体, 以及两次返回值
+    assert codec.dumps_calls == 3
+    assert codec.loads_calls == 2 + 2
+
+
+if __name__ == "__main__":
+    test_codecs_compatible()
+    test_client_uses_codec()
@@ -0,0 +1,102 @@
+import inspect
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from feishu.apis import base
+from feishu.apis.message import MessageAPI
+
+# 先导入第三方依赖, 只统计定义API类(生成async方法)的耗时
+IMPORT_APIS = """
+import time, aiohttp, requests, sanic, pydantic, feishu.models, feishu.utils
+start = time.perf_counter()
+import feishu.apis
+print(time.perf_counter() - start)
+"""
+
+
+def test_cached_async_api(monkeypatch, tmp_path):
+    monkeypatch.setattr(base, "CODEGEN_CACHE_DIR", str(tmp_path))
+    func = MessageAPI.send_text.func
+    cold = base.create_async_api(MessageAPI, func)
+    assert os.listdir(tmp_path)
+
+    # 命中缓存时不再读源码、解析和编译
+    def compile_async_api(owner, func):
+        raise AssertionError("cache miss")
+
+    def getsource(obj):
+        raise AssertionError("source read")
+
+    monkeypatch.setattr(base, "compile_async_api", compile_async_api)
+    monkeypatch.setattr(base.inspect, "getsource", getsource)
+    warm = base.create_async_api(MessageAPI, func)
+    assert warm.__code__.co_code == cold.__code__.co_code
+    assert warm.__code__.co_firstlineno == cold.__code__.co_firstlineno
+    assert inspect.iscoroutinefunction(warm)
+
+
+def test_cache_key_changes_with_source():
+    namespace = {}
+    exec("def api(self):\n    return self.client.request('GET', api='/a')\n", namespace)
+    key_a = base.codegen_cache_key(MessageAPI, namespace["api"])
+    exec("def api(self):\n    return self.client.request('GET', api='/b')\n", namespace)
+    key_b = base.codegen_cache_key(MessageAPI, namespace["api"])
+    assert key_a != key_b
+    assert key_b == base.codegen_cache_key(MessageAPI, namespace["api"])
+
+
+def test_superseded_entries_pruned(monkeypatch, tmp_path):
+    monkeypatch.setattr(base, "CODEGEN_CACHE_DIR", str(tmp_path))
+    func = MessageAPI.send_text.func
+    key = base.codegen_cache_key(MessageAPI, func)
+    prefix = key.rsplit(".", 1)[0]
+    stale = tmp_path / f"{prefix}.{'0' * 32}.pyc"
+    stale.write_bytes(b"stale")
+    other = tmp_path / f"{prefix}_other.{'0' * 32}.pyc"
+    other.write_bytes(b"other")
+
+    base.create_async_api(MessageAPI, func)
+    assert sorted(os.listdir(tmp_path)) == sorted([key + ".pyc", other.name])
+
+
+def test_cache_key_changes_with_codegen(monkeypatch):
+    func = MessageAPI.send_text.func
+    key = base.codegen_cache_key(MessageAPI, func)
+    monkeypatch.setattr(base, "CODEGEN_HASH", "changed")
+    assert base.codegen_cache_key(MessageAPI, func) != key
+
+
+def test_cache_disabled_by_default():
+    env = {k: v for k, v in os.environ.items() if k != "FEISHU_CODEGEN_CACHE"}
+    output = subprocess.run([sys.executable, "-c", "from feishu.apis import base; print(repr(base.CODEGEN_CACHE_DIR))"],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    assert output.strip() == "''"
+
+
+def import_time(cache_dir: str, repeat: int = 5) -> float:
+    env = dict(os.environ, FEISHU_CODEGEN_CACHE=cache_dir)
+    cost = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT_APIS], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        cost.append(float(output))
+    return min(cost)
+
+
+def test_startup_benchmark():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = import_time("")
+        import_time(cache_dir, repeat=1)
+        assert os.listdir(cache_dir)
+        warm = import_time(cache_dir)
+    print(f"\n`import feishu.apis`: cold(no cache) {cold * 1000:.1f}ms, warm(cached) {warm * 1000:.1f}ms")
+    assert warm < cold
+
+
+if __name__ == "__main__":
+    test_cache_key_changes_with_source()
+    test_cache_disabled_by_default()
+    test_startup_benchmark()
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import requests
+
+from feishu.client import FeishuClient
+
+RESPONSE = json.dumps({"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200, "data": {}}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    # keep-alive, 按客户端端口统计用了几个连接
+    protocol_version = "HTTP/1.1"
+    peers = set()
+
+    def do_GET(self):
+        self.peers.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server() -> ThreadingHTTPServer:
+    Handler.peers = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def endpoint(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_shared_connector_reused_and_not_closed():
+    server = start_server()
+
+    async def main():
+        connector = aiohttp.TCPConnector(limit=10)
+        clients = [FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True, endpoint=endpoint(server),
+                                connector=connector) for _ in range(2)]
+        for client in clients:
+            for _ in range(3):
+                await client.request("GET", "/test")
+            assert client.session_async.connector is connector
+        for client in clients:
+            await client.close()
+        # 外部传入的connector由调用方关闭
+        assert not connector.closed
+        await connector.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        server.shutdown()
+    # 两个client的token和业务请求都复用同一个keep-alive连接
+    assert len(Handler.peers) == 1
+
+
+def test_own_connector_options_and_close():
+    server = start_server()
+
+    async def main():
+        client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True, endpoint=endpoint(server),
+                              connection_limit=7, connection_limit_per_host=3)
+        await client.request("GET", "/test")
+        connector = client.session_async.connector
+        assert connector.limit == 7 and connector.limit_per_host == 3
+        await client.close()
+        assert connector.closed
+
+    try:
+        asyncio.run(main())
+    finally:
+        server.shutdown()
+
+
+def test_shared_session_sync():
+    server = start_server()
+    session = requests.Session()
+    urls = []
+    session.hooks["response"].append(lambda resp, *args, **kwargs: urls.append(resp.url))
+    try:
+        clients = [FeishuClient(app_id="cli_xxx", app_secret="xxx", endpoint=endpoint(server), session=session)
+                   for _ in range(2)]
+        for client in clients:
+            assert client.session is session
+            client.request("GET", "/test")
+            asyncio.run(client.close())
+        # client关闭后外部传入的session仍可使用
+        assert session.get(endpoint(server) + "/test").status_code == 200
+    finally:
+        server.shutdown()
+        session.close()
+    assert sum(url.endswith("/test") for url in urls) == 3
+    assert len(Handler.peers) == 1
+
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", connection_limit=7)
+    assert client.session.get_adapter("https://").poolmanager.connection_pool_kw["maxsize"] == 7
+
+
+if __name__ == "__main__":
+    test_shared_connector_reused_and_not_closed()
+    test_own_connector_options_and_close()
+    test_shared_session_sync()
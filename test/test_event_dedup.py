@@ -0,0 +1,263 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+
+import pytest
+from Crypto.Cipher import AES
+
+from feishu.apis import EventReceiver
+from feishu.apis.dispatcher import EventDispatcher
+from feishu.apis.event import find_event_id, payload_event_id
+from feishu.stores import MemoryEventIdStore, RedisEventIdStore
+from feishu.utils import FeishuError, ERRORS
+
+ENCRYPT_KEY = "kudryavka"
+
+
+def make_event(event_id: str, content: str = "hello") -> bytes:
+    return json.dumps({
+        "schema": "2.0",
+        "header": {"event_id": event_id, "token": "t", "create_time": "1603977298000000",
+                   "event_type": "test.event_v1", "tenant_key": "k", "app_id": "cli_x"},
+        "event": {"content": json.dumps({"event_id": "nested", "text": content})},
+    }).encode()
+
+
+def encrypt(key: str, content: bytes) -> bytes:
+    iv, pad = os.urandom(16), 16 - len(content) % 16
+    cipher = AES.new(hashlib.sha256(key.encode()).digest(), AES.MODE_CBC, iv)
+    encrypted = base64.b64encode(iv + cipher.encrypt(content + bytes([pad]) * pad)).decode()
+    return json.dumps({"encrypt": encrypted}).encode()
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    async def set(self, key, value, nx=False, ex=None):
+        if self.down:
+            raise ConnectionError("redis is down")
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+def test_find_event_id():
+    assert find_event_id(make_event("e-1")) == "e-1"
+    assert find_event_id(make_event("e-1").decode()) == "e-1"
+    assert find_event_id(b'{"uuid": "u-1", "type": "event_callback"}') == "u-1"
+    assert find_event_id(b'{"encrypt": "abc"}') is None
+
+
+def make_sorted_event(event_id: str) -> bytes:
+    """key按字母排序: event在header之前, 事件内容中有未转义的同名key"""
+    payload = json.loads(make_event(event_id))
+    payload["event"]["operator"] = {"uuid": "operator-uuid", "event_id": "operator-event"}
+    return json.dumps(payload, sort_keys=True).encode()
+
+
+def test_find_event_id_reordered_keys():
+    body = make_sorted_event("e-1")
+    # 正则不能确定event_id时交给解析后的payload
+    assert find_event_id(body) is None
+    assert find_event_id(body.decode()) is None
+    assert payload_event_id(json.loads(body)) == "e-1"
+    v1 = json.dumps({"uuid": "u-1", "type": "event_callback", "event": {"uuid": "inner"}}, sort_keys=True)
+    assert find_event_id(v1) is None
+    assert payload_event_id(json.loads(v1)) == "u-1"
+    assert payload_event_id({"type": "url_verification", "challenge": "c"}) is None
+
+
+def test_receiver_dedup_reordered_keys():
+    received = []
+
+    async def on_event(event):
+        received.append(event.header.event_id)
+
+    async def main():
+        receiver = EventReceiver(on_event=on_event, encrypt_key=ENCRYPT_KEY, dispatcher=False)
+        for event_id in ["e-1", "e-1", "e-2"]:
+            assert await receiver.handle(make_sorted_event(event_id)) == {}
+        assert await receiver.handle(encrypt(ENCRYPT_KEY, make_sorted_event("e-2"))) == {}
+        await asyncio.sleep(0)
+        assert list(receiver.event_ids.cache) == ["e-1", "e-2"]
+
+    asyncio.run(main())
+    assert received == ["e-1", "e-2"]
+
+
+def test_memory_event_id_store_bounded():
+    store = MemoryEventIdStore(max_size=3, ttl=60)
+    assert all(store.add_nowait(f"e-{i}") for i in range(5))
+    assert list(store.cache) == ["e-2", "e-3", "e-4"]
+    assert not store.add_nowait("e-4")
+    # 已被淘汰的event_id会再次被当作新事件
+    assert store.add_nowait("e-0")
+    assert len(store.cache) == 3
+
+
+def test_memory_event_id_store_ttl():
+    store = MemoryEventIdStore(max_size=10, ttl=60)
+    assert store.add_nowait("e-1")
+    store.cache["e-1"] = time.time() - 1
+    assert store.add_nowait("e-1")
+    assert not store.add_nowait("e-1")
+
+
+def test_receiver_skips_redelivered_event():
+    received = []
+
+    async def on_event(event):
+        received.append(event.header.event_id)
+
+    async def main():
+        receiver = EventReceiver(on_event=on_event)
+        for event_id in ["e-1", "e-2", "e-1", "e-1", "e-2"]:
+            assert await receiver.handle(make_event(event_id)) == {}
+        await receiver.close()
+
+    asyncio.run(main())
+    assert received == ["e-1", "e-2"]
+
+
+def test_receiver_dedup_disabled():
+    received = []
+
+    async def on_event(event):
+        received.append(event.header.event_id)
+
+    async def main():
+        receiver = EventReceiver(on_event=on_event, dedup=False, dispatcher=False)
+        for _ in range(3):
+            await receiver.handle(make_event("e-1"))
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert received == ["e-1"] * 3
+
+
+def test_redis_event_id_store():
+    async def main():
+        store = RedisEventIdStore(local_size=10)
+        store.client = FakeRedis()
+        assert await store.add("e-1")
+        assert not await store.add("e-1")
+        assert list(store.client.data) == ["feishu:event:e-1"]
+
+        # Redis写入失败时不在进程内留下记录, 重推的事件还能处理
+        store.client.down = True
+        with pytest.raises(ConnectionError):
+            await store.add("e-2")
+        store.client.down = False
+        assert await store.add("e-2")
+
+        await store.discard("e-1")
+        assert await store.add("e-1")
+
+        # 其他进程已经记录过的event_id
+        other = RedisEventIdStore(local_size=0)
+        other.client = store.client
+        assert not await other.add("e-1")
+
+    asyncio.run(main())
+
+
+def test_receiver_dedup_encrypted_event():
+    received = []
+
+    async def on_event(event):
+        received.append(event.header.event_id)
+
+    async def main():
+        receiver = EventReceiver(on_event=on_event, encrypt_key=ENCRYPT_KEY, dispatcher=False)
+        for event_id in ["e-1", "e-1", "e-2"]:
+            assert await receiver.handle(encrypt(ENCRYPT_KEY, make_event(event_id))) == {}
+        await asyncio.sleep(0)
+        assert list(receiver.event_ids.cache) == ["e-1", "e-2"]
+
+    asyncio.run(main())
+    assert received == ["e-1", "e-2"]
+
+
+def test_receiver_forgets_failed_event():
+    received = []
+
+    async def on_event(event):
+        received.append(event.header.event_id)
+
+    async def main():
+        receiver = EventReceiver(on_event=on_event)
+        submit = receiver.dispatcher.submit
+
+        async def failing_submit(event):
+            receiver.dispatcher.submit = submit
+            raise RuntimeError("spill failed")
+
+        receiver.dispatcher.submit = failing_submit
+        with pytest.raises(RuntimeError):
+            await receiver.handle(make_event("e-1"))
+        # 调度失败后飞书重推, 再次处理
+        assert await receiver.handle(make_event("e-1")) == {}
+
+        # 解析失败的事件也不留下记录
+        body = make_event("e-2").replace(b"test.event_v1", b"im.message.receive_v1")
+        for _ in range(2):
+            with pytest.raises(FeishuError):
+                await receiver.handle(body)
+        assert "e-2" not in receiver.event_ids.cache
+        await receiver.close()
+
+    asyncio.run(main())
+    assert received == ["e-1"]
+
+
+def test_receiver_forgets_dropped_event():
+    received = []
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def on_event(event):
+            await gate.wait()
+            received.append(event.header.event_id)
+
+        dispatcher = EventDispatcher(workers=1, max_queue=1, overflow="shed")
+        receiver = EventReceiver(on_event=on_event, dispatcher=dispatcher)
+        assert await receiver.handle(make_event("e-1")) == {}
+        await asyncio.sleep(0.01)
+        assert await receiver.handle(make_event("e-2")) == {}
+        # 队列满被丢弃: 不回复2xx, 也不留下去重记录
+        with pytest.raises(FeishuError) as e:
+            await receiver.handle(make_event("e-3"))
+        assert e.value.code == ERRORS.EVENT_DROPPED
+        assert "e-3" not in receiver.event_ids.cache
+        gate.set()
+        await asyncio.sleep(0.01)
+        # 飞书重推后再次处理
+        assert await receiver.handle(make_event("e-3")) == {}
+        await receiver.close()
+
+    asyncio.run(main())
+    assert received == ["e-1", "e-2", "e-3"]
+
+
+if __name__ == "__main__":
+    test_find_event_id()
+    test_find_event_id_reordered_keys()
+    test_memory_event_id_store_bounded()
+    test_memory_event_id_store_ttl()
+    test_receiver_skips_redelivered_event()
+    test_receiver_dedup_disabled()
+    test_redis_event_id_store()
+    test_receiver_dedup_encrypted_event()
+    test_receiver_dedup_reordered_keys()
+    test_receiver_forgets_failed_event()
+    test_receiver_forgets_dropped_event()
@@ -0,0 +1,250 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from feishu.apis import EventDispatcher, OverflowPolicy
+from feishu.apis.dispatcher import chat_key
+from feishu.client import MetricsRegistry
+
+
+def test_workers_limit_concurrency():
+    running, peak, done = 0, 0, []
+
+    async def handler(event):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        done.append(event)
+
+    async def main():
+        dispatcher = EventDispatcher(handler, workers=3, max_queue=100)
+        for i in range(20):
+            assert await dispatcher.submit(i)
+        await dispatcher.stop()
+        assert not dispatcher.tasks
+
+    asyncio.run(main())
+    assert peak == 3
+    assert sorted(done) == list(range(20))
+
+
+def test_shed_when_queue_full():
+    metrics = MetricsRegistry()
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(event):
+            await gate.wait()
+
+        dispatcher = EventDispatcher(handler, workers=1, max_queue=2, overflow="shed", metrics=metrics)
+        results = [await dispatcher.submit(i) for i in range(5)]
+        await asyncio.sleep(0)
+        # worker取走了第一个事件, 队列中还有一个
+        assert metrics.snapshot()["gauges"]["event_queue_depth"] == 1
+        gate.set()
+        await dispatcher.stop()
+        return results
+
+    results = asyncio.run(main())
+    assert results == [True, True, False, False, False]
+    snapshot = metrics.snapshot()
+    assert snapshot["events"]["event_shed"] == 3
+    assert snapshot["histograms"]["event_handler_seconds"]["count"] == 2
+    assert snapshot["histograms"]["event_wait_seconds"]["count"] == 2
+    assert "feishu_event_wait_seconds_count 2" in metrics.to_prometheus()
+    assert "feishu_event_queue_depth 0" in metrics.to_prometheus()
+
+
+def test_block_waits_for_free_slot():
+    async def handler(event):
+        await asyncio.sleep(0.01)
+
+    async def main():
+        dispatcher = EventDispatcher(handler, workers=1, max_queue=1, overflow=OverflowPolicy.BLOCK,
+                                     block_timeout=1)
+        results = [await dispatcher.submit(i) for i in range(5)]
+        await dispatcher.stop()
+        return results
+
+    assert asyncio.run(main()) == [True] * 5
+
+
+def test_block_timeout_sheds():
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(event):
+            await gate.wait()
+
+        dispatcher = EventDispatcher(handler, workers=1, max_queue=1, overflow="block", block_timeout=0.05)
+        results = [await dispatcher.submit(i) for i in range(3)]
+        gate.set()
+        await dispatcher.stop()
+        return results
+
+    assert asyncio.run(main()) == [True, True, False]
+
+
+def test_spill():
+    spilled = []
+
+    async def spill(event):
+        spilled.append(event)
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(event):
+            await gate.wait()
+
+        dispatcher = EventDispatcher(handler, workers=1, max_queue=1, overflow="spill", spill=spill)
+        for i in range(4):
+            await dispatcher.submit(i)
+        gate.set()
+        await dispatcher.stop()
+
+    asyncio.run(main())
+    assert spilled == [1, 2, 3]
+
+    with pytest.raises(ValueError):
+        EventDispatcher(spill, overflow="spill")
+
+
+def test_handler_error_does_not_stop_worker():
+    metrics = MetricsRegistry()
+    done = []
+
+    async def handler(event):
+        if event % 2:
+            raise RuntimeError("boom")
+        done.append(event)
+
+    async def main():
+        dispatcher = EventDispatcher(handler, workers=1, metrics=metrics)
+        for i in range(6):
+            await dispatcher.submit(i)
+        await dispatcher.stop()
+
+    asyncio.run(main())
+    assert done == [0, 2, 4]
+    assert metrics.snapshot()["events"]["event_handler_error"] == 3
+
+
+def test_chat_key():
+    def message_event(chat_type, chat_id="oc_1", open_id="ou_1"):
+        message = SimpleNamespace(chat_type=chat_type, chat_id=chat_id)
+        sender = SimpleNamespace(sender_id=SimpleNamespace(open_id=open_id))
+        return SimpleNamespace(event=SimpleNamespace(message=message, sender=sender))
+
+    assert chat_key(message_event("group")) == "oc_1"
+    assert chat_key(message_event("p2p")) == "ou_1"
+    assert chat_key(SimpleNamespace(event={"message_id": "om_1"})) is None
+
+
+def test_lanes_keep_order_within_chat():
+    handled = {}
+    running, peak = 0, 0
+
+    async def handler(event):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(random.random() * 0.002)
+        running -= 1
+        handled.setdefault(event[0], []).append(event[1])
+
+    async def main():
+        dispatcher = EventDispatcher(handler, lanes=4, max_queue=400, lane_key=lambda event: event[0])
+        for i in range(50):
+            for chat in ("oc_a", "oc_b", "oc_c", "oc_d", "oc_e"):
+                await dispatcher.submit((chat, i))
+        await dispatcher.stop()
+        assert not dispatcher.pending
+
+    asyncio.run(main())
+    assert handled == {chat: list(range(50)) for chat in ("oc_a", "oc_b", "oc_c", "oc_d", "oc_e")}
+    # 不同会话并行处理, 但不超过lane数
+    assert 1 < peak <= 4
+
+
+def test_lane_is_stable():
+    first = EventDispatcher(lanes=8)
+    second = EventDispatcher(lanes=8)
+    assert [first.lane(f"oc_{i}") for i in range(100)] == [second.lane(f"oc_{i}") for i in range(100)]
+    assert len({first.lane(f"oc_{i}") for i in range(100)}) == 8
+
+
+def test_hot_chat_metrics():
+    metrics = MetricsRegistry()
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(event):
+            await gate.wait()
+
+        dispatcher = EventDispatcher(handler, lanes=2, max_queue=100, lane_key=lambda event: event,
+                                     hot_threshold=5, metrics=metrics)
+        for _ in range(10):
+            await dispatcher.submit("oc_hot")
+        await dispatcher.submit("oc_cold")
+        assert dispatcher.hot_chats(1) == [("oc_hot", 10)]
+        assert metrics.snapshot()["gauges"]["event_chat_pending"] == {"oc_hot": 10, "oc_cold": 1}
+        assert 'feishu_event_chat_pending{key="oc_hot"} 10' in metrics.to_prometheus()
+        gate.set()
+        await dispatcher.stop()
+        assert dispatcher.hot_chats() == []
+
+    asyncio.run(main())
+    assert metrics.snapshot()["events"]["event_hot_chat"] == 1
+
+
+def test_stop_timeout_drops_pending():
+    metrics = MetricsRegistry()
+
+    async def main():
+        async def handler(event):
+            await asyncio.Event().wait()
+
+        dispatcher = EventDispatcher(handler, lanes=2, max_queue=100, lane_key=lambda event: event,
+                                     metrics=metrics)
+        for _ in range(5):
+            await dispatcher.submit("oc_stuck")
+        await asyncio.sleep(0)
+        await dispatcher.stop(timeout=0.05)
+        assert not dispatcher.tasks and not dispatcher.pending
+        assert dispatcher.qsize() == 0 and dispatcher.hot_chats() == []
+        gauges = metrics.snapshot()["gauges"]
+        assert gauges["event_queue_depth"] == 0 and gauges["event_chat_pending"] == {}
+
+        # 停止后再次submit会重新启动worker
+        done = asyncio.Event()
+
+        async def resumed(event):
+            done.set()
+
+        dispatcher.handler = resumed
+        assert await dispatcher.submit("oc_new")
+        await asyncio.wait_for(done.wait(), 1)
+        await dispatcher.stop()
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    test_workers_limit_concurrency()
+    test_shed_when_queue_full()
+    test_block_waits_for_free_slot()
+    test_block_timeout_sheds()
+    test_spill()
+    test_handler_error_does_not_stop_worker()
+    test_chat_key()
+    test_lanes_keep_order_within_chat()
+    test_lane_is_stable()
+    test_hot_chat_metrics()
+    test_stop_timeout_drops_pending()
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+from feishu.apis import Router, EventReceiver
+
+
+def make_event(event_type: str, event: dict, event_id: str = "e-1") -> bytes:
+    return json.dumps({
+        "schema": "2.0",
+        "header": {"event_id": event_id, "token": "t", "create_time": "1603977298000000",
+                   "event_type": event_type, "tenant_key": "k", "app_id": "cli_x"},
+        "event": event,
+    }).encode()
+
+
+def test_router_dispatch_with_filters():
+    router = Router()
+    handled = []
+
+    @router.on("test.event_v1", filter=lambda event: event.event["n"] > 10)
+    async def on_big(event):
+        handled.append(("big", event.event["n"]))
+
+    @router.on("test.event_v1")
+    async def on_other(event):
+        handled.append(("other", event.event["n"]))
+
+    async def main():
+        receiver = EventReceiver(on_event=router, dedup=False)
+        for n in (1, 20, 3):
+            await receiver.handle(make_event("test.event_v1", {"n": n}))
+        await receiver.close()
+
+    asyncio.run(main())
+    assert handled == [("other", 1), ("big", 20), ("other", 3)]
+
+
+def test_router_skips_unhandled_before_parsing():
+    router = Router()
+
+    @router.on("test.event_v1")
+    async def on_event(event):
+        pass
+
+    async def main():
+        receiver = EventReceiver(on_event=router, dedup=False)
+        # header不完整, 解析成Event会失败; 没有handler时不解析
+        body = json.dumps({"schema": "2.0", "header": {"event_type": "test.unused_v1"}, "event": {}})
+        assert await receiver.handle(body.encode()) == {}
+        await receiver.close()
+
+    asyncio.run(main())
+    assert router.accepts("test.event_v1")
+    assert not router.accepts("test.unused_v1")
+
+
+def test_router_rebuilds_after_late_registration():
+    router = Router()
+    router.build()
+    assert not router.accepts("test.event_v1")
+
+    async def handler(event):
+        pass
+
+    router.add("test.event_v1", handler)
+    assert router.accepts("test.event_v1")
+    assert router.table == {"test.event_v1": ((None, handler),)}
+
+
+if __name__ == "__main__":
+    test_router_dispatch_with_filters()
+    test_router_skips_unhandled_before_parsing()
+    test_router_rebuilds_after_late_registration()
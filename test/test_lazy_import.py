@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+LAZY_MODULES = ["aiohttp", "sanic", "Crypto", "requests"]
+
+# 在新进程中执行setup, 返回导入耗时、RSS增量(字节)以及哪些重量级依赖被加载了
+# ru_maxrss会带上fork出子进程前父进程(pytest)的峰值, 所以直接读/proc/self/statm里当前的RSS
+MEASURE = """
+import json, os, sys, time
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+before = rss()
+start = time.perf_counter()
+{setup}
+print(json.dumps({{
+    "time": time.perf_counter() - start,
+    "rss": rss() - before,
+    "modules": [m for m in {modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(setup: str) -> dict:
+    code = MEASURE.format(setup=setup, modules=LAZY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def test_import_client_is_lazy():
+    assert measure("import feishu.client")["modules"] == []
+
+
+def test_dependencies_loaded_on_demand():
+    sync_client = measure("from feishu.client import FeishuClient\n"
+                          "FeishuClient(app_id='cli_xxx', app_secret='xxx')")
+    assert sync_client["modules"] == ["requests"]
+
+    async_client = measure("import asyncio\n"
+                           "from feishu.client import FeishuClient\n"
+                           "client = FeishuClient(app_id='cli_xxx', app_secret='xxx', run_async=True)\n"
+                           "asyncio.run(asyncio.sleep(0, client._get_session_async()))")
+    assert async_client["modules"] == ["aiohttp"]
+
+    blueprint = measure("from sanic import Blueprint\n"
+                        "from feishu.apis import setup_event_blueprint\n"
+                        "setup_event_blueprint('sanic', Blueprint('feishu'), '/event', None)")
+    assert "sanic" in blueprint["modules"] and "Crypto" not in blueprint["modules"]
+
+    decrypt = measure("from feishu.utils import decrypt\n"
+                      "from feishu.utils.AES import AESCipher\n"
+                      "AESCipher('key')")
+    assert decrypt["modules"] == ["Crypto"]
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="需要/proc/self/statm读取RSS")
+def test_import_benchmark():
+    client = min((measure("import feishu.client") for _ in range(3)), key=lambda r: r["time"])
+    eager = min((measure("import feishu.client, aiohttp, requests, sanic, Crypto.Cipher.AES")
+                 for _ in range(3)), key=lambda r: r["time"])
+    print(f"\n`import feishu.client`: {client['time'] * 1000:.1f}ms, +{client['rss'] / 2 ** 20:.1f}MB RSS; "
+          f"with all dependencies: {eager['time'] * 1000:.1f}ms, +{eager['rss'] / 2 ** 20:.1f}MB RSS")
+    assert client["time"] < eager["time"]
+    assert client["rss"] < eager["rss"]
+
+
+if __name__ == "__main__":
+    test_import_client_is_lazy()
+    test_dependencies_loaded_on_demand()
+    test_import_benchmark()
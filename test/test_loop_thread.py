@@ -0,0 +1,42 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from feishu.client import FeishuClient
+
+AUTH_API = "/auth/v3/tenant_access_token/internal/"
+THREADS = 20
+LATENCY = 0.2
+
+
+def test_loop_thread_concurrent_requests():
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", loop_thread=True)
+    request_threads = set()
+
+    async def _async_request(method, url, **kwargs):
+        request_threads.add(threading.current_thread().name)
+        if url.endswith(AUTH_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        await asyncio.sleep(LATENCY)
+        return {"code": 0, "msg": "ok", "data": {"n": kwargs["params"]["n"]}}
+
+    client._async_request = _async_request
+    client.get_token()
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(lambda n: client.request("GET", "/test", params={"n": n}), range(THREADS)))
+    elapsed = time.monotonic() - start
+
+    assert [r["data"]["n"] for r in results] == list(range(THREADS))
+    # 所有请求都在同一个loop线程中并发执行, 而不是串行
+    assert request_threads == {"feishu-loop"}
+    assert elapsed < LATENCY * 3
+
+    asyncio.run(client.close())
+    assert not client.loop_thread.thread.is_alive()
+
+
+if __name__ == "__main__":
+    test_loop_thread_concurrent_requests()
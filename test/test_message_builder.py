@@ -0,0 +1,75 @@
+import json
+import time
+
+import pytest
+from pydantic import ValidationError
+
+from feishu.client import FeishuClient
+from feishu.models import ReceiveIdType
+
+MESSAGES_API = "/im/v1/messages"
+POST = {"post": {"zh_cn": {"title": "标题", "content": [
+    [{"tag": "text", "text": "第一行: "}, {"tag": "a", "href": "http://www.feishu.cn", "text": "超链接"}],
+    [{"tag": "at", "user_id": "ou_xxx", "user_name": "tom"}],
+    [{"tag": "img", "image_key": "img_xxx"}],
+]}}}
+SENDS = {
+    "text": lambda client: client.send_text("hello", "ou_xxx"),
+    "post": lambda client: client.send_post(POST, "oc_xxx", ReceiveIdType.ChatId),
+    "image": lambda client: client.send_image("img_xxx", "ou_xxx"),
+    "media": lambda client: client.send_media("file_xxx", None, "ou_xxx"),
+}
+
+
+def create_client(validate_messages: bool, payloads: list) -> FeishuClient:
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", validate_messages=validate_messages)
+
+    def _sync_request(method, url, payload, **kwargs):
+        if not url.endswith(MESSAGES_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        payloads.append(payload)
+        return {"code": 0, "msg": "ok", "data": {"message_id": "om_xxx"}}
+
+    client._sync_request = _sync_request
+    return client
+
+
+def test_fast_path_same_payload():
+    fast, validated = [], []
+    fast_client, validated_client = create_client(False, fast), create_client(True, validated)
+    for send in SENDS.values():
+        send(fast_client)
+        send(validated_client)
+    for payload in fast + validated:
+        payload.pop("uuid")
+        payload["content"] = json.loads(payload["content"])
+    assert fast == validated
+
+
+def test_validate_messages():
+    client = create_client(True, [])
+    with pytest.raises(ValidationError):
+        client.send_post({"title": "缺少post"}, "ou_xxx")
+
+
+def test_builder_benchmark():
+    rounds = 2000
+    fast_client, validated_client = create_client(False, []), create_client(True, [])
+    for name, send in SENDS.items():
+        if name == "media":
+            continue
+        cost = []
+        for client in (fast_client, validated_client):
+            client.get_token()
+            start = time.perf_counter()
+            for _ in range(rounds):
+                send(client)
+            cost.append((time.perf_counter() - start) / rounds)
+        print(f"\nsend_{name}: fast path {cost[0] * 1e6:.1f}us, validated {cost[1] * 1e6:.1f}us")
+        assert cost[0] < cost[1]
+
+
+if __name__ == "__main__":
+    test_fast_path_same_payload()
+    test_validate_messages()
+    test_builder_benchmark()
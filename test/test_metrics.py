@@ -0,0 +1,124 @@
+import threading
+
+from feishu.client import FeishuClient, MetricsRegistry, CircuitBreaker, RateLimiter, normalize_route
+from feishu.utils import FeishuError
+
+MESSAGES_API = "/im/v1/messages"
+AUTH_API = "/auth/v3/tenant_access_token/internal/"
+
+
+def test_concurrent_record():
+    metrics = MetricsRegistry()
+    threads, rounds = 8, 10000
+
+    def worker():
+        for i in range(rounds):
+            metrics.record_request(MESSAGES_API, 0 if i % 10 else 230020, 0.01)
+            metrics.record_event("token_store_hit")
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    snapshot = metrics.snapshot()
+    total = threads * rounds
+    assert snapshot["requests"][MESSAGES_API] == {0: total * 9 // 10, 230020: total // 10}
+    assert snapshot["errors"] == {230020: total // 10}
+    assert snapshot["latency"][MESSAGES_API]["count"] == total
+    assert snapshot["events"]["token_store_hit"] == total
+
+
+def test_dead_thread_shards_merged():
+    metrics = MetricsRegistry()
+    metrics.record_event("token_store_hit")
+
+    def worker():
+        metrics.record_request(MESSAGES_API, 0, 0.01)
+        metrics.record_event("token_store_hit")
+
+    for _ in range(100):
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+
+    # 只剩主线程的分片, 退出线程的计数都在_base中
+    assert len(metrics._shards) == 1
+    snapshot = metrics.snapshot()
+    assert snapshot["requests"][MESSAGES_API] == {0: 100}
+    assert snapshot["latency"][MESSAGES_API]["count"] == 100
+    assert snapshot["events"]["token_store_hit"] == 101
+
+
+def test_quantile():
+    metrics = MetricsRegistry(buckets=(0.1, 0.2, 0.5))
+    for _ in range(90):
+        metrics.record_request(MESSAGES_API, 0, 0.05)
+    for _ in range(10):
+        metrics.record_request(MESSAGES_API, 0, 0.3)
+    assert metrics.quantile(MESSAGES_API, 0.5) <= 0.1
+    assert 0.2 < metrics.quantile(MESSAGES_API, 0.99) <= 0.5
+    assert metrics.quantile("/unknown", 0.99) is None
+
+
+def test_client_metrics():
+    metrics = MetricsRegistry()
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", metrics=metrics)
+
+    def _sync_request(method, url, payload, **kwargs):
+        if url.endswith(AUTH_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        if payload["receive_id"] == "ou_limited":
+            raise FeishuError(230020, "rate limited")
+        return {"code": 0, "msg": "ok", "data": {"message_id": "om_xxx"}}
+
+    client._sync_request = _sync_request
+    client.send_text("hello", "ou_xxx")
+    client.send_text("hello", "ou_xxx")
+    try:
+        client.send_text("hello", "ou_limited")
+    except FeishuError:
+        pass
+
+    snapshot = metrics.snapshot()
+    assert snapshot["requests"] == {AUTH_API: {0: 1}, MESSAGES_API: {0: 2, 230020: 1}}
+    assert snapshot["events"] == {"token_store_miss": 1, "token_store_hit": 2, "token_refresh_success": 1}
+
+    text = metrics.to_prometheus()
+    assert f'feishu_requests_total{{path="{MESSAGES_API}",code="230020"}} 1' in text
+    assert f'feishu_request_duration_seconds_bucket{{path="{MESSAGES_API}",le="+Inf"}} 3' in text
+    assert f'feishu_request_duration_seconds_count{{path="{MESSAGES_API}"}} 3' in text
+    assert 'feishu_events_total{event="token_refresh_success"} 1' in text
+
+
+def test_keys_use_route_template():
+    metrics, breaker, limiter, traces = MetricsRegistry(), CircuitBreaker(), RateLimiter(), []
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", metrics=metrics, circuit_breaker=breaker,
+                          rate_limiter=limiter, on_request=traces.append)
+    client._sync_request = lambda method, url, payload, **kwargs: {
+        "code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+
+    for i in range(50):
+        client.request("POST", f"/im/v1/messages/om_{i:032x}/reply", payload={"content": "{}"})
+    client.request("GET", "/im/v1/chats/oc_1/members", route="/im/v1/chats/{chat_id}/members")
+
+    reply = "/im/v1/messages/:id/reply"
+    assert metrics.snapshot()["requests"] == {AUTH_API: {0: 1}, reply: {0: 50},
+                                              "/im/v1/chats/{chat_id}/members": {0: 1}}
+    assert set(breaker.circuits) == {AUTH_API, reply, "/im/v1/chats/{chat_id}/members"}
+    assert set(limiter.buckets) == {AUTH_API, reply, "/im/v1/chats/{chat_id}/members"}
+    # on_request中仍然是真实的path
+    assert traces[1].path == f"/im/v1/messages/om_{0:032x}/reply" and traces[1].route == reply
+
+    assert normalize_route("/auth/v3/app_access_token/internal") == "/auth/v3/app_access_token/internal"
+    assert normalize_route("/contact/v3/users/123/") == "/contact/v3/users/:id/"
+    assert normalize_route("/drive/v1/files/boxcnrHpsg1QDqXAAAyachabcef") == "/drive/v1/files/:id"
+
+
+if __name__ == "__main__":
+    test_concurrent_record()
+    test_dead_thread_shards_merged()
+    test_quantile()
+    test_client_metrics()
+    test_keys_use_route_template()
@@ -0,0 +1,86 @@
+import time
+
+from feishu.client import RateLimiter
+from feishu.models import ReceiveIdType
+from feishu.utils import FeishuError
+
+API = "/im/v1/messages"
+
+
+def test_token_bucket_delays_over_rate():
+    limiter = RateLimiter(rate=10)
+    keys = limiter.keys(API, {"receive_id_type": ReceiveIdType.OpenId}, {"receive_id": "ou_xxx"})
+    assert keys == [API]
+    delays = [limiter.acquire(keys) for _ in range(20)]
+    assert delays[:10] == [0] * 10
+    # 超出桶容量后每个请求多等1/rate秒
+    assert 0.9 < delays[-1] < 1.1
+
+
+def test_per_chat_bucket():
+    limiter = RateLimiter(rate=100, per_chat_rate=5)
+    keys = limiter.keys(API, {"receive_id_type": ReceiveIdType.ChatId}, {"receive_id": "oc_xxx"})
+    assert keys == [API, API + "#oc_xxx"]
+    delays = [limiter.acquire(keys) for _ in range(10)]
+    assert delays[4] == 0 and delays[5] > 0
+
+
+def test_adaptive_rate():
+    limiter = RateLimiter(rate=40, increase_step=10, increase_after=5)
+    keys = [API]
+    limiter.record(keys, FeishuError(99991400, "request trigger frequency limit"))
+    assert limiter.buckets[API].rate == 20
+    # 其他错误不影响速率
+    limiter.record(keys, FeishuError(230001, "invalid receive_id"))
+    assert limiter.buckets[API].rate == 20
+    for _ in range(10):
+        limiter.record(keys)
+    assert limiter.buckets[API].rate == 40
+    for _ in range(10):
+        limiter.record(keys)
+    assert limiter.buckets[API].rate == 40
+
+
+def test_idle_chat_buckets_evicted():
+    limiter = RateLimiter(per_chat_rate=5, max_buckets=11)
+    throttled = [API, API + "#oc_throttled"]
+    limiter.acquire(throttled)
+    limiter.record(throttled, FeishuError(99991400, "request trigger frequency limit"))
+    for i in range(9):
+        limiter.acquire([API + f"#oc_{i}"])
+    # 1秒后令牌都已回满
+    for bucket in limiter.buckets.values():
+        bucket.updated -= 1
+    limiter.acquire([API + "#oc_9"])
+    limiter.acquire([API + "#oc_10"])
+    # 回满的桶被清理, 被降速的桶和刚用过的桶保留
+    assert sorted(limiter.buckets) == [API, API + "#oc_10", API + "#oc_9", API + "#oc_throttled"]
+
+    # 长时间没有使用的桶即使被降速也会被清理
+    limiter.buckets[API + "#oc_throttled"].updated = time.monotonic() - 601
+    for i in range(20, 40):
+        limiter.acquire([API + f"#oc_{i}"])
+    assert API + "#oc_throttled" not in limiter.buckets
+    assert API in limiter.buckets
+
+
+def test_record_after_bucket_evicted():
+    limiter = RateLimiter(per_chat_rate=5, max_buckets=2)
+    keys = [API, API + "#oc_1"]
+    limiter.acquire(keys)
+    for bucket in limiter.buckets.values():
+        bucket.updated -= 1
+    # 请求还没结束时, 已经回满的桶被其他请求触发的清理删除
+    limiter.acquire([API + "#oc_2"])
+    assert API + "#oc_1" not in limiter.buckets
+    limiter.record(keys)
+    limiter.record(keys, FeishuError(99991400, "request trigger frequency limit"))
+    assert limiter.buckets[API + "#oc_1"].rate == 2.5
+
+
+if __name__ == "__main__":
+    test_token_bucket_delays_over_rate()
+    test_per_chat_bucket()
+    test_adaptive_rate()
+    test_idle_chat_buckets_evicted()
+    test_record_after_bucket_evicted()
@@ -0,0 +1,122 @@
+import json
+import time
+from typing import Optional, Union
+
+from pydantic import BaseModel
+
+from feishu.models import (ReceiveMessageEven, ImageContent, TextContent, CONTENT_MODELS, MessageType, PostContent,
+                           InteractiveContent, ShareChatContent, ShareUserContent, AudioContent, MediaContent,
+                           FileContent, StickerContent)
+from feishu.models.event.receive_message import Sender, ChatType
+from feishu.utils import default_codec
+
+
+def make_event(message_type: str, content, mentions=None) -> dict:
+    user = {"union_id": "on_1", "user_id": "u_1", "open_id": "ou_1"}
+    return {
+        "sender": {"sender_id": user, "sender_type": "user", "tenant_key": "t"},
+        "message": {"message_id": "om_1", "message_type": message_type, "chat_id": "oc_1", "chat_type": "group",
+                    "content": json.dumps(content), "mentions": mentions},
+    }
+
+
+def test_content_parsed_by_message_type():
+    event = ReceiveMessageEven(**make_event("image", {"image_key": "img_1"}))
+    assert event.message.content == ImageContent(image_key="img_1")
+
+    event = ReceiveMessageEven(**make_event("text", {"text": "@_user_1 hello"}))
+    assert event.message.content == TextContent(text="@_user_1 hello")
+
+
+def test_content_validated_once(monkeypatch):
+    calls = []
+
+    class CountingImageContent(ImageContent):
+        def __init__(self, **data):
+            calls.append(data)
+            super().__init__(**data)
+
+    monkeypatch.setitem(CONTENT_MODELS, MessageType.IMAGE, CountingImageContent)
+    event = ReceiveMessageEven(**make_event("image", {"image_key": "img_1"}))
+    assert isinstance(event.message.content, CountingImageContent)
+    assert len(calls) == 1
+
+
+def test_content_falls_back_to_dict():
+    # 未知的消息类型
+    event = ReceiveMessageEven(**make_event("merge_forward", {"foo": "bar"}))
+    assert event.message.message_type == "merge_forward"
+    assert event.message.content == {"foo": "bar"}
+
+    # 内容和模型对不上
+    event = ReceiveMessageEven(**make_event("image", {"file_key": "f_1"}))
+    assert event.message.content == {"file_key": "f_1"}
+
+    # 收到的富文本没有zh_cn这一层
+    post = {"title": "t", "content": [[{"tag": "text", "text": "hi"}]]}
+    event = ReceiveMessageEven(**make_event("post", post))
+    assert event.message.content == post
+
+
+def test_mentions_is_list():
+    mention = {"key": "@_user_1", "id": {"union_id": "on_2", "user_id": "u_2", "open_id": "ou_2"},
+               "name": "Tom", "tenant_key": "t"}
+    event = ReceiveMessageEven(**make_event("text", {"text": "@_user_1 @_user_2"}, [mention, mention]))
+    assert [m.name for m in event.message.mentions] == ["Tom", "Tom"]
+
+
+class UnionMessage(BaseModel):
+    """按message_type查表之前的Message: content由pydantic逐个尝试Union中的模型"""
+    message_id: str
+    message_type: MessageType
+    content: Union[
+        TextContent, PostContent, ImageContent, InteractiveContent, ShareChatContent,
+        ShareUserContent, AudioContent, MediaContent, FileContent, StickerContent, dict, str
+    ]
+    chat_id: Optional[str]
+    chat_type: Optional[ChatType]
+
+
+class UnionReceiveMessageEven(BaseModel):
+    sender: Sender
+    message: UnionMessage
+
+    def __init__(self, **kwargs):
+        content = kwargs['message']['content']
+        if type(content) == str:
+            kwargs['message']['content'] = default_codec().loads(content)
+        super().__init__(**kwargs)
+
+
+def parse_time(model, events, repeat: int = 5) -> float:
+    cost = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for event in events:
+            # 和事件推送一样, 每次都从JSON解析出新的dict
+            model(**json.loads(event))
+        cost.append(time.perf_counter() - start)
+    return min(cost)
+
+
+def test_lookup_faster_than_union():
+    key = "file_v2_6a2e6b1e"
+    contents = {
+        "image": {"image_key": "img_1"},
+        "file": {"file_key": key, "file_name": "a.txt"},
+        "audio": {"file_key": key, "duration": 2000},
+        "media": {"file_key": key, "image_key": "img_1"},
+        "sticker": {"file_key": key},
+    }
+    events = [json.dumps(make_event(message_type, content)) for message_type, content in contents.items()] * 200
+    union = parse_time(UnionReceiveMessageEven, events)
+    lookup = parse_time(ReceiveMessageEven, events)
+    print(f"\n{len(events)} events: union {union * 1000:.1f}ms, lookup {lookup * 1000:.1f}ms")
+    assert lookup < union
+
+
+if __name__ == "__main__":
+    test_content_parsed_by_message_type()
+    test_content_falls_back_to_dict()
+    test_mentions_is_list()
+    test_lookup_faster_than_union()
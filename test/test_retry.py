@@ -0,0 +1,142 @@
+import asyncio
+import socket
+import threading
+
+from feishu.client import FeishuClient, RetryPolicy
+from feishu.models import ReceiveIdType
+from feishu.utils import FeishuError, ERRORS
+
+MESSAGES_API = "/im/v1/messages"
+
+
+def create_client(failures: list, sent: list, reports: list) -> FeishuClient:
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01,
+                         on_complete=lambda api, attempts, elapsed, error: reports.append((api, attempts, error)))
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", retry_policy=policy)
+
+    def _sync_request(method, url, payload, **kwargs):
+        if not url.endswith(MESSAGES_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        sent.append(payload)
+        if failures:
+            raise failures.pop(0)
+        return {"code": 0, "msg": "ok", "data": {"message_id": "om_xxx"}}
+
+    client._sync_request = _sync_request
+    return client
+
+
+def test_retry_with_same_uuid():
+    sent, reports = [], []
+    failures = [FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, "timeout"),
+                FeishuError(99991400, "request trigger frequency limit")]
+    client = create_client(failures, sent, reports)
+
+    message_id = client.send_text("hello", "ou_xxx", ReceiveIdType.OpenId)
+    assert message_id == "om_xxx"
+    assert len(sent) == 3
+    # 重试时幂等键不变
+    assert len({payload["uuid"] for payload in sent}) == 1
+    assert reports[-1] == (MESSAGES_API, 3, None)
+
+
+def test_no_retry_on_client_error():
+    sent, reports = [], []
+    failures = [FeishuError(230001, "invalid receive_id")]
+    client = create_client(failures, sent, reports)
+
+    try:
+        client.send_text("hello", "ou_xxx", ReceiveIdType.OpenId)
+        assert False
+    except FeishuError as e:
+        assert e.code == 230001
+    assert len(sent) == 1
+    assert reports[-1][:2] == (MESSAGES_API, 1)
+
+
+def test_non_idempotent_request_retried_only_when_not_sent():
+    sent, reports = [], []
+    # 读超时: 请求可能已经被处理, 没有uuid的POST不重试
+    failures = [FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, "read timeout")]
+    client = create_client(failures, sent, reports)
+    try:
+        client.request("POST", api=MESSAGES_API, payload={"receive_id": "ou_xxx"})
+        assert False
+    except FeishuError as e:
+        assert e.code == ERRORS.FAILED_TO_ESTABLISH_CONNECTION
+    assert len(sent) == 1
+
+    # 没连上服务器或被限流: 请求确定没有被处理, 可以重试
+    sent.clear()
+    failures += [FeishuError(ERRORS.CONNECT_FAILED, "connection refused"), FeishuError(99991400, "limit")]
+    client.request("POST", api=MESSAGES_API, payload={"receive_id": "ou_xxx"})
+    assert len(sent) == 3
+
+    # 明确声明幂等时按幂等请求重试
+    sent.clear()
+    failures += [FeishuError(ERRORS.FAILED_TO_ESTABLISH_CONNECTION, "read timeout")]
+    client.request("POST", api=MESSAGES_API, payload={"receive_id": "ou_xxx"}, idempotent=True)
+    assert len(sent) == 2
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def silent_server() -> socket.socket:
+    """接受连接但从不返回的服务器, 用来制造读超时"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    connections = []
+
+    def accept():
+        while True:
+            try:
+                connections.append(server.accept()[0])
+            except OSError:
+                break
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server
+
+
+def classify(client: FeishuClient, url: str) -> int:
+    kwargs = dict(method="POST", url=url, timeout_pair=(0.5, 0.3), headers={}, params={}, payload={"a": 1},
+                  data={}, files={})
+    try:
+        if client.run_async:
+            client.event_loop.run_until_complete(client._async_request(**kwargs))
+        else:
+            client._sync_request(**kwargs)
+    except FeishuError as e:
+        return e.code
+    raise AssertionError("no error")
+
+
+def test_connect_failure_classification():
+    server = silent_server()
+    refused = f"http://127.0.0.1:{closed_port()}/"
+    no_reply = f"http://127.0.0.1:{server.getsockname()[1]}/"
+    try:
+        client = FeishuClient(app_id="cli_xxx", app_secret="xxx")
+        assert classify(client, refused) == ERRORS.CONNECT_FAILED
+        assert classify(client, no_reply) == ERRORS.FAILED_TO_ESTABLISH_CONNECTION
+
+        loop = asyncio.new_event_loop()
+        client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True, event_loop=loop)
+        assert classify(client, refused) == ERRORS.CONNECT_FAILED
+        assert classify(client, no_reply) == ERRORS.FAILED_TO_ESTABLISH_CONNECTION
+        loop.run_until_complete(client.close())
+        loop.close()
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    test_retry_with_same_uuid()
+    test_no_retry_on_client_error()
+    test_non_idempotent_request_retried_only_when_not_sent()
+    test_connect_failure_classification()
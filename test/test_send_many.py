@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+from feishu.client import FeishuClient
+from feishu.utils import FeishuError
+
+MESSAGES_API = "/im/v1/messages"
+TOTAL = 50
+CONCURRENCY = 5
+
+
+def create_messages(pulled: list):
+    for i in range(TOTAL):
+        pulled.append(i)
+        yield {"receive_id": f"ou_{i}", "msg_type": "text", "content": {"text": f"hello {i}"}}
+
+
+def test_send_many_sync():
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx")
+    lock = threading.Lock()
+    in_flight = [0, 0]  # 当前并发, 最大并发
+
+    def _sync_request(method, url, payload, **kwargs):
+        if not url.endswith(MESSAGES_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        if payload["receive_id"] == "ou_7":
+            raise FeishuError(230001, "invalid receive_id")
+        return {"code": 0, "msg": "ok", "data": {"message_id": "om_" + payload["receive_id"]}}
+
+    client._sync_request = _sync_request
+    pulled = []
+    results = client.send_many(create_messages(pulled), concurrency=CONCURRENCY)
+
+    first = next(results)
+    # 结果是边发边返回的, 不会先把所有消息都读出来
+    assert len(pulled) <= CONCURRENCY + 1
+    results = [first] + list(results)
+
+    assert in_flight[1] <= CONCURRENCY
+    assert sorted(r.index for r in results) == list(range(TOTAL))
+    for r in results:
+        if r.index == 7:
+            assert r.message_id is None and r.error.code == 230001
+        else:
+            assert r.message_id == f"om_ou_{r.index}" and r.error is None
+
+
+def create_async_client(in_flight: list, sent: list):
+    loop = asyncio.new_event_loop()
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True, event_loop=loop)
+
+    async def _async_request(method, url, payload, **kwargs):
+        if not url.endswith(MESSAGES_API):
+            return {"code": 0, "msg": "ok", "tenant_access_token": "t-xxx", "expire": 7200}
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            in_flight[0] -= 1
+        sent.append(payload["receive_id"])
+        if payload["receive_id"] == "ou_7":
+            raise FeishuError(230001, "invalid receive_id")
+        return {"code": 0, "msg": "ok", "data": {"message_id": "om_" + payload["receive_id"]}}
+
+    client._async_request = _async_request
+    return client, loop
+
+
+def test_send_many_async():
+    in_flight, sent, pulled = [0, 0], [], []
+    client, loop = create_async_client(in_flight, sent)
+
+    async def collect():
+        results = client.send_many(create_messages(pulled), concurrency=CONCURRENCY)
+        first = await results.__anext__()
+        # 和同步模式一样按需读取messages
+        assert len(pulled) <= CONCURRENCY + 1
+        return [first] + [r async for r in results]
+
+    results = loop.run_until_complete(collect())
+    loop.close()
+
+    assert in_flight[1] <= CONCURRENCY
+    assert sorted(r.index for r in results) == list(range(TOTAL))
+    for r in results:
+        if r.index == 7:
+            assert r.message_id is None and r.error.code == 230001
+        else:
+            assert r.message_id == f"om_ou_{r.index}" and r.error is None
+
+
+def test_send_many_async_early_exit():
+    in_flight, sent, pulled = [0, 0], [], []
+    client, loop = create_async_client(in_flight, sent)
+
+    async def first_result():
+        results = client.send_many(create_messages(pulled), concurrency=CONCURRENCY)
+        async for result in results:
+            await results.aclose()
+            return result
+
+    assert loop.run_until_complete(first_result()).error is None
+    loop.run_until_complete(asyncio.sleep(0.05))
+    loop.close()
+    # 提前退出时还没发完的消息被取消, 不再读取后面的messages
+    assert in_flight[0] == 0
+    assert len(sent) < CONCURRENCY + 1 and len(pulled) <= CONCURRENCY + 1
+
+
+if __name__ == "__main__":
+    test_send_many_sync()
+    test_send_many_async()
+    test_send_many_async_early_exit()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from feishu.stores import MemoryStore, LayeredStore, AsyncMemoryStore, SyncStoreAdapter
+
+
+class CountingStore(MemoryStore):
+    """记录get次数的L2, 模拟RedisStore"""
+
+    def __init__(self):
+        super().__init__()
+        self.gets = 0
+
+    def get(self, key: str):
+        self.gets += 1
+        return super().get(key)
+
+
+def test_layered_store_reads_local_copy():
+    l2 = CountingStore()
+    store = LayeredStore(l2)
+    store.set("token", "t-1", 7200)
+    for _ in range(1000):
+        assert store.get("token") == "t-1"
+    assert l2.gets == 0
+
+
+def test_layered_store_reads_shared_store_near_expiry():
+    l2 = CountingStore()
+    l2.set("token", "t-1", 7200)
+    store = LayeredStore(l2, refresh_ahead=60)
+    assert store.get("token") == "t-1"
+    assert store.get("token") == "t-1"
+    assert l2.gets == 1
+
+    # 其他进程刷新了token, 本地副本临近过期后读到新的token
+    l2.set("token", "t-2", 7200)
+    store.cache["token"] = ("t-1", time.time() - 1)
+    assert store.get("token") == "t-2"
+    assert l2.gets == 2
+
+    l2.set("token", "t-3", 7200)
+    store.invalidate("token")
+    assert store.get("token") == "t-3"
+    assert l2.gets == 3
+
+
+def test_async_stores():
+    async def check(store):
+        assert await store.get("token") is None
+        await store.set("token", "t-1", 7200)
+        assert await store.get("token") == "t-1"
+        assert 0 < await store.ttl("token") <= 7200
+
+    asyncio.run(check(AsyncMemoryStore()))
+    asyncio.run(check(SyncStoreAdapter(MemoryStore())))
+
+
+if __name__ == "__main__":
+    test_layered_store_reads_local_copy()
+    test_layered_store_reads_shared_store_near_expiry()
+    test_async_stores()
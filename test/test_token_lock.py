@@ -0,0 +1,236 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import secrets
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from feishu.client import FeishuClient
+from feishu.client.refresher import TokenRefresher
+from feishu.stores import TokenStore, MemoryStore, AsyncMemoryStore
+
+AUTH_API = "/auth/v3/tenant_access_token/internal/"
+PROCESSES = 6
+
+
+class FileStore(TokenStore):
+    """多进程共享的token_store替身, 用目录下的文件模拟Redis"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def set(self, key: str, value: str, expire: float = 7200):
+        tmp = os.path.join(self.path, f"{key}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"value": value, "expire_at": time.time() + expire}, f)
+        os.replace(tmp, os.path.join(self.path, key))
+
+    def get(self, key: str):
+        try:
+            with open(os.path.join(self.path, key)) as f:
+                item = json.load(f)
+        except FileNotFoundError:
+            return None
+        if item["expire_at"] < time.time():
+            return None
+        return item["value"]
+
+    def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        lock_id = secrets.token_hex(8)
+        try:
+            fd = os.open(os.path.join(self.path, key + ".lock"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        os.write(fd, lock_id.encode())
+        os.close(fd)
+        return lock_id
+
+    def release_lock(self, key: str, lock_id: str):
+        lock = os.path.join(self.path, key + ".lock")
+        with open(lock) as f:
+            if f.read() == lock_id:
+                os.remove(lock)
+
+
+class CountingClient(FeishuClient):
+    """每次请求token都往auth_calls文件里追加一行"""
+    auth_calls_path = ""
+
+    def _sync_request(self, method, url, **kwargs):
+        if url.endswith(AUTH_API):
+            with open(self.auth_calls_path, "a") as f:
+                f.write(f"{os.getpid()}\n")
+            time.sleep(0.2)
+            return {"code": 0, "msg": "ok", "tenant_access_token": f"t-{os.getpid()}", "expire": 7200}
+        return {"code": 0, "msg": "ok", "data": {}}
+
+
+def worker(store_path: str, auth_calls_path: str, barrier, results):
+    CountingClient.auth_calls_path = auth_calls_path
+    client = CountingClient(app_id="cli_xxx", app_secret="xxx", token_store=FileStore(store_path))
+    barrier.wait()
+    results.put(client.get_token())
+
+
+def test_single_refresh_across_processes():
+    with tempfile.TemporaryDirectory() as store_path:
+        auth_calls_path = os.path.join(store_path, "auth_calls")
+        barrier = multiprocessing.Barrier(PROCESSES)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(store_path, auth_calls_path, barrier, results))
+                     for _ in range(PROCESSES)]
+        for p in processes:
+            p.start()
+        tokens = [results.get(timeout=10) for _ in processes]
+        for p in processes:
+            p.join()
+
+        with open(auth_calls_path) as f:
+            auth_calls = f.read().split()
+
+    assert len(auth_calls) == 1
+    assert set(tokens) == {f"t-{auth_calls[0]}"}
+
+
+class LateWriterStore(MemoryStore):
+    """拿到锁之前, 另一个进程刚好刷新完token并释放了锁"""
+
+    def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        self.set(key, "t-other", 7200)
+        return "lock"
+
+
+class AsyncLateWriterStore(AsyncMemoryStore):
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        await self.set(key, "t-other", 7200)
+        return "lock"
+
+
+def test_reread_store_after_lock_sync():
+    auth_calls = []
+
+    def _sync_request(method, url, **kwargs):
+        auth_calls.append(url)
+        return {"code": 0, "msg": "ok", "tenant_access_token": "t-self", "expire": 7200}
+
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", token_store=LateWriterStore())
+    client._sync_request = _sync_request
+    assert client.get_token() == "t-other"
+    assert auth_calls == []
+
+
+def test_reread_store_after_lock_async():
+    auth_calls = []
+
+    async def _async_request(method, url, **kwargs):
+        auth_calls.append(url)
+        return {"code": 0, "msg": "ok", "tenant_access_token": "t-self", "expire": 7200}
+
+    loop = asyncio.new_event_loop()
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True, event_loop=loop,
+                          token_store=AsyncLateWriterStore())
+    client._async_request = _async_request
+    assert loop.run_until_complete(client.get_token()) == "t-other"
+    loop.close()
+    assert auth_calls == []
+
+
+class SharedStore(MemoryStore):
+    """多个client共享的store, 刷新锁同RedisStore"""
+
+    def __init__(self):
+        super().__init__()
+        self.locks = {}
+        self.mutex = threading.Lock()
+
+    def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        with self.mutex:
+            if key in self.locks:
+                return None
+            lock_id = self.locks[key] = secrets.token_hex(8)
+            return lock_id
+
+    def release_lock(self, key: str, lock_id: str):
+        with self.mutex:
+            if self.locks.get(key) == lock_id:
+                del self.locks[key]
+
+
+class AsyncSharedStore(AsyncMemoryStore):
+    def __init__(self):
+        super().__init__()
+        self.store = SharedStore()
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        return self.store.acquire_lock(key, ttl)
+
+    async def release_lock(self, key: str, lock_id: str):
+        self.store.release_lock(key, lock_id)
+
+
+def expired_store(store: MemoryStore) -> MemoryStore:
+    store.set("token", "t-old", 7200)
+    store.timings["token"] = time.time() - 1
+    return store
+
+
+def test_refreshers_share_lease_sync():
+    auth_calls = []
+
+    def _sync_request(method, url, **kwargs):
+        auth_calls.append(url)
+        time.sleep(0.1)
+        return {"code": 0, "msg": "ok", "tenant_access_token": "t-new", "expire": 7200}
+
+    store = expired_store(SharedStore())
+    refreshers = []
+    for _ in range(2):
+        client = FeishuClient(app_id="cli_xxx", app_secret="xxx", token_store=store)
+        client._sync_request = _sync_request
+        refreshers.append(TokenRefresher(client))
+
+    # 两个进程的刷新器同时醒来
+    with ThreadPoolExecutor(2) as executor:
+        list(executor.map(lambda refresher: refresher.refresh_sync(), refreshers))
+    # 先后醒来
+    assert all(refresher.refresh_sync() > 5000 for refresher in refreshers)
+    assert len(auth_calls) == 1
+    assert store.get("token") == "t-new"
+
+
+def test_refreshers_share_lease_async():
+    auth_calls = []
+
+    async def _async_request(method, url, **kwargs):
+        auth_calls.append(url)
+        await asyncio.sleep(0.05)
+        return {"code": 0, "msg": "ok", "tenant_access_token": "t-new", "expire": 7200}
+
+    async def main():
+        store = AsyncSharedStore()
+        expired_store(store.store)
+        refreshers = []
+        for _ in range(2):
+            client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True,
+                                  event_loop=asyncio.get_running_loop(), token_store=store)
+            client._async_request = _async_request
+            refreshers.append(TokenRefresher(client))
+        await asyncio.gather(*(refresher.refresh_async() for refresher in refreshers))
+        for refresher in refreshers:
+            assert await refresher.refresh_async() > 5000
+        assert await store.get("token") == "t-new"
+
+    asyncio.run(main())
+    assert len(auth_calls) == 1
+
+
+if __name__ == "__main__":
+    test_single_refresh_across_processes()
+    test_reread_store_after_lock_sync()
+    test_reread_store_after_lock_async()
+    test_refreshers_share_lease_sync()
+    test_refreshers_share_lease_async()
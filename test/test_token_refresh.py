@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from feishu import stores
+from feishu.client import FeishuClient
+from feishu.client.refresher import TokenRefresher
+from feishu.stores import TokenStore, AsyncMemoryStore
+
+AUTH_API = "/auth/v3/tenant_access_token/internal/"
+CONCURRENCY = 50
+
+
+class ExpiredStore(TokenStore):
+    """一开始就没有token的store, 模拟token已过期"""
+
+    def __init__(self):
+        self.cache = {}
+
+    def set(self, key: str, value: str, expire: float = 0):
+        self.cache[key] = value
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+
+def fake_result(url: str) -> dict:
+    if url.endswith(AUTH_API):
+        return {"code": 0, "msg": "ok", "tenant_access_token": "t-fresh", "expire": 7200}
+    return {"code": 0, "msg": "ok", "data": {"message_id": "om_xxx"}}
+
+
+def test_sync_single_flight():
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", token_store=ExpiredStore())
+    auth_calls = []
+    tokens = []
+
+    def _sync_request(method, url, headers, **kwargs):
+        if url.endswith(AUTH_API):
+            auth_calls.append(url)
+            time.sleep(0.05)
+        else:
+            tokens.append(headers["Authorization"])
+        return fake_result(url)
+
+    client._sync_request = _sync_request
+    barrier = threading.Barrier(CONCURRENCY)
+
+    def send():
+        barrier.wait()
+        client.request("GET", api="/im/v1/chats")
+
+    threads = [threading.Thread(target=send) for _ in range(CONCURRENCY)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(auth_calls) == 1
+    assert tokens == ["Bearer t-fresh"] * CONCURRENCY
+
+
+def run_async_single_flight(token_store):
+    loop = asyncio.new_event_loop()
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True, event_loop=loop,
+                          token_store=token_store)
+    auth_calls = []
+    tokens = []
+
+    async def _async_request(method, url, headers, **kwargs):
+        if url.endswith(AUTH_API):
+            auth_calls.append(url)
+            await asyncio.sleep(0.05)
+        else:
+            tokens.append(headers["Authorization"])
+        return fake_result(url)
+
+    client._async_request = _async_request
+    futures = [client.request("GET", api="/im/v1/chats") for _ in range(CONCURRENCY)]
+    loop.run_until_complete(asyncio.gather(*futures))
+    loop.close()
+
+    assert len(auth_calls) == 1
+    assert tokens == ["Bearer t-fresh"] * CONCURRENCY
+
+
+def test_async_single_flight():
+    # 同步store经过SyncStoreAdapter
+    run_async_single_flight(ExpiredStore())
+    # 原生异步store
+    run_async_single_flight(AsyncMemoryStore())
+
+
+def test_background_refresh():
+    refreshed = threading.Event()
+    reports = []
+
+    def on_token_refresh(latency, error):
+        reports.append((latency, error))
+        refreshed.set()
+
+    class FakeClient(FeishuClient):
+        def _sync_request(self, method, url, **kwargs):
+            return fake_result(url)
+
+    store = ExpiredStore()
+    client = FakeClient(app_id="cli_xxx", app_secret="xxx", token_store=store,
+                        refresh_token_in_background=True, on_token_refresh=on_token_refresh)
+
+    assert refreshed.wait(5)
+    client.token_refresher.stop()
+    client.token_refresher._thread.join(5)
+    assert store.get("token") == "t-fresh"
+    # 停止后的请求不会重新启动刷新线程
+    thread = client.token_refresher._thread
+    client.request("GET", "/test")
+    assert client.token_refresher._thread is thread and not thread.is_alive()
+    latency, error = reports[0]
+    assert latency >= 0 and error is None
+
+    # token_store中的token过期后(飞书开始发放新token)再加上随机抖动
+    delays = {client.token_refresher.next_delay(5400) for _ in range(10)}
+    assert all(5400 <= d <= 5400 + 300 for d in delays) and len(delays) > 1
+
+
+def test_background_refresh_async():
+    reports = []
+    fail = [True]
+
+    async def _async_request(method, url, payload, **kwargs):
+        if url.endswith(AUTH_API) and fail:
+            fail.pop()
+            raise RuntimeError("network down")
+        return fake_result(url)
+
+    async def main():
+        client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True,
+                              event_loop=asyncio.get_running_loop(), token_store=AsyncMemoryStore(),
+                              refresh_token_in_background=True,
+                              on_token_refresh=lambda latency, error: reports.append(error))
+        client._async_request = _async_request
+        refresher = client.token_refresher
+        refresher.retry_interval = 0.01
+        # 异步模式在第一次请求时才启动
+        assert not refresher.started
+        await client.request("GET", "/test", auth=False)
+        task = refresher._task
+        assert task is not None
+
+        # 第一次刷新失败后按retry_interval重试
+        for _ in range(100):
+            if len(reports) >= 2:
+                break
+            await asyncio.sleep(0.01)
+        assert isinstance(reports[0], RuntimeError) and reports[1] is None
+        assert await client.token_store.get("token") == "t-fresh"
+
+        refresher.stop()
+        await asyncio.sleep(0)
+        assert task.cancelled()
+        # 停止后的请求不会重新启动刷新task
+        await client.request("GET", "/test", auth=False)
+        assert refresher._task is task and refresher.started and refresher.stopped
+        await client.close()
+
+    asyncio.run(main())
+    assert len(reports) == 2
+
+
+class FeishuAuth:
+    """模拟飞书的token接口: 剩余有效期超过30分钟时返回同一个token, 否则发放新token"""
+
+    def __init__(self, clock: list):
+        self.clock = clock
+        self.tokens = []
+        self.expires_at = 0
+
+    def __call__(self, method, url, payload, **kwargs):
+        if self.expires_at - self.clock[0] < 1800:
+            self.tokens.append(f"t-{len(self.tokens)}")
+            self.expires_at = self.clock[0] + 7200
+        return {"code": 0, "msg": "ok", "tenant_access_token": self.tokens[-1],
+                "expire": int(self.expires_at - self.clock[0])}
+
+
+def test_refresh_schedule_gets_new_token(monkeypatch):
+    clock = [1e9]
+    monkeypatch.setattr(stores, "time", SimpleNamespace(time=lambda: clock[0]))
+    auth = FeishuAuth(clock)
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx")
+    client._sync_request = auth
+    refresher = TokenRefresher(client)
+
+    delay = refresher.first_delay(client.token_store.ttl("token"))
+    assert delay == 0
+    for _ in range(10):
+        clock[0] += delay
+        delay = refresher.next_delay(refresher.refresh_sync())
+        # 每次刷新都拿到新token, 不会因为拿到同一个token而缩短下次刷新的间隔
+        assert 5400 <= delay <= 5700
+    assert len(auth.tokens) == 10
+
+    # 其他进程刚刷新过时, 启动后不立刻刷新
+    other = TokenRefresher(client)
+    assert other.first_delay(client.token_store.ttl("token")) >= 5400
+
+    # 飞书返回的剩余有效期不足TOKEN_UPDATE_TIME时只缓存1秒
+    client.token_store.set("token", "t-short", 600)
+    assert client.token_store.ttl("token") == 1
+
+
+if __name__ == "__main__":
+    test_sync_single_flight()
+    test_async_single_flight()
+    test_background_refresh()
+    test_background_refresh_async()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from feishu.client import FeishuClient, client as client_module
+
+AUTH_API = "/auth/v3/tenant_access_token/internal/"
+MESSAGES_API = "/im/v1/messages"
+TOKEN = "t-secret-token"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path.startswith(AUTH_API):
+            result = {"code": 0, "msg": "ok", "tenant_access_token": TOKEN, "expire": 7200}
+        elif self.headers["Authorization"] != f"Bearer {TOKEN}":
+            result = {"code": 99991663, "msg": "invalid token"}
+        else:
+            result = {"code": 0, "msg": "ok", "data": {"message_id": "om_xxx"}}
+        content = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_traces(traces: list):
+    assert [(t.method, t.path, t.status, t.code) for t in traces] == [
+        ("POST", AUTH_API, 200, 0),
+        ("POST", MESSAGES_API, 200, 0),
+    ]
+    for trace in traces:
+        assert trace.request_bytes > 0 and trace.response_bytes > 0
+        assert 0 < trace.ttfb <= trace.total
+        assert trace.error is None
+
+
+def test_trace_sync(caplog):
+    server = start_server()
+    traces = []
+    client = FeishuClient(app_id="cli_xxx", app_secret="app-secret", on_request=traces.append,
+                          endpoint=f"http://127.0.0.1:{server.server_port}")
+    with caplog.at_level(logging.DEBUG, logger="feishu"):
+        assert client.send_text("hello", "ou_xxx") == "om_xxx"
+    server.shutdown()
+
+    check_traces(traces)
+    # 同步模式下没有DNS解析和建立连接的耗时
+    assert traces[0].dns is None and traces[0].connect is None
+    # token和secret不会出现在日志中
+    assert "Bearer ***" in caplog.text or "'Authorization': '***'" in caplog.text
+    assert TOKEN not in caplog.text and "app-secret" not in caplog.text
+
+
+def test_trace_async():
+    server = start_server()
+    loop = asyncio.new_event_loop()
+    traces = []
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", run_async=True, event_loop=loop,
+                          on_request=traces.append, endpoint=f"http://127.0.0.1:{server.server_port}")
+    assert loop.run_until_complete(client.send_text("hello", "ou_xxx")) == "om_xxx"
+    loop.run_until_complete(client.close())
+    loop.close()
+    server.shutdown()
+
+    check_traces(traces)
+    # 第一个请求新建连接, 第二个复用连接
+    assert traces[0].connect > 0 and traces[1].connect == 0
+    assert traces[0].dns >= 0
+
+
+def test_no_formatting_without_debug(monkeypatch):
+    class Secrets:
+        @staticmethod
+        def token_hex(n):
+            raise AssertionError("debug关闭时不应生成请求id")
+
+    server = start_server()
+    monkeypatch.setattr(client_module, "secrets", Secrets)
+    client = FeishuClient(app_id="cli_xxx", app_secret="xxx", endpoint=f"http://127.0.0.1:{server.server_port}")
+    logger = logging.getLogger("feishu")
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    try:
+        assert client.send_text("hello", "ou_xxx") == "om_xxx"
+    finally:
+        logger.setLevel(level)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_trace_async()